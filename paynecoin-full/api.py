@@ -1,60 +1,144 @@
-import requests
-from flask import Flask, jsonify, request
+from flask import Flask, Response, jsonify, request
+from flask.json.provider import DefaultJSONProvider
+from block_store import BlockStore
 from blockchain import Blockchain
 from blockchain import Wallets
+from blockchain import HISTORY_PAGE, SYNC_BATCH
+from blockchain import well_formed_block, well_formed_transaction
+from gossip import Gossip
+from merkle import transaction_hash
+from miner import Miner
+from time import time_ns
 from uuid import uuid4
 
 MINING_REWARD = 1
+# Number of blocks between two snapshots of the wallets of a chain kept on disk
+SNAPSHOT_INTERVAL = 1000
+
+
+class JSONProvider(DefaultJSONProvider):
+    """Serialize Blocks and Transactions as the dicts they convert to, and
+    BlockStores as lists"""
+
+    @staticmethod
+    def default(o):
+        if hasattr(o, "to_dict"):
+            return o.to_dict()
+        if isinstance(o, BlockStore):
+            return list(o)
+        return DefaultJSONProvider.default(o)
+
 
 # Instantiate the Node
 app = Flask(__name__)
+app.json = JSONProvider(app)
 app.config["JSONIFY_PRETTYPRINT_REGULAR"] = False
+# Number of processes used to search for the proof of work
+app.config["MINING_WORKERS"] = 1
 
-# Instantiate the Blockchain and Wallets
+# Instantiate the Blockchain and Wallets, and gossip with the neighbors.
+# Requests are served by several threads, which hold `blockchain.lock` while
+# they read or update the chain, the mempool or the wallets.
 blockchain = Blockchain()
 wallets = Wallets()
+wallets.sync(blockchain.chain)
+gossip = Gossip(blockchain)
 
 
-@app.route("/mine", methods=["GET"])
-def mine():
-    # We run the proof of work algorithm to get the next proof...
-    last_block = blockchain.last_block
-    proof = blockchain.proof_of_work(last_block)
+def forge_block(proof, previous_hash):
+    """
+    Add the block of a proof found by a mining job to the chain, rewarding
+    this node. Hold `blockchain.lock`.
+    :return: The new block, or None if the chain no longer ends with the block
+        the proof was searched for
+    """
+
+    # The proof only extends the block it was searched for
+    if blockchain.hash(blockchain.last_block) != previous_hash:
+        return None
 
     # We must receive a reward for finding the proof.
     # The sender is "0" to signify that this node has mined a new coin.
-    sender = "0"
-    amount = MINING_REWARD
-    blockchain.new_transaction(
-        sender=sender,
-        recipient=node_uuid,
-        amount=amount,
-    )
-    wallets.wallet_update(node_uuid, amount)
+    reward = {
+        "sender": "0",
+        "recipient": node_uuid,
+        "amount": MINING_REWARD,
+        "timestamp": time_ns(),
+    }
+    # The reward comes first in the mempool, and may evict a transaction
+    drop_evicted(blockchain.add_transaction(reward))
 
     # Forge the new Block by adding it to the chain
-    previous_hash = blockchain.hash(last_block)
-    block = blockchain.new_block(proof, previous_hash)
+    try:
+        block = blockchain.new_block(proof, previous_hash)
+    except Exception:
+        # The next job adds a reward of its own
+        blockchain.mempool.remove(transaction_hash(reward))
+        raise
+    sync_wallets()
+    gossip.see(blockchain.hash(block))
+    gossip.announce(blocks=[block])
+
+    chain = blockchain.chain
+    if (
+        isinstance(chain, BlockStore)
+        and len(chain) - wallets.snapshot_height >= SNAPSHOT_INTERVAL
+    ):
+        wallets.take_snapshot(chain)
+    return block
+
+
+# The proof of work is searched in the background, by worker processes, so
+# other requests are served while mining
+miner = Miner(blockchain, forge_block)
+
 
+@app.route("/mine", methods=["GET"])
+def mine():
+    job, started = miner.start(app.config["MINING_WORKERS"])
     response = {
-        "message": "New Block Forged",
-        "index": block["index"],
-        "transactions": block["transactions"],
-        "proof": block["proof"],
-        "previous_hash": block["previous_hash"],
+        "message": "Mining started" if started else "Already mining",
+        "job": job.to_dict(),
     }
+    return jsonify(response), 202 if started else 200
+
+
+@app.route("/mine/status", methods=["GET"])
+def mine_status():
+    job = miner.job
+    if job is None:
+        return "Error: Nothing mined yet", 404
+    with blockchain.lock:
+        response = job.to_dict()
+    return jsonify(response), 200
+
+
+@app.route("/mine/cancel", methods=["POST"])
+def mine_cancel():
+    job = miner.cancel()
+    if job is None:
+        return "Error: Not mining", 404
+    with blockchain.lock:
+        response = job.to_dict()
     return jsonify(response), 200
 
 
 @app.route("/wallets", methods=["GET"])
 def full_wallets():
-    response = wallets.wallets
+    with blockchain.lock:
+        response = wallets.summaries()
     return jsonify(response), 200
 
 
 @app.route("/wallets/<uuid>", methods=["GET"], strict_slashes=False)
 def route_wallets_get(uuid):
-    response = wallets.wallets_get(uuid=uuid)
+    offset = request.args.get("offset", 0, type=int)
+    limit = min(request.args.get("limit", HISTORY_PAGE, type=int), HISTORY_PAGE)
+    with blockchain.lock:
+        wallet = wallets.wallets_get(uuid=uuid)
+        if wallet is None:
+            return jsonify(None)
+        response = wallet.history(max(offset, 0), max(limit, 0))
     return jsonify(response)
 
 
@@ -64,52 +148,290 @@ def route_wallets_get(uuid):
 @app.route("/wallets/new/<uuid>", methods=["GET"], strict_slashes=False)
 def route_wallets_new(uuid):
     uuid = uuid if uuid is not None else str(uuid4().hex)
-    response = wallets.wallet_create(uuid=uuid)
+    with blockchain.lock:
+        wallets.wallet_create(uuid=uuid)
+        response = wallets.summaries()
     return jsonify(response)
 
 
 @app.route("/wallets/update/<uuid>", methods=["GET"])
 def route_wallets_update(uuid):
+    with blockchain.lock:
+        wallet = wallets.wallet_update(uuid).summary()
     response = {
         "message": "Wallet updated",
         "uuid": uuid,
-        "wallet": wallets.wallet_update(uuid),
+        "wallet": wallet,
     }
     return jsonify(response)
 
 
 @app.route("/transaction", methods=["POST"])
 def new_transaction():
-    values = request.get_json()
-    print(values)
+    values = request.get_json(silent=True)
 
     # Check that the required fields are in the POSTed data
     required = ["sender", "recipient", "amount"]
-    if not all(k in values for k in required):
+    if not isinstance(values, dict) or not all(k in values for k in required):
         return "Missing values", 400
 
     # Create a new Transaction
-    index = blockchain.new_transaction(
-        values["sender"], values["recipient"], values["amount"]
-    )
-
-    # Update wallets
-    wallets.wallet_update(values["sender"], -values["amount"])
-    wallets.wallet_update(values["recipient"], values["amount"])
+    tx = {
+        "sender": values["sender"],
+        "recipient": values["recipient"],
+        "amount": values["amount"],
+        "timestamp": values.get("timestamp", time_ns()),
+    }
+    if not well_formed_transaction(tx):
+        return "Error: Malformed transaction", 400
+    try:
+        with blockchain.lock:
+            index = add_transaction(tx)
+            # Drop the transaction when neighbors announce it back
+            gossip.see(transaction_hash(tx))
+    except ValueError as e:
+        return f"Error: {e}", 400
 
     response = {"message": f"Transaction will be added to Block {index}"}
     return jsonify(response), 201
 
 
-@app.route("/chain", methods=["GET"])
-def full_chain():
+def add_transaction(tx):
+    """Add a transaction, update the wallets and announce it to neighbors.
+    Hold `blockchain.lock`.
+    :raise ValueError: If the mempool does not take it"""
+    evicted = blockchain.add_transaction(tx)
+    try:
+        wallets.add_pending(tx)
+    except Exception:
+        # Keep the mempool and the pending balances in step
+        blockchain.mempool.remove(transaction_hash(tx))
+        wallets.pending.pop(transaction_hash(tx), None)
+        raise
+    drop_evicted(evicted)
+    gossip.announce(transactions=[tx])
+    return blockchain.last_block["index"] + 1
+
+
+def drop_evicted(evicted):
+    """Stop counting transactions evicted from the mempool in the pending
+    balances, since they will not be mined. Hold `blockchain.lock`."""
+    for tx in evicted:
+        wallets.remove_pending(transaction_hash(tx))
+
+
+def sync_wallets(dropped=()):
+    """Bring the wallets up to date with the chain. Transactions of blocks
+    dropped by a switch to another chain are pending again. Hold
+    `blockchain.lock`.
+    :param dropped: The transactions dropped with our blocks, see
+        `Blockchain.replace_chain`, which include those of blocks older than
+        the undo log of the wallets"""
+    pending = {}
+    for tx in list(dropped) + wallets.sync(blockchain.chain):
+        pending.setdefault(transaction_hash(tx), tx)
+    for tx in pending.values():
+        try:
+            add_transaction(tx)
+        except ValueError:
+            pass
+
+
+@app.route("/gossip", methods=["POST"])
+def receive_gossip():
+    values = request.get_json(silent=True)
+    if not isinstance(values, dict):
+        return "Error: Please supply a JSON object", 400
+
+    transactions = values.get("transactions", [])
+    blocks = values.get("blocks", [])
+    if not (isinstance(transactions, list) and isinstance(blocks, list)):
+        return "Error: Please supply lists of transactions and blocks", 400
+    if not (
+        all(well_formed_transaction(tx) for tx in transactions)
+        and all(well_formed_block(block) for block in blocks)
+    ):
+        return "Error: Malformed transaction or block", 400
+
+    # Drop what we have seen, so that each announcement crosses us once
+    transactions = [tx for tx in transactions if gossip.see(transaction_hash(tx))]
+    blocks = [block for block in blocks if gossip.see(blockchain.hash(block))]
+
+    added = 0
+    accepted = []
+    behind = False
+    with blockchain.lock:
+        for tx in transactions:
+            try:
+                add_transaction(tx)
+            except ValueError:
+                # Take it if it comes again, once it may fit
+                gossip.forget(transaction_hash(tx))
+                continue
+            added += 1
+
+        for block in sorted(blocks, key=lambda block: block["index"]):
+            if blockchain.add_block(block):
+                accepted.append(block)
+            elif block["index"] > blockchain.last_block["index"]:
+                behind = True
+        sync_wallets()
+        # Stop mining on a block that is no longer the tip
+        miner.tip_changed()
+    gossip.announce(blocks=accepted)
+
+    # A block we cannot link comes from a longer chain, which we download
+    if behind and resolve()[0]:
+        with blockchain.lock:
+            gossip.announce(blocks=[blockchain.last_block])
+
+    with blockchain.lock:
+        length = len(blockchain.chain)
     response = {
-        "chain": blockchain.chain,
-        "length": len(blockchain.chain),
+        "transactions": added,
+        "blocks": len(accepted),
+        "length": length,
     }
     return jsonify(response), 200
 
 
+@app.route("/mempool", methods=["GET"])
+def mempool_stats():
+    with blockchain.lock:
+        response = blockchain.mempool.stats()
+    return jsonify(response), 200
+
+
+@app.route("/mempool/transactions", methods=["GET"])
+def mempool_transactions():
+    limit = request.args.get("limit", 100, type=int)
+    with blockchain.lock:
+        response = {
+            "transactions": blockchain.mempool.peek(max(limit, 0)),
+            "count": len(blockchain.mempool),
+        }
+    return jsonify(response), 200
+
+
+@app.route("/chain", methods=["GET"])
+def full_chain():
+    start = max(request.args.get("from", 0, type=int), 0)
+    limit = request.args.get("limit", None, type=int)
+    ndjson = request.args.get("format") == "ndjson"
+
+    # Stream the chain one block at a time, so that a chain kept in a
+    # BlockStore is never loaded into memory whole, and the lock is not held
+    # while the client reads
+    with blockchain.lock:
+        chain = blockchain.chain
+        length = len(chain)
+    stop = length if limit is None else min(start + max(limit, 0), length)
+
+    def stream():
+        for position in range(start, stop):
+            with blockchain.lock:
+                # The chain may have been cut short by a switch to another one
+                if position >= len(chain):
+                    return
+                block = chain[position]
+            yield app.json.dumps(block)
+
+    if ndjson:
+        # One block per line, which a client can parse as it arrives
+        lines = (block + "\n" for block in stream())
+        headers = {"X-Chain-Length": str(length)}
+        return Response(lines, mimetype="application/x-ndjson", headers=headers), 200
+
+    def generate():
+        yield '{"chain":['
+        for count, block in enumerate(stream()):
+            yield ("," if count else "") + block
+        yield f'],"from":{start},"length":{length}}}\n'
+
+    return Response(generate(), mimetype="application/json"), 200
+
+
+@app.route("/chain/tip", methods=["GET"])
+def chain_tip():
+    with blockchain.lock:
+        response = {
+            "length": len(blockchain.chain),
+            "hash": blockchain.hash(blockchain.last_block),
+        }
+    return jsonify(response), 200
+
+
+@app.route("/chain/locate", methods=["POST"])
+def chain_locate():
+    values = request.get_json()
+
+    locator = values.get("locator")
+    if not isinstance(locator, list):
+        return "Error: Please supply a locator", 400
+
+    with blockchain.lock:
+        response = {
+            "fork": blockchain.locate_fork(locator),
+            "length": len(blockchain.chain),
+        }
+    return jsonify(response), 200
+
+
+@app.route("/headers", methods=["GET"])
+def headers_from():
+    start = request.args.get("from", 0, type=int)
+    limit = min(request.args.get("limit", SYNC_BATCH, type=int), SYNC_BATCH)
+    with blockchain.lock:
+        response = {
+            "headers": blockchain.headers(max(start, 0), max(limit, 0)),
+            "length": len(blockchain.chain),
+        }
+    return jsonify(response), 200
+
+
+@app.route("/blocks", methods=["GET"])
+def blocks_from():
+    start = request.args.get("from", 0, type=int)
+    limit = min(request.args.get("limit", SYNC_BATCH, type=int), SYNC_BATCH)
+    with blockchain.lock:
+        response = {
+            "blocks": blockchain.blocks(max(start, 0), max(limit, 0)),
+            "length": len(blockchain.chain),
+        }
+        return jsonify(response), 200
+
+
+@app.route("/blocks/<int:index>", methods=["GET"])
+def block_at(index):
+    with blockchain.lock:
+        if not 1 <= index <= len(blockchain.chain):
+            return "Error: Unknown block", 404
+        response = blockchain.chain[index - 1]
+        return jsonify(response), 200
+
+
+@app.route("/blocks/<block_hash>", methods=["GET"])
+def block_with_hash(block_hash):
+    with blockchain.lock:
+        height = blockchain.height_of(block_hash)
+        if height is None:
+            return "Error: Unknown block", 404
+        response = blockchain.chain[height - 1]
+        return jsonify(response), 200
+
+
+@app.route("/blocks/<int:index>/proof/<int:position>", methods=["GET"])
+def transaction_proof(index, position):
+    with blockchain.lock:
+        if not 1 <= index <= len(blockchain.chain):
+            return "Error: Unknown block", 404
+        if not 0 <= position < len(blockchain.chain[index - 1]["transactions"]):
+            return "Error: Unknown transaction", 404
+
+        response = blockchain.transaction_proof(index, position)
+    return jsonify(response), 200
+
+
 @app.route("/nodes/register", methods=["POST"])
 def register_nodes():
     values = request.get_json()
@@ -118,35 +440,49 @@ def register_nodes():
     if nodes is None:
         return "Error: Please supply a valid list of nodes", 400
 
-    for node in nodes:
-        blockchain.add_node(node)
+    with blockchain.lock:
+        for node in nodes:
+            blockchain.add_node(node)
+        total_nodes = list(blockchain.nodes)
 
     response = {
         "message": "New nodes have been added",
-        "total_nodes": list(blockchain.nodes),
+        "total_nodes": total_nodes,
     }
     return jsonify(response), 201
 
 
 @app.route("/nodes/register", methods=["GET"])
 def register_nodes_get():
-    response = list(blockchain.nodes)
+    with blockchain.lock:
+        response = list(blockchain.nodes)
     return jsonify(response), 201
 
 
-@app.route("/nodes/resolve", methods=["GET"])
-def consensus():
-    # Update longest chain
-    replaced, neighbor = blockchain.resolve_conflicts()
-    # If a longer chain was found, update wallets with that node's transactions
+def resolve():
+    """Switch to the longest chain of the neighbors, and bring the wallets up
+    to date with it"""
+    # Update longest chain, which takes the lock itself
+    replaced, neighbor, dropped = blockchain.resolve_conflicts()
     if replaced:
-        response = {"message": "Our chain was replaced", "new_chain": blockchain.chain}
-        updated_wallets = requests.get(f"http://{neighbor}/wallets").json()
-        wallets.wallets = updated_wallets.copy()
+        with blockchain.lock:
+            sync_wallets(dropped)
+            miner.tip_changed()
+    return replaced, neighbor
 
-    else:
-        response = {"message": "Our chain is authoritative", "chain": blockchain.chain}
 
+@app.route("/nodes/resolve", methods=["GET"])
+def consensus():
+    replaced, neighbor = resolve()
+    with blockchain.lock:
+        # The chain itself can be paged through with /blocks
+        response = {
+            "message": (
+                "Our chain was replaced" if replaced else "Our chain is authoritative"
+            ),
+            "length": len(blockchain.chain),
+            "hash": blockchain.hash(blockchain.last_block),
+        }
     return jsonify(response), 200
 
 
@@ -160,9 +496,53 @@ if __name__ == "__main__":
     parser.add_argument(
         "-u", "--uuid", default=None, type=str, help="unique identifier for node"
     )
+    parser.add_argument(
+        "-w",
+        "--workers",
+        default=1,
+        type=int,
+        help="number of processes to mine with (0 for one per CPU)",
+    )
+    parser.add_argument(
+        "-d",
+        "--data-dir",
+        default=None,
+        type=str,
+        help="directory to keep the chain in across restarts",
+    )
+    parser.add_argument(
+        "--production",
+        action="store_true",
+        help="serve with waitress instead of the Flask development server",
+    )
+    parser.add_argument(
+        "-t",
+        "--threads",
+        default=8,
+        type=int,
+        help="number of threads serving requests in production",
+    )
     args = parser.parse_args()
     port = args.port
+    app.config["MINING_WORKERS"] = args.workers or None
+    if args.data_dir is not None:
+        blockchain = Blockchain(store=BlockStore(args.data_dir))
+        wallets = Wallets()
+        wallets.restore(blockchain.chain)
+        gossip = Gossip(blockchain)
+        # The miner must mine on, and lock, the chain kept on disk
+        miner = Miner(blockchain, forge_block)
     # Generate a globally unique address for this node if none is specified
     node_uuid = args.uuid if args.uuid is not None else str(uuid4().hex)
 
-    app.run(host="0.0.0.0", port=port)
+    if args.production:
+        try:
+            import waitress
+        except ImportError:
+            parser.error(
+                "--production needs waitress: poetry install -E production,"
+                " or pip install waitress"
+            )
+        waitress.serve(app, host="0.0.0.0", port=port, threads=args.threads)
+    else:
+        app.run(host="0.0.0.0", port=port, threaded=True)
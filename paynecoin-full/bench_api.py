@@ -0,0 +1,130 @@
+"""Measure how many transactions a node accepts per second
+
+Starts a node in this process on a free port, with the Flask development server
+or with waitress, unless `--url` points to a running one. Then `--concurrency`
+threads POST `--requests` transactions to `/transaction` between them, each on
+its own keep-alive connection, and the throughput and latency percentiles are
+printed. With `--mine`, another thread calls `/mine` in a loop meanwhile, to
+check that mining does not hold up the other requests.
+"""
+
+from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import socket
+import statistics
+import threading
+import time
+
+import requests
+
+
+def start_server(production, threads):
+    """Serve the node in a daemon thread
+    :return: The URL of the node"""
+    import api
+
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    api.node_uuid = "bench"
+    if production:
+        from waitress.server import create_server
+
+        server = create_server(api.app, host="127.0.0.1", port=port, threads=threads)
+        serve = server.run
+    else:
+        from werkzeug.serving import make_server
+
+        logging.getLogger("werkzeug").setLevel(logging.WARNING)
+        server = make_server("127.0.0.1", port, api.app, threaded=True)
+        serve = server.serve_forever
+    threading.Thread(target=serve, daemon=True).start()
+    return f"http://127.0.0.1:{port}"
+
+
+def post_transactions(url, start, count):
+    """POST `count` transactions from one connection
+    :return: The latency of each request, in seconds"""
+    latencies = []
+    with requests.Session() as session:
+        for i in range(start, start + count):
+            tx = {"sender": "bench", "recipient": f"r{i}", "amount": 1}
+            start_time = time.perf_counter()
+            response = session.post(f"{url}/transaction", json=tx)
+            latencies.append(time.perf_counter() - start_time)
+            response.raise_for_status()
+    return latencies
+
+
+def mine(url, stop):
+    """Mine until `stop` is set
+    :return: The number of blocks mined"""
+    blocks = 0
+    with requests.Session() as session:
+        while not stop.is_set():
+            job = session.get(f"{url}/mine").json()["job"]
+            while job["status"] == "running" and not stop.is_set():
+                time.sleep(0.05)
+                job = session.get(f"{url}/mine/status").json()
+            blocks += job["status"] == "mined"
+    return blocks
+
+
+def main(url, total, concurrency, mining):
+    stop = threading.Event()
+    with ThreadPoolExecutor(concurrency + 1) as executor:
+        miner = executor.submit(mine, url, stop) if mining else None
+        per_thread = total // concurrency
+        start_time = time.perf_counter()
+        futures = [
+            executor.submit(post_transactions, url, i * per_thread, per_thread)
+            for i in range(concurrency)
+        ]
+        latencies = sorted(x for future in futures for x in future.result())
+        elapsed = time.perf_counter() - start_time
+        stop.set()
+        blocks = miner.result() if miner else 0
+
+    quantiles = statistics.quantiles(latencies, n=100)
+    print(
+        f"{len(latencies):,} transactions from {concurrency} connections"
+        f" in {elapsed:.2f}s: {len(latencies) / elapsed:,.0f} requests/s,"
+        f" p50 {quantiles[49] * 1000:.1f}ms, p99 {quantiles[98] * 1000:.1f}ms"
+        + (f", {blocks} blocks mined meanwhile" if mining else "")
+    )
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument(
+        "--url", default=None, type=str, help="node to load, instead of starting one"
+    )
+    parser.add_argument(
+        "--production",
+        action="store_true",
+        help="start the node with waitress instead of the Flask development server",
+    )
+    parser.add_argument(
+        "-t", "--threads", default=8, type=int, help="threads of the waitress server"
+    )
+    parser.add_argument(
+        "-n", "--requests", default=5000, type=int, help="number of transactions"
+    )
+    parser.add_argument(
+        "-c", "--concurrency", default=8, type=int, help="number of connections"
+    )
+    parser.add_argument(
+        "--mine", action="store_true", help="mine blocks during the benchmark"
+    )
+    args = parser.parse_args()
+    if args.production and args.url is None:
+        try:
+            import waitress
+        except ImportError:
+            parser.error(
+                "--production needs waitress: poetry install -E production,"
+                " or pip install waitress"
+            )
+    url = args.url or start_server(args.production, args.threads)
+    main(url, args.requests, args.concurrency, args.mine)
@@ -0,0 +1,265 @@
+"""Compact blocks and transactions that remember their own hash
+
+A chain holds far more transactions than blocks, and a dict per transaction
+costs several times the memory of its fields. `Block` and `Transaction` keep
+their usual fields in `__slots__`, and any other field in an `extra` dict that
+is only created when needed. Fields can be read as attributes (`tx.amount`) or
+as items (`tx["amount"]`): both classes are mutable mappings, so they are used
+like the dicts they replace. `to_dict` gives back the plain dict and JSON shape,
+and `Block(block_dict)` converts the other way, without loss.
+
+A Block caches its serialized header and its hash (see `Blockchain.hash`), and
+a Transaction caches the digest of its Merkle leaf (see
+`merkle.transaction_hash`), but not its serialized bytes, which would take more
+memory than the Transaction itself. Modifying either clears its caches, and
+modifying a transaction inside a block clears the caches of the block as well.
+
+`Block.mutations` counts every modification of any Block. A cache built from
+verified blocks can compare it with the count it saw when the blocks were
+verified to notice that one of them has been tampered with since.
+"""
+
+from collections.abc import MutableMapping
+
+_set = object.__setattr__
+_delete = object.__delattr__
+
+
+class _Record(MutableMapping):
+    """A mutable mapping that stores its usual fields in slots"""
+
+    __slots__ = ("extra",)
+
+    # The fields stored in slots, in iteration order. An unset slot is a
+    # missing field.
+    fields = ()
+    field_set = frozenset()
+
+    def __init__(self, *args, **kwargs):
+        _set(self, "extra", None)
+        for key, value in dict(*args, **kwargs).items():
+            self._store(key, value)
+
+    def invalidate(self):
+        """Forget the cached values after a modification"""
+        raise NotImplementedError
+
+    def _store(self, key, value):
+        """Set a field without invalidating the caches"""
+        if key in self.field_set:
+            _set(self, key, value)
+        elif self.extra is None:
+            _set(self, "extra", {key: value})
+        else:
+            self.extra[key] = value
+
+    def __getitem__(self, key):
+        if key in self.field_set:
+            try:
+                return getattr(self, key)
+            except AttributeError:
+                pass
+        elif self.extra is not None and key in self.extra:
+            return self.extra[key]
+        raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        self._store(key, value)
+        self.invalidate()
+
+    def __delitem__(self, key):
+        if key in self.field_set:
+            try:
+                _delete(self, key)
+            except AttributeError:
+                raise KeyError(key) from None
+        elif self.extra is not None and key in self.extra:
+            del self.extra[key]
+        else:
+            raise KeyError(key)
+        self.invalidate()
+
+    def __setattr__(self, name, value):
+        if name in self.field_set:
+            self[name] = value
+        else:
+            _set(self, name, value)
+
+    def __delattr__(self, name):
+        if name in self.field_set:
+            del self[name]
+        else:
+            _delete(self, name)
+
+    def __contains__(self, key):
+        if key in self.field_set:
+            return hasattr(self, key)
+        return self.extra is not None and key in self.extra
+
+    def __iter__(self):
+        for key in self.fields:
+            if hasattr(self, key):
+                yield key
+        if self.extra:
+            yield from self.extra
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __repr__(self):
+        return f"{type(self).__name__}({self.to_dict()!r})"
+
+    def __reduce__(self):
+        # Pickle as a plain dict, the caches are rebuilt
+        return (type(self), (self.to_dict(),))
+
+    def to_dict(self):
+        """Convert to the plain dict shape
+        :return: <dict>"""
+        return {key: self[key] for key in self}
+
+
+class Transaction(_Record):
+    __slots__ = (
+        "sender",
+        "receiver",
+        "recipient",
+        "amount",
+        "timestamp",
+        "signature",
+        "block",
+        "cached_digest",
+    )
+
+    # paynecoin-full calls the receiver "recipient"
+    fields = ("sender", "receiver", "recipient", "amount", "timestamp", "signature")
+    field_set = frozenset(fields)
+
+    def __init__(self, *args, **kwargs):
+        # The Block holding this transaction, if any
+        _set(self, "block", None)
+        _set(self, "cached_digest", None)
+        super().__init__(*args, **kwargs)
+
+    def invalidate(self):
+        _set(self, "cached_digest", None)
+        if self.block is not None:
+            self.block.invalidate()
+
+
+class Block(_Record):
+    __slots__ = (
+        "index",
+        "timestamp",
+        "transactions",
+        "total_transactions",
+        "merkle_root",
+        "proof",
+        "nonce",
+        "previous_hash",
+        "cached_header",
+        "cached_hash",
+    )
+
+    # paynecoin-lite blocks have a "nonce", paynecoin-full blocks have a
+    # "proof" and "total_transactions"
+    fields = (
+        "nonce",
+        "index",
+        "timestamp",
+        "transactions",
+        "total_transactions",
+        "merkle_root",
+        "proof",
+        "previous_hash",
+    )
+    field_set = frozenset(fields)
+
+    # Number of modifications made to any Block since the program started
+    mutations = 0
+
+    def __init__(self, *args, **kwargs):
+        _set(self, "cached_header", None)
+        _set(self, "cached_hash", None)
+        super().__init__(*args, **kwargs)
+
+    def invalidate(self):
+        _set(self, "cached_header", None)
+        _set(self, "cached_hash", None)
+        Block.mutations += 1
+
+    def _store(self, key, value):
+        if key == "transactions":
+            value = _track_transactions(value, self)
+        super()._store(key, value)
+
+    def to_dict(self):
+        block = super().to_dict()
+        if "transactions" in block:
+            block["transactions"] = [tx.to_dict() for tx in self.transactions]
+        return block
+
+
+def _own_transaction(tx, block):
+    """Convert a transaction into a Transaction held by `block`"""
+    if not (isinstance(tx, Transaction) and tx.block is block):
+        tx = Transaction(tx)
+        _set(tx, "block", block)
+    return tx
+
+
+class _TrackedList(list):
+    """The transaction list of a Block"""
+
+    __slots__ = ("block",)
+
+    def __setitem__(self, index, value):
+        if isinstance(index, slice):
+            value = [_own_transaction(tx, self.block) for tx in value]
+        else:
+            value = _own_transaction(value, self.block)
+        list.__setitem__(self, index, value)
+        self.block.invalidate()
+
+    def __iadd__(self, transactions):
+        self.extend(transactions)
+        return self
+
+    def append(self, tx):
+        list.append(self, _own_transaction(tx, self.block))
+        self.block.invalidate()
+
+    def insert(self, index, tx):
+        list.insert(self, index, _own_transaction(tx, self.block))
+        self.block.invalidate()
+
+    def extend(self, transactions):
+        list.extend(self, [_own_transaction(tx, self.block) for tx in transactions])
+        self.block.invalidate()
+
+    def __reduce__(self):
+        return (list, ([tx.to_dict() for tx in self],))
+
+
+def _notify(method):
+    """Wrap a mutating method so that it invalidates the owning Block"""
+
+    def wrapper(self, *args, **kwargs):
+        result = method(self, *args, **kwargs)
+        self.block.invalidate()
+        return result
+
+    wrapper.__name__ = method.__name__
+    return wrapper
+
+
+for _name in ("__delitem__", "__imul__", "pop", "remove", "clear", "sort", "reverse"):
+    setattr(_TrackedList, _name, _notify(getattr(list, _name)))
+
+
+def _track_transactions(transactions, block):
+    """Copy a list of transactions into a tracked list owned by `block`"""
+    tracked = _TrackedList()
+    tracked.block = block
+    list.extend(tracked, [_own_transaction(tx, block) for tx in transactions])
+    return tracked
@@ -0,0 +1,231 @@
+"""Append-only storage of a chain on disk
+
+A `BlockStore` keeps a chain in two files of a directory:
+
+- `blocks.dat`, the block log: a magic header followed by one record per block,
+  made of the 4-byte length and 4-byte CRC-32 of the block, and the block
+  itself serialized with `serialization.encode`
+- `blocks.idx`, the offset index: the 8-byte offset of each record in the log
+
+Blocks are only ever appended, except when a node switches to a competing chain
+and `truncate` drops the blocks after the fork. Appended blocks are written
+right away, but only flushed to disk with fsync every `sync_every` blocks, or by
+`sync` and `close`, since an fsync per block would limit a node to a few hundred
+blocks per second. A crash loses at most the unsynced blocks.
+
+Blocks are read through a read-only memory map of the log, so iterating over a
+store decodes one block at a time and never loads the whole chain into memory.
+A `BlockStore` is a sequence of Blocks that can stand in for the `chain` list of
+a `Blockchain`. The last block is kept in memory; other Blocks read from the
+store are fresh copies, and modifying them does not change the store.
+
+Opening a store recovers from a crash in the middle of an append: a torn or
+corrupt final record is truncated, index entries past the end of the log are
+dropped, and records missing from the index are indexed again.
+"""
+
+from array import array
+import mmap
+import os
+import struct
+import sys
+import zlib
+
+from block import Block
+from serialization import decode, encode
+
+MAGIC = b"PAYNBLK1"
+DATA_FILE = "blocks.dat"
+INDEX_FILE = "blocks.idx"
+
+_record_header = struct.Struct(">II")
+_offset = struct.Struct("<Q")
+
+
+class BlockStore:
+    def __init__(self, directory, sync_every=100):
+        """Open the block store in a directory, creating it if needed
+        :param directory: Path of the directory holding the store files
+        :param sync_every: Number of blocks appended between two fsyncs"""
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.sync_every = sync_every
+        self.unsynced = 0
+        # Number of times blocks were dropped by `truncate`, so that a cache of
+        # verified blocks can tell that the blocks it saw may have changed
+        self.truncations = 0
+
+        data_path = os.path.join(directory, DATA_FILE)
+        index_path = os.path.join(directory, INDEX_FILE)
+        for path in (data_path, index_path):
+            if not os.path.exists(path):
+                open(path, "wb").close()
+        self.data = open(data_path, "r+b", buffering=0)
+        self.index = open(index_path, "r+b", buffering=0)
+
+        magic = self.data.read(len(MAGIC))
+        if len(magic) < len(MAGIC) and MAGIC.startswith(magic):
+            # Created, but the magic header never made it to disk
+            self.data.truncate(0)
+            self.data.write(MAGIC)
+        elif magic != MAGIC:
+            raise ValueError(f"Not a block store: {data_path}")
+
+        self.map = None
+        self.offsets = array("Q")
+        self.tip = None
+        self._recover()
+
+    def _remap(self):
+        """Map the whole block log, after it grew or shrank"""
+        if self.map is not None:
+            self.map.close()
+        self.map = mmap.mmap(self.data.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def _record_end(self, offset):
+        """Check the record at `offset`
+        :return: The offset just after the record, or None if it is torn or
+            corrupt"""
+        if offset + _record_header.size > self.size:
+            return None
+        length, checksum = _record_header.unpack_from(self.map, offset)
+        start = offset + _record_header.size
+        end = start + length
+        if end > self.size or zlib.crc32(self.map[start:end]) != checksum:
+            return None
+        return end
+
+    def _recover(self):
+        """Make the log and the index agree after an unclean shutdown"""
+        self.size = os.fstat(self.data.fileno()).st_size
+        self._remap()
+
+        index_data = self.index.read()
+        self.offsets.frombytes(index_data[: len(index_data) // 8 * 8])
+        if sys.byteorder == "big":
+            self.offsets.byteswap()
+
+        # Drop index entries for records that did not make it to the log
+        while self.offsets and self._record_end(self.offsets[-1]) is None:
+            self.offsets.pop()
+        end = self._record_end(self.offsets[-1]) if self.offsets else len(MAGIC)
+
+        # Index records that made it to the log but not to the index
+        record_end = self._record_end(end)
+        while record_end is not None:
+            self.offsets.append(end)
+            end, record_end = record_end, self._record_end(record_end)
+
+        # Truncate a torn or corrupt final record
+        if end < self.size:
+            self.map.close()
+            self.map = None
+            self.data.truncate(end)
+            self.size = end
+            self._remap()
+        self.data.seek(self.size)
+
+        if len(index_data) != len(self.offsets) * 8:
+            self.index.truncate(0)
+            self.index.seek(0)
+            offsets = array("Q", self.offsets)
+            if sys.byteorder == "big":
+                offsets.byteswap()
+            self.index.write(offsets.tobytes())
+            self.sync()
+        self.index.seek(len(self.offsets) * 8)
+
+    def _read(self, position):
+        """Decode the block at a position of the chain"""
+        offset = self.offsets[position]
+        start = offset + _record_header.size
+        (length, _) = _record_header.unpack_from(self.map, offset)
+        return Block(decode(self.map[start : start + length]))
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def __getitem__(self, position):
+        if isinstance(position, slice):
+            return [self[i] for i in range(*position.indices(len(self)))]
+        length = len(self.offsets)
+        if position < 0:
+            position += length
+        if not 0 <= position < length:
+            raise IndexError("Block index out of range")
+        if position == length - 1:
+            # Keep the last block, so that its cached hash survives
+            if self.tip is None:
+                self.tip = self._read(position)
+            return self.tip
+        return self._read(position)
+
+    def __iter__(self):
+        for position in range(len(self.offsets)):
+            yield self[position]
+
+    def append(self, block):
+        """Append a block to the end of the log
+        :param block: The block, as a Block or a dict"""
+        if not isinstance(block, Block):
+            block = Block(block)
+        payload = encode(block)
+        record = _record_header.pack(len(payload), zlib.crc32(payload)) + payload
+        offset = self.size
+        self.data.write(record)
+        self.index.write(_offset.pack(offset))
+        self.size += len(record)
+        self.offsets.append(offset)
+        self.tip = block
+        if self.size > len(self.map):
+            self._remap()
+
+        self.unsynced += 1
+        if self.unsynced >= self.sync_every:
+            self.sync()
+
+    def extend(self, blocks):
+        """Append several blocks
+        :param blocks: An iterable of Blocks or dicts"""
+        for block in blocks:
+            self.append(block)
+
+    def truncate(self, length):
+        """Drop every block after the first `length` blocks
+        :param length: Number of blocks to keep"""
+        if length >= len(self.offsets):
+            return
+        end = self.offsets[length]
+        self.map.close()
+        self.map = None
+        self.data.truncate(end)
+        self.data.seek(end)
+        self.size = end
+        self._remap()
+        del self.offsets[length:]
+        self.index.truncate(length * 8)
+        self.index.seek(length * 8)
+        self.tip = None
+        self.truncations += 1
+        self.sync()
+
+    def sync(self):
+        """Flush the appended blocks to disk"""
+        os.fsync(self.data.fileno())
+        os.fsync(self.index.fileno())
+        self.unsynced = 0
+
+    def close(self):
+        """Flush the appended blocks and close the files"""
+        if self.data.closed:
+            return
+        self.sync()
+        self.map.close()
+        self.data.close()
+        self.index.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
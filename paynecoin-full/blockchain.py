@@ -1,13 +1,219 @@
+from array import array
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from hashlib import sha256
 import json
-from time import time
+import math
+import threading
+from time import monotonic, time, time_ns
 from urllib.parse import urlparse
 import requests
+from requests.adapters import HTTPAdapter
+
+from block import Block
+from block_store import BlockStore
+from mempool import BLOCK_SIZE, Mempool
+from merkle import merkle_proof, transaction_hash, transactions_root
+from mining import DIFFICULTY, parallel_search_nonce
+from serialization import INT_MAX, INT_MIN, encode
+from snapshot import latest_snapshot, save_snapshot
+
+# Largest number of headers or blocks served or fetched in one request
+SYNC_BATCH = 500
+# Largest number of neighbors queried at the same time
+PEER_WORKERS = 16
+# Seconds to wait for a neighbor to accept a connection, and to answer
+PEER_TIMEOUT = (3.05, 10)
+# Seconds a neighbor has to send the part of its chain we are missing
+PEER_BUDGET = 60
+# Bytes read at a time from a neighbor's answer, between checks of its budget
+PEER_CHUNK = 16 * 1024
+# Default number of wallet history entries per page
+HISTORY_PAGE = 100
+# Number of blocks the wallets can revert without replaying the chain
+UNDO_DEPTH = 100
+
+
+def reward_first(tx):
+    """Priority of a transaction in the mempool: mining rewards first, then
+    the others in order of arrival"""
+    return 1 if tx["sender"] == "0" else 0
+
+
+# Fields a transaction may have, all but the timestamp required
+TRANSACTION_FIELDS = {"sender", "recipient", "amount", "timestamp"}
+
+
+def well_formed_transaction(tx):
+    """Check the shape of a transaction received from a client or a neighbor:
+    a dict with string sender and recipient, a finite number as amount and an
+    integer timestamp, if any, and no other field
+    :param tx: The transaction
+    :return: <bool>"""
+    if not isinstance(tx, dict) or not TRANSACTION_FIELDS.issuperset(tx):
+        return False
+    amount = tx.get("amount")
+    return (
+        isinstance(tx.get("sender"), str)
+        and isinstance(tx.get("recipient"), str)
+        and type(amount) in (int, float)
+        and math.isfinite(amount)
+        and type(tx.get("timestamp", 0)) is int
+    )
+
+
+def well_formed_block(block):
+    """Check the shape of a block received from a neighbor: a dict with an
+    integer index and proof, a string previous hash and a list of well-formed
+    transactions
+    :param block: The block
+    :return: <bool>"""
+    return (
+        isinstance(block, dict)
+        and type(block.get("index")) is int
+        and type(block.get("proof")) is int
+        and isinstance(block.get("previous_hash"), str)
+        and isinstance(block.get("transactions"), list)
+        and all(well_formed_transaction(tx) for tx in block["transactions"])
+    )
+
+
+def header_fields(block):
+    """Collect the fields of a block header
+
+    The header holds every field of the block except the transactions, which
+    enter only through their Merkle root. Blocks built without a `merkle_root`
+    field get one computed from their transactions.
+    :param block: Block dict
+    :return: <dict>"""
+    header = {k: v for k, v in block.items() if k != "transactions"}
+    if "merkle_root" not in header:
+        header["merkle_root"] = transactions_root(block["transactions"])
+    return header
+
+
+class Wallet:
+    """
+    The balance of a wallet and the history of the amounts that changed it
+
+    The history holds the amounts of the mined transactions, in two arrays of
+    64-bit integers: the amounts and the index of the block each amount comes
+    from. An entry costs 16 bytes, and an update adds to the running balance
+    in O(1). The amounts switch to a list of Python numbers once one is not a
+    64-bit integer, so balances stay exact. Posted transactions not mined yet
+    only count in `pending`.
+    """
+
+    __slots__ = ("balance", "pending", "amounts", "blocks")
+
+    def __init__(self, balance=0, amounts=(), blocks=()):
+        self.balance = balance
+        self.pending = 0
+        self.amounts = array("q")
+        for amount in amounts:
+            self.record(amount)
+        self.blocks = array("q", blocks)
+
+    def __len__(self):
+        return len(self.amounts)
+
+    def update(self, amount, block):
+        """
+        Record an amount received (or sent, if negative) in a block
+        :param amount: The amount
+        :param block: Index of the block
+        """
+
+        self.record(amount)
+        self.blocks.append(block)
+        self.balance += amount
+
+    def record(self, amount):
+        """Append an amount to the history, without updating the balance"""
+        if isinstance(self.amounts, array) and not (
+            type(amount) is int and INT_MIN <= amount <= INT_MAX
+        ):
+            self.amounts = list(self.amounts)
+        self.amounts.append(amount)
+
+    def pop(self):
+        """Remove the last amount recorded"""
+        self.blocks.pop()
+        self.balance -= self.amounts.pop()
+
+    def summary(self):
+        return {
+            "balance": self.balance + self.pending,
+            "pending": self.pending,
+            "transactions": len(self.amounts),
+        }
+
+    def history(self, offset=0, limit=HISTORY_PAGE):
+        """
+        Page through the history, oldest first
+        :param offset: Number of entries to skip
+        :param limit: Largest number of entries returned
+        :return: <dict> The summary of the wallet and the entries of the page
+        """
+
+        page = range(offset, min(offset + limit, len(self.amounts)))
+        return {
+            **self.summary(),
+            "offset": offset,
+            "history": [
+                {"amount": self.amounts[i], "block": self.blocks[i]} for i in page
+            ],
+        }
+
+    def to_dict(self):
+        """The mined part of the wallet, without `pending`"""
+        return {
+            "balance": self.balance,
+            "amounts": list(self.amounts),
+            "blocks": self.blocks.tolist(),
+        }
+
+    @classmethod
+    def from_dict(cls, values):
+        return cls(values["balance"], values["amounts"], values["blocks"])
+
+
+class _Undo:
+    """What `Wallets.revert_block` needs to undo a block"""
+
+    __slots__ = ("previous_hash", "transactions", "uuids", "created")
+
+    def __init__(self, previous_hash, transactions, uuids, created):
+        self.previous_hash = previous_hash
+        self.transactions = transactions
+        # Wallets updated by the block, once per amount, in order
+        self.uuids = uuids
+        # Wallets the block created
+        self.created = created
 
 
 class Wallets:
+    """
+    The wallets of a chain, derived from its blocks
+
+    The wallets follow the chain with `sync`, which applies the blocks the
+    chain gained since the last call. When the chain switched to a competing
+    one, `sync` first reverts the blocks after the fork, using an undo log of
+    the last `UNDO_DEPTH` blocks applied, so a reorg costs O(reorged blocks).
+    Posted transactions count in the `pending` balance of their wallets until
+    the block holding them is applied.
+    """
+
     def __init__(self):
         self.wallets = {}
+        # Pending transactions by hash
+        self.pending = {}
+        # Number of blocks applied, and hash of the last one
+        self.height = 0
+        self.tip = None
+        self.undo = deque(maxlen=UNDO_DEPTH)
+        # Height of the last snapshot of the wallets
+        self.snapshot_height = 0
 
     def wallets_get(self, uuid):
         if uuid is not None:
@@ -18,31 +224,233 @@ class Wallets:
         else:
             return self.wallets
 
+    def summaries(self):
+        """Summarize every wallet, without its history"""
+        return {uuid: wallet.summary() for uuid, wallet in self.wallets.items()}
+
     def wallet_create(self, uuid):
-        transactions = []
-        wallet = {"transactions": transactions, "balance": sum(transactions)}
-        self.wallets[uuid] = wallet
+        self.wallets.setdefault(uuid, Wallet())
         return self.wallets
 
     def wallet_update(self, uuid, amount=0):
+        """Add an amount to the pending balance of a wallet, creating it if
+        needed"""
         try:
             wallet = self.wallets[uuid]
         except KeyError:
             self.wallet_create(uuid)
             wallet = self.wallets[uuid]
-        wallet["transactions"].append(amount)
-        wallet["balance"] = sum(wallet["transactions"])
+        wallet.pending += amount
         return wallet
 
+    @staticmethod
+    def amounts(tx):
+        """List the (uuid, amount) changes of a transaction. The sender "0" of
+        mining rewards has no wallet."""
+        if tx["sender"] == "0":
+            return [(tx["recipient"], tx["amount"])]
+        return [(tx["sender"], -tx["amount"]), (tx["recipient"], tx["amount"])]
+
+    def add_pending(self, tx):
+        """
+        Count a posted transaction in the pending balances
+        :param tx: The transaction
+        """
+
+        self.pending[transaction_hash(tx)] = tx
+        for uuid, amount in self.amounts(tx):
+            self.wallet_update(uuid, amount)
+
+    def remove_pending(self, tx_hash):
+        """
+        Stop counting a pending transaction, once mined or evicted from the
+        mempool
+        :param tx_hash: The hash of the transaction
+        """
+
+        tx = self.pending.pop(tx_hash, None)
+        if tx is not None:
+            for uuid, amount in self.amounts(tx):
+                self.wallet_update(uuid, -amount)
+
+    def apply_block(self, block):
+        """
+        Update the wallets with the transactions of the next block
+        :param block: Block
+        """
+
+        uuids = []
+        created = []
+        for tx in block["transactions"]:
+            self.remove_pending(transaction_hash(tx))
+            for uuid, amount in self.amounts(tx):
+                wallet = self.wallets.get(uuid)
+                if wallet is None:
+                    wallet = self.wallets[uuid] = Wallet()
+                    created.append(uuid)
+                wallet.update(amount, block["index"])
+                uuids.append(uuid)
+        self.undo.append(
+            _Undo(block["previous_hash"], block["transactions"], uuids, created)
+        )
+        self.height += 1
+        self.tip = Blockchain.hash(block)
+
+    def revert_block(self):
+        """
+        Undo the last block applied, from the undo log
+        :return: The transactions of the block
+        """
+
+        undo = self.undo.pop()
+        for uuid in reversed(undo.uuids):
+            self.wallets[uuid].pop()
+        for uuid in undo.created:
+            wallet = self.wallets[uuid]
+            if not len(wallet) and not wallet.pending:
+                del self.wallets[uuid]
+        self.height -= 1
+        self.tip = undo.previous_hash
+        return undo.transactions
+
+    def sync(self, chain):
+        """
+        Bring the wallets up to date with a chain
+
+        Blocks applied that are no longer in the chain are reverted, then the
+        blocks of the chain after them are applied. A fork deeper than the undo
+        log makes the wallets replay the chain from the start, or from a
+        snapshot for a BlockStore. The transactions of blocks older than the
+        undo log are then not known here, see `Blockchain.replace_chain`.
+        :param chain: The blockchain
+        :return: The transactions of the reverted blocks that are not in the
+            chain anymore, except mining rewards
+        """
+
+        reverted = []
+        while self.height and (
+            self.height > len(chain)
+            or self.tip != Blockchain.hash(chain[self.height - 1])
+        ):
+            if not self.undo:
+                self.rebuild(chain)
+                break
+            reverted.extend(self.revert_block())
+
+        # The blocks applied from here hold every block of the chain after the
+        # fork, and so the reverted transactions that were mined again
+        mined = set()
+        for position in range(self.height, len(chain)):
+            block = chain[position]
+            self.apply_block(block)
+            if reverted:
+                mined.update(transaction_hash(tx) for tx in block["transactions"])
+
+        return [
+            tx
+            for tx in reverted
+            if tx["sender"] != "0" and transaction_hash(tx) not in mined
+        ]
+
+    def rebuild(self, chain):
+        """Forget the blocks applied, keeping the pending balances, and load
+        the newest snapshot of a BlockStore, without replaying the blocks
+        after it"""
+        pending = self.pending
+        self.wallets = {}
+        self.pending = {}
+        self.height = 0
+        self.tip = None
+        self.undo.clear()
+        for tx in pending.values():
+            self.add_pending(tx)
+        if isinstance(chain, BlockStore):
+            self.load_snapshot(chain)
+
+    def restore(self, chain):
+        """
+        Load the wallets of a chain kept in a BlockStore from its newest
+        snapshot, and replay the blocks after it
+
+        :param chain: The BlockStore
+        :return: The height of the snapshot used, or 0 if the whole chain was
+            replayed
+        """
+
+        self.load_snapshot(chain)
+        self.sync(chain)
+        return self.snapshot_height
+
+    def load_snapshot(self, chain):
+        """Load the wallets from the newest snapshot of a BlockStore, if any,
+        keeping the pending balances"""
+        snapshot = latest_snapshot(chain.directory, chain, Blockchain.hash)
+        if snapshot is not None:
+            for uuid, values in snapshot["state"].items():
+                wallet = Wallet.from_dict(values)
+                if uuid in self.wallets:
+                    wallet.pending = self.wallets[uuid].pending
+                self.wallets[uuid] = wallet
+            self.height = snapshot["height"]
+            self.tip = snapshot["block_hash"]
+            self.undo.clear()
+        self.snapshot_height = self.height
+
+    def take_snapshot(self, chain):
+        """
+        Snapshot the wallets of a chain kept in a BlockStore, after `sync`
+        :param chain: The BlockStore
+        """
+
+        # The snapshot must not cover blocks that could still be lost
+        chain.sync()
+        save_snapshot(chain.directory, self.height, self.tip, self.wallets)
+        self.snapshot_height = self.height
+
 
 class Blockchain:
-    def __init__(self):
-        self.current_transactions = []
-        self.chain = []
+    # Largest total size of the transactions of a block, in bytes
+    block_size = BLOCK_SIZE
+
+    def __init__(self, store=None, mempool=None):
+        """
+        Initialize the blockchain
+        :param store: A `BlockStore` to keep the chain in, instead of a list. If
+            the store already holds a chain, the blockchain continues it.
+        :param mempool: The `Mempool` holding the pending transactions, a
+            default one putting mining rewards first if None
+        """
+
+        self.mempool = Mempool(priority=reward_first) if mempool is None else mempool
+        self.chain = [] if store is None else store
         self.nodes = set()
+        # Guards the chain, the mempool and the nodes against the threads of a
+        # server. Callers hold it around reads and updates, except for
+        # `resolve_conflicts`, which takes it itself so that it is not held
+        # while downloading from the neighbors.
+        self.lock = threading.RLock()
+        # Keep-alive connections to the neighbors, shared by the threads that
+        # query them
+        self.session = requests.Session()
+        self.session.mount("http://", HTTPAdapter(pool_maxsize=PEER_WORKERS))
+        # Verified-prefix cache: the blocks of the last chain that passed
+        # `valid_chain`, or for a BlockStore, the store, its truncation count
+        # and its length
+        self.verified_blocks = []
+        self.verified_mutations = Block.mutations
+        self.verified_store = None
+        # Height of each block of our chain by hash, built on the first lookup
+        # (see `height_of`) so that opening a stored chain does not read it all
+        self.heights = None
 
         # Spawn the genesis block
-        self.new_block(previous_hash="1", proof=100)
+        if not len(self.chain):
+            self.new_block(previous_hash="1", proof=100)
+
+    @property
+    def current_transactions(self):
+        """The pending transactions, oldest first"""
+        return list(self.mempool)
 
     def add_node(self, address):
         """
@@ -59,68 +467,409 @@ class Blockchain:
         else:
             raise ValueError("Invalid URL")
 
+    def verified_prefix(self, chain):
+        """
+        Count the blocks at the start of a chain that were already verified
+
+        These are the leading blocks of `chain` that are the very same Block
+        objects as in the last chain that passed `valid_chain`, or for a
+        BlockStore, the blocks it held when it passed `valid_chain`. Modifying
+        any Block since then empties the cache.
+        :param chain: A blockchain
+        :return: The number of verified blocks
+        """
+
+        if Block.mutations != self.verified_mutations:
+            self.verified_blocks = []
+            self.verified_mutations = Block.mutations
+            self.verified_store = None
+        if isinstance(chain, BlockStore):
+            # Stored blocks only change when the store is truncated
+            if self.verified_store is None:
+                return 0
+            store, truncations, length = self.verified_store
+            if store is not chain or truncations != chain.truncations:
+                return 0
+            return length
+        count = 0
+        for block, verified in zip(chain, self.verified_blocks):
+            if block is not verified:
+                break
+            count += 1
+        return count
+
+    def remember_verified(self, chain):
+        """
+        Cache the leading Block objects of a chain that passed `valid_chain`,
+        or the whole chain for a BlockStore
+        :param chain: The verified blockchain
+        """
+
+        self.verified_mutations = Block.mutations
+        if isinstance(chain, BlockStore):
+            self.verified_blocks = []
+            self.verified_store = (chain, chain.truncations, len(chain))
+            return
+        self.verified_store = None
+        count = 0
+        for block in chain:
+            if not isinstance(block, Block):
+                break
+            count += 1
+        self.verified_blocks = chain[:count]
+
     def valid_chain(self, chain):
         """
         Determine if a given blockchain is valid
+
+        Blocks already verified as the start of a previous chain (see
+        `verified_prefix`) are not checked again, so validating a chain that
+        extends a valid one only checks the new blocks.
         :param chain: A blockchain
         :return: True if valid, False if not
         """
 
-        last_block = chain[0]
-        current_index = 1
+        verified = self.verified_prefix(chain)
+        if not verified:
+            if not self.valid_merkle_root(chain[0]):
+                return False
+            verified = 1
+
+        last_block = chain[verified - 1]
+        current_index = verified
 
         while current_index < len(chain):
             block = chain[current_index]
-            print(f"{last_block}")
-            print(f"{block}")
-            print("\n-----------\n")
-            # Check that the hash of the block is correct
-            last_block_hash = self.hash(last_block)
-            if block["previous_hash"] != last_block_hash:
+            # Check that the transactions match the Merkle root in the header
+            if not self.valid_merkle_root(block):
                 return False
 
-            # Check that the Proof of Work is correct
-            if not self.valid_proof(last_block["proof"], block["proof"]):
+            # Check the hash of the previous block and the Proof of Work
+            if not self.valid_link(last_block, block):
                 return False
 
             last_block = block
             current_index += 1
 
+        self.remember_verified(chain)
         return True
 
+    def valid_link(self, last_block, block):
+        """
+        Check that a block follows another one
+        :param last_block: The previous block or its header
+        :param block: The block or its header
+        :return: True if the block holds the hash of the previous one and a
+            valid Proof of Work, False if not
+        """
+
+        # Check that the hash of the block is correct
+        if block["previous_hash"] != self.hash(last_block):
+            return False
+
+        # Check that the Proof of Work is correct
+        return self.valid_proof(last_block["proof"], block["proof"])
+
+    def locator(self):
+        """
+        Describe our chain for a neighbor looking for the fork with its own
+
+        The locator holds the height (number of blocks up to and including a
+        block) and hash of our last 10 blocks, then of blocks further and
+        further apart, down to the genesis block, so its size grows with the
+        logarithm of the length of the chain.
+        :return: A list of [height, hash] pairs, from the tip down
+        """
+
+        heights = []
+        height = len(self.chain)
+        step = 1
+        while height > 0:
+            heights.append(height)
+            if len(heights) >= 10:
+                step *= 2
+            height -= step
+        if heights[-1] != 1:
+            heights.append(1)
+        return [[height, self.hash(self.chain[height - 1])] for height in heights]
+
+    def locate_fork(self, locator):
+        """
+        Find the last block of our chain that a neighbor's chain also has
+        :param locator: The locator of the neighbor's chain, see `locator`
+        :return: The height of that block, 0 if the chains share no block
+        """
+
+        for height, block_hash in locator:
+            if 0 < height <= len(self.chain) and (
+                self.hash(self.chain[height - 1]) == block_hash
+            ):
+                return height
+        return 0
+
+    def height_of(self, block_hash):
+        """
+        Find a block of our chain by its hash
+        :param block_hash: The hash of the block
+        :return: Its height, or None if it is not in our chain
+        """
+
+        if self.heights is None:
+            self.heights = {
+                self.hash(block): height for height, block in enumerate(self.chain, 1)
+            }
+        return self.heights.get(block_hash)
+
+    def index_blocks(self, start):
+        """Add the blocks of our chain from height `start` + 1 to the hash index"""
+        if self.heights is None:
+            return
+        for height in range(start + 1, len(self.chain) + 1):
+            self.heights[self.hash(self.chain[height - 1])] = height
+
+    def headers(self, start, limit=SYNC_BATCH):
+        """
+        Collect the headers of a range of blocks, see `header_fields`
+        :param start: Height of the block before the first one
+        :param limit: Largest number of headers
+        :return: A list of headers
+        """
+
+        stop = min(start + limit, len(self.chain))
+        return [header_fields(self.chain[i]) for i in range(start, stop)]
+
+    def blocks(self, start, limit=SYNC_BATCH):
+        """
+        Collect a range of blocks
+        :param start: Height of the block before the first one
+        :param limit: Largest number of blocks
+        :return: A list of blocks
+        """
+
+        stop = min(start + limit, len(self.chain))
+        return [self.chain[i] for i in range(start, stop)]
+
+    def query(self, method, url, deadline, **kwargs):
+        """
+        Send a request to a neighbor and read its JSON answer before a deadline
+
+        The answer is streamed, and the deadline checked between chunks, so a
+        neighbor that answers slowly, or without end, cannot hold us past it.
+        :param method: "GET" or "POST"
+        :param url: URL of the request
+        :param deadline: Time of `time.monotonic` to give up at
+        :param kwargs: Arguments of `requests.Session.request`
+        :return: The status code and the decoded answer, None if not 200
+        :raise TimeoutError: If the deadline passes
+        """
+
+        remaining = deadline - monotonic()
+        if remaining <= 0:
+            raise TimeoutError("Neighbor out of time")
+        connect, read = PEER_TIMEOUT
+        timeout = (min(connect, remaining), min(read, remaining))
+        with self.session.request(
+            method, url, stream=True, timeout=timeout, **kwargs
+        ) as response:
+            if response.status_code != 200:
+                return response.status_code, None
+            body = bytearray()
+            for chunk in response.iter_content(PEER_CHUNK):
+                if monotonic() > deadline:
+                    raise TimeoutError("Neighbor out of time")
+                body += chunk
+        return response.status_code, json.loads(body)
+
+    def fetch(self, node, kind, start, stop, deadline):
+        """
+        Download a range of headers or blocks from a neighbor, in batches
+        :param node: Address of the neighbor
+        :param kind: "headers" or "blocks"
+        :param start: Height of the block before the first one
+        :param stop: Height of the last block
+        :param deadline: Time of `time.monotonic` to give up at, see `query`
+        :return: The list of headers or blocks, which may be shorter if the
+            neighbor's chain got shorter, or None if the neighbor failed
+        :raise TimeoutError: If the deadline passes
+        """
+
+        items = []
+        while start + len(items) < stop:
+            limit = min(SYNC_BATCH, stop - start - len(items))
+            status, answer = self.query(
+                "GET",
+                f"http://{node}/{kind}",
+                deadline,
+                params={"from": start + len(items), "limit": limit},
+            )
+            if status != 200:
+                return None
+            batch = answer[kind][:limit]
+            if not isinstance(batch, list) or not all(
+                isinstance(item, dict) for item in batch
+            ):
+                return None
+            if not batch:
+                break
+            items.extend(batch)
+        return items
+
+    def fetch_suffix(self, node, min_length, locator):
+        """
+        Download the part of a neighbor's chain that is not in ours
+
+        The neighbor finds the fork with our `locator`. Then the headers of its
+        blocks after the fork are downloaded and their Proof of Work checked,
+        and only if they are valid are the blocks themselves downloaded and
+        checked against the headers. The cost depends on how far the chains
+        diverge, not on their length, and the whole download must fit in
+        `PEER_BUDGET` seconds.
+        :param node: Address of the neighbor
+        :param min_length: Length the neighbor's chain must exceed
+        :param locator: Our `locator`
+        :return: The height of the fork and the blocks after it, or None if the
+            neighbor's chain is not longer or not valid
+        :raise TimeoutError: If the neighbor runs out of time
+        """
+
+        deadline = monotonic() + PEER_BUDGET
+        status, answer = self.query("GET", f"http://{node}/chain/tip", deadline)
+        if status != 200:
+            return None
+        length = answer["length"]
+        if type(length) is not int or length <= min_length:
+            return None
+
+        status, answer = self.query(
+            "POST", f"http://{node}/chain/locate", deadline, json={"locator": locator}
+        )
+        if status != 200:
+            return None
+        fork = answer["fork"]
+        if type(fork) is not int or not 0 <= fork <= len(self.chain):
+            return None
+
+        headers = self.fetch(node, "headers", fork, length, deadline)
+        if headers is None or fork + len(headers) <= min_length:
+            return None
+        with self.lock:
+            if fork > len(self.chain):
+                return None
+            last_block = self.chain[fork - 1] if fork else None
+        for header in headers:
+            if last_block is not None and not self.valid_link(last_block, header):
+                return None
+            last_block = header
+
+        blocks = self.fetch(node, "blocks", fork, fork + len(headers), deadline)
+        if blocks is None or len(blocks) != len(headers):
+            return None
+        for block, header in zip(blocks, headers):
+            # Check that the transactions match the Merkle root in the header
+            if (
+                not well_formed_block(block)
+                or self.hash(block) != self.hash(header)
+                or not self.valid_merkle_root(block)
+            ):
+                return None
+        return fork, blocks
+
     def resolve_conflicts(self):
         """
         This is our consensus algorithm, it resolves conflicts
         by replacing our chain with the longest one in the network.
-        :return: True if our chain was replaced, False if not
+
+        Only the blocks of each neighbor's chain after its fork with ours are
+        downloaded, see `fetch_suffix`. Neighbors are queried concurrently,
+        and one that fails, does not answer within `PEER_TIMEOUT`, or takes
+        more than `PEER_BUDGET` seconds in all is skipped, so a slow neighbor
+        only delays the answer by its budget.
+        :return: (replaced, neighbor, dropped): whether our chain was replaced,
+            the neighbor with the longest chain, and the transactions dropped
+            with our blocks, see `replace_chain`
         """
 
-        neighbors = self.nodes
+        with self.lock:
+            neighbors = list(self.nodes)
+            # We're only looking for chains longer than ours
+            max_length = len(self.chain)
+            locator = self.locator()
         winning_neighbor = None
-        new_chain = None
+        new_suffix = None
+
+        # Grab and verify the new blocks from all the nodes in our network,
+        # keeping the longest valid chain as the answers arrive
+        with ThreadPoolExecutor(max(1, min(PEER_WORKERS, len(neighbors)))) as executor:
+            futures = {
+                executor.submit(self.fetch_suffix, node, max_length, locator): node
+                for node in neighbors
+            }
+            for future in as_completed(futures):
+                # Whatever a neighbor answers, or fails to, it only loses
+                # its turn
+                try:
+                    suffix = future.result()
+                except Exception:
+                    continue
+                if suffix is not None and suffix[0] + len(suffix[1]) > max_length:
+                    fork, blocks = suffix
+                    max_length = fork + len(blocks)
+                    new_suffix = suffix
+                    winning_neighbor = futures[future]
 
-        # We're only looking for chains longer than ours
-        max_length = len(self.chain)
+        # Replace our chain if we discovered a new, valid chain longer than ours,
+        # and still is once our chain is locked: it may have grown or switched
+        # during the download
+        if new_suffix:
+            fork, blocks = new_suffix
+            with self.lock:
+                if (
+                    fork <= len(self.chain) < fork + len(blocks)
+                    and (
+                        fork == 0
+                        or self.hash(self.chain[fork - 1]) == blocks[0]["previous_hash"]
+                    )
+                ):
+                    dropped = self.replace_chain(fork, blocks)
+                    return True, winning_neighbor, dropped
 
-        # Grab and verify the chains from all the nodes in our network
-        for node in neighbors:
-            chain_response = requests.get(f"http://{node}/chain")
-            if chain_response.status_code == 200:
-                length = chain_response.json()["length"]
-                chain = chain_response.json()["chain"]
+        return False, winning_neighbor, []
 
-                # Check if the length is longer and the chain is valid
-                if length > max_length and self.valid_chain(chain):
-                    max_length = length
-                    new_chain = chain
-                    winning_neighbor = node
+    def replace_chain(self, fork, blocks):
+        """
+        Replace the blocks of our chain after a fork
+        :param fork: Number of blocks to keep
+        :param blocks: The blocks to append after them
+        :return: The transactions of the blocks replaced that are not in the new
+            blocks, except mining rewards, which are no longer mined
+        """
+
+        # Transactions of the new blocks are no longer pending
+        mined = set()
+        for block in blocks:
+            for tx in block["transactions"]:
+                tx_hash = transaction_hash(tx)
+                self.mempool.remove(tx_hash)
+                mined.add(tx_hash)
+        dropped = [
+            tx
+            for position in range(fork, len(self.chain))
+            for tx in self.chain[position]["transactions"]
+            if tx["sender"] != "0" and transaction_hash(tx) not in mined
+        ]
 
-        # Replace our chain if we discovered a new, valid chain longer than ours
-        if new_chain:
-            self.chain = new_chain
-            return True, winning_neighbor
+        if self.heights is not None:
+            for position in range(fork, len(self.chain)):
+                self.heights.pop(self.hash(self.chain[position]), None)
 
-        return False, winning_neighbor
+        if not isinstance(self.chain, BlockStore):
+            self.chain = self.chain[:fork] + [Block(block) for block in blocks]
+        else:
+            self.chain.truncate(fork)
+            self.chain.extend(blocks)
+            self.chain.sync()
+        self.index_blocks(fork)
+        return dropped
 
     def new_block(self, proof, previous_hash):
         """
@@ -130,72 +879,169 @@ class Blockchain:
         :return: New Block
         """
 
-        block = {
-            "index": len(self.chain) + 1,
-            "timestamp": time(),
-            "transactions": self.current_transactions,
-            "total_transactions": sum(
-                [x.get("amount") for x in self.current_transactions]
-            ),
-            "proof": proof,
-            "previous_hash": previous_hash or self.hash(self.chain[-1]),
-        }
-
-        # Reset the current list of transactions
-        self.current_transactions = []
-
+        # Take the best pending transactions that fit in the block
+        transactions = self.mempool.take(self.block_size)
+        try:
+            block = {
+                "index": len(self.chain) + 1,
+                "timestamp": time(),
+                "transactions": transactions,
+                "total_transactions": sum([x.get("amount") for x in transactions]),
+                "merkle_root": transactions_root(transactions),
+                "proof": proof,
+                "previous_hash": previous_hash or self.hash(self.chain[-1]),
+            }
+            block = Block(block)
+        except Exception:
+            # A block that cannot be built loses none of the transactions
+            for tx in transactions:
+                self.mempool.add(tx)
+            raise
         self.chain.append(block)
+        self.index_blocks(len(self.chain) - 1)
         return block
 
-    def new_transaction(self, sender, recipient, amount):
+    def new_transaction(self, sender, recipient, amount, timestamp=None):
         """
         Create a new transaction to go into the next mined block
         :param sender: Address of the Sender
         :param recipient: Address of the Recipient
         :param amount: Amount
+        :param timestamp: Time of the transaction in nanoseconds, now if None.
+            It tells apart transactions that are otherwise identical.
         :return: The index of the Block that will hold this transaction
         """
-        self.current_transactions.append(
+        self.add_transaction(
             {
                 "sender": sender,
                 "recipient": recipient,
                 "amount": amount,
+                "timestamp": time_ns() if timestamp is None else timestamp,
             }
         )
 
         # TODO: I think there should not be a +1 here
         return self.last_block["index"] + 1
 
+    def add_transaction(self, tx):
+        """
+        Add a transaction to the mempool, to go into a coming block
+        :param tx: The transaction dict
+        :return: The transactions evicted from the mempool to make room for it
+        :raise ValueError: If the transaction is malformed (see
+            `well_formed_transaction`) or already pending, or the mempool is
+            full of transactions of higher priority
+        """
+        if not well_formed_transaction(tx):
+            raise ValueError("Malformed transaction")
+        return self.mempool.add(tx)
+
+    def add_block(self, block):
+        """
+        Append a block mined by a neighbor, if it extends our chain
+
+        The transactions of the block are removed from the mempool.
+        :param block: The block
+        :return: True if the block was appended, False if it does not extend
+            our chain
+        """
+
+        if not (
+            well_formed_block(block)
+            and self.valid_merkle_root(block)
+            and self.valid_link(self.last_block, block)
+        ):
+            return False
+        block = Block(block)
+        self.chain.append(block)
+        self.index_blocks(len(self.chain) - 1)
+        for tx in block["transactions"]:
+            self.mempool.remove(transaction_hash(tx))
+        return True
+
     @property
     def last_block(self):
         return self.chain[-1]
 
+    @staticmethod
+    def valid_merkle_root(block):
+        """
+        Check that the transactions of a block match its Merkle root
+        :param block: Block
+        :return: True if they match or the block has no root, False if not
+        """
+
+        if "merkle_root" not in block:
+            return True
+        return block["merkle_root"] == transactions_root(block["transactions"])
+
+    def transaction_proof(self, block_index, position):
+        """
+        Build a Merkle inclusion proof for a transaction in the chain
+        :param block_index: Index of the block holding the transaction
+        :param position: Position of the transaction in the block
+        :return: The block header, its hash, the transaction hash and the proof
+        """
+
+        block = self.chain[block_index - 1]
+        tx_hashes = [transaction_hash(tx) for tx in block["transactions"]]
+        return {
+            "header": header_fields(block),
+            "block_hash": self.hash(block),
+            "transaction_hash": tx_hashes[position],
+            "proof": merkle_proof(tx_hashes, position),
+        }
+
     @staticmethod
     def hash(block):
         """
         Create a SHA-256 hash of a Block
-        :param block: Block
+
+        Only the block header is hashed (see `header_fields`), so the cost does
+        not depend on the number of transactions. A header hashes to the same
+        value as its block.
+        :param block: Block or block header
         """
 
-        # NOTE: dict must be sorted to avoid inconsistent hashes
-        block_string = json.dumps(block, sort_keys=True).encode()
-        return sha256(block_string).hexdigest()
+        # Blocks cache their serialized header and hash until they are modified
+        if isinstance(block, Block) and block.cached_hash is not None:
+            return block.cached_hash
+
+        # NOTE: the binary encoding sorts dict keys to avoid inconsistent hashes
+        header = encode(header_fields(block))
+        block_hash = sha256(header).hexdigest()
+        if isinstance(block, Block):
+            block.cached_header = header
+            block.cached_hash = block_hash
+        return block_hash
 
-    def proof_of_work(self, last_block):
+    @staticmethod
+    def proof_of_work(last_block, workers=1, progress=None, cancel=None):
         """
         Simple Proof of Work (PoW) algorithm:
             - Find a number p' such that hash(pp') contains leading 5 zeroes
             - Where p is the previous proof, and p' is the new proof
 
+        The search is done by `mining.parallel_search_nonce`, which returns the
+        lowest such p' whatever the number of workers.
+
         :param last_block: <dict> last block
-        :return: <int>
+        :param workers: <int> number of processes to search with
+        :param progress: Function called with the number of attempts so far
+        :param cancel: A `threading.Event` that stops the search once set
+        :return: <int>, or None if the search was cancelled
         """
 
         last_proof = last_block["proof"]
 
-        proof = 0
-        while self.valid_proof(last_proof, proof) is False:
-            proof += 1
+        proof, _ = parallel_search_nonce(
+            str(last_proof).encode(),
+            DIFFICULTY,
+            encoding="decimal",
+            workers=workers,
+            progress=progress,
+            cancel=cancel,
+        )
 
         return proof
 
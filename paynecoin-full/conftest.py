@@ -0,0 +1,21 @@
+"""Let pytest collect the tests of paynecoin-lite and paynecoin-full in one run
+
+Both packages are imported by their tests as top-level modules of the same
+names (blockchain, merkle, ...), so the modules of the other package are
+forgotten before the tests of this one are imported.
+"""
+
+import os
+import sys
+
+here = os.path.dirname(os.path.abspath(__file__))
+for name, module in list(sys.modules.items()):
+    path = getattr(module, "__file__", None)
+    if path is None:
+        continue
+    directory = os.path.dirname(os.path.abspath(path))
+    # A module of a sibling package
+    if directory != here and os.path.dirname(directory) == os.path.dirname(here):
+        del sys.modules[name]
+if sys.path[0] != here:
+    sys.path.insert(0, here)
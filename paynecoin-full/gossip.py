@@ -0,0 +1,154 @@
+"""
+Push-based gossip of transactions and blocks between nodes
+
+A node announces each transaction it receives and each block it mines or
+accepts to a few of its neighbors, picked at random, which announce them to a
+few of theirs, and so on. Every node remembers the hashes of what it has seen
+and drops anything it sees again, so each announcement crosses every node once
+and reaches all nodes in a number of rounds that grows with the logarithm of
+the number of nodes.
+
+A node may still miss an announcement, when the neighbors that pick it are
+down or by bad luck. A missed transaction reaches it inside the next block,
+and a missed block is noticed when the next one does not link to its chain,
+which it then syncs from its neighbors.
+
+Announcements are not sent one by one: they are queued and pushed together
+every `GOSSIP_INTERVAL` seconds, as one POST to the `/gossip` endpoint of
+`GOSSIP_FANOUT` neighbors.
+"""
+
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import random
+import threading
+import time
+
+import requests
+
+from blockchain import PEER_TIMEOUT
+
+# Number of neighbors each batch of announcements is pushed to
+GOSSIP_FANOUT = 4
+# Seconds announcements are queued for before they are pushed together
+GOSSIP_INTERVAL = 0.2
+# Number of transaction and block hashes remembered
+SEEN_SIZE = 100_000
+
+
+class Gossip:
+    def __init__(
+        self,
+        blockchain,
+        fanout=GOSSIP_FANOUT,
+        interval=GOSSIP_INTERVAL,
+        seen_size=SEEN_SIZE,
+    ):
+        """
+        Gossip with the neighbors of a blockchain
+        :param blockchain: The Blockchain, whose `nodes` are the neighbors and
+            whose `session` is used to reach them
+        :param fanout: Number of neighbors each batch is pushed to
+        :param interval: Seconds between two batches
+        :param seen_size: Number of hashes remembered
+        """
+
+        self.blockchain = blockchain
+        self.fanout = fanout
+        self.interval = interval
+        self.seen_size = seen_size
+        self.seen = OrderedDict()
+        self.transactions = []
+        self.blocks = []
+        self.lock = threading.Lock()
+        self.wake = threading.Event()
+        self.thread = None
+        self.executor = ThreadPoolExecutor(fanout)
+
+    def see(self, item_hash):
+        """
+        Remember the hash of a transaction or block
+        :param item_hash: The hash
+        :return: True if it was not seen before, False if not
+        """
+
+        with self.lock:
+            if item_hash in self.seen:
+                self.seen.move_to_end(item_hash)
+                return False
+            self.seen[item_hash] = None
+            if len(self.seen) > self.seen_size:
+                self.seen.popitem(last=False)
+            return True
+
+    def forget(self, item_hash):
+        """
+        Forget the hash of a transaction or block that was seen but not taken,
+        so that it is taken if it comes again
+        :param item_hash: The hash
+        """
+
+        with self.lock:
+            self.seen.pop(item_hash, None)
+
+    def announce(self, transactions=(), blocks=()):
+        """
+        Queue transactions and blocks for the next batch
+        :param transactions: New transactions
+        :param blocks: New blocks
+        """
+
+        with self.lock:
+            self.transactions.extend(
+                tx.to_dict() if hasattr(tx, "to_dict") else tx for tx in transactions
+            )
+            self.blocks.extend(
+                block.to_dict() if hasattr(block, "to_dict") else block
+                for block in blocks
+            )
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, daemon=True)
+                self.thread.start()
+        self.wake.set()
+
+    def run(self):
+        """Push the queued announcements every `interval` seconds"""
+        while True:
+            self.wake.wait()
+            # Let more announcements join the batch
+            time.sleep(self.interval)
+            self.wake.clear()
+            self.flush()
+
+    def flush(self):
+        """
+        Push the queued announcements to `fanout` random neighbors
+        :return: The number of neighbors that accepted them
+        """
+
+        with self.lock:
+            transactions, self.transactions = self.transactions, []
+            blocks, self.blocks = self.blocks, []
+        if not (transactions or blocks):
+            return 0
+
+        with self.blockchain.lock:
+            nodes = list(self.blockchain.nodes)
+        peers = random.sample(nodes, min(self.fanout, len(nodes)))
+        batch = {"transactions": transactions, "blocks": blocks}
+        sent = self.executor.map(lambda node: self.push(node, batch), peers)
+        return sum(sent)
+
+    def push(self, node, batch):
+        """
+        POST a batch of announcements to a neighbor
+        :return: True if the neighbor accepted it, False if not
+        """
+
+        try:
+            response = self.blockchain.session.post(
+                f"http://{node}/gossip", json=batch, timeout=PEER_TIMEOUT
+            )
+        except requests.RequestException:
+            return False
+        return response.status_code == 200
@@ -0,0 +1,277 @@
+"""Pool of the transactions waiting to go into a block
+
+A `Mempool` holds the pending transactions of a node, keyed by their hash (see
+`merkle.transaction_hash`), so a transaction received twice is detected in O(1)
+and rejected.
+
+The pool is bounded both in number of transactions and in bytes (the size of
+the transaction serialized with `serialization.encode`). When a new transaction
+does not fit, the transactions of lowest priority are evicted to make room, the
+newest first among equal priorities; if the only candidates have a priority at
+least as high as the new transaction, it is rejected instead.
+
+The priority of a transaction is given by a function, which must return a
+non-negative integer. Neither chain has fees that senders sign and pay, and a
+field the sender neither signs nor pays for must not buy priority, so by
+default all transactions have the same priority and the pool is first in,
+first out.
+
+Two heaps index the pool, one from the best transaction and one from the worst,
+so `take` picks the best `k` transactions that fit in a block in O(k log n) and
+eviction pops the worst ones. Removed transactions are left in the heaps and
+skipped when popped; the heaps are rebuilt when they hold more stale keys than
+live ones.
+"""
+
+from collections import OrderedDict
+import heapq
+import time
+
+from merkle import transaction_hash
+from serialization import encode
+
+# Largest number of transactions in a mempool
+MAX_TRANSACTIONS = 100_000
+# Largest total size of the transactions in a mempool, in bytes
+MAX_BYTES = 64_000_000
+# Largest total size of the transactions in a block, in bytes
+BLOCK_SIZE = 1_000_000
+
+
+def fifo_priority(tx):
+    """The default priority of a transaction: 0 for all, so that transactions
+    are taken in order of arrival"""
+    return 0
+
+
+class _Entry:
+    __slots__ = ("tx", "priority", "sequence", "size", "added")
+
+    def __init__(self, tx, priority, sequence, size, added):
+        self.tx = tx
+        self.priority = priority
+        # Order of arrival, which breaks ties between equal priorities
+        self.sequence = sequence
+        self.size = size
+        self.added = added
+
+
+class Mempool:
+    def __init__(
+        self,
+        max_transactions=MAX_TRANSACTIONS,
+        max_bytes=MAX_BYTES,
+        priority=fifo_priority,
+    ):
+        """
+        Create an empty pool
+        :param max_transactions: Largest number of transactions held
+        :param max_bytes: Largest total size of the transactions held
+        :param priority: Function giving the priority of a transaction, a
+            non-negative integer, higher is better
+        """
+
+        self.max_transactions = max_transactions
+        self.max_bytes = max_bytes
+        self.priority = priority
+        # Entries by transaction hash, oldest first
+        self.entries = OrderedDict()
+        # Heaps of (-priority, sequence, hash) and (priority, -sequence, hash)
+        self.best = []
+        self.worst = []
+        self.size = 0
+        self.sequence = 0
+        # Sum of the times the transactions were added, for their mean age
+        self.added_total = 0.0
+        # Number of transactions evicted since the pool was created
+        self.evicted = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __iter__(self):
+        """Iterate over the transactions, oldest first"""
+        return (entry.tx for entry in self.entries.values())
+
+    def __contains__(self, tx_hash):
+        return tx_hash in self.entries
+
+    def add(self, tx):
+        """
+        Add a transaction, evicting transactions of lower priority if the pool
+        is full
+        :param tx: The transaction dict
+        :return: The list of evicted transactions
+        :raise ValueError: If the transaction is already in the pool, has an
+            invalid priority, or does not fit
+        """
+
+        tx_hash = transaction_hash(tx)
+        if tx_hash in self.entries:
+            raise ValueError("Duplicate transaction")
+        size = len(encode(tx))
+        # Checked before the pool changes, since the heaps compare priorities
+        priority = self.priority(tx)
+        if not isinstance(priority, int) or priority < 0:
+            raise ValueError("Invalid priority")
+
+        # Pick the transactions to evict before evicting any, so that a
+        # rejected transaction leaves the pool as it was
+        candidates = []
+        count = len(self.entries) + 1
+        total = self.size + size
+        while count > self.max_transactions or total > self.max_bytes:
+            key = self._pop_live(self.worst)
+            if key is None or key[0] >= priority:
+                if key is not None:
+                    candidates.append(key)
+                for key in candidates:
+                    heapq.heappush(self.worst, key)
+                raise ValueError("Mempool full")
+            candidates.append(key)
+            count -= 1
+            total -= self.entries[key[2]].size
+
+        evicted = [self._remove(key[2]).tx for key in candidates]
+        self.evicted += len(evicted)
+
+        self.sequence += 1
+        entry = _Entry(tx, priority, self.sequence, size, time.monotonic())
+        heapq.heappush(self.best, (-priority, entry.sequence, tx_hash))
+        heapq.heappush(self.worst, (priority, -entry.sequence, tx_hash))
+        self.entries[tx_hash] = entry
+        self.size += size
+        self.added_total += entry.added
+        self._compact()
+        return evicted
+
+    def remove(self, tx_hash):
+        """
+        Remove a transaction, for instance one that was included in a block
+        received from a neighbor
+        :param tx_hash: The hash of the transaction
+        :return: The transaction, or None if it was not in the pool
+        """
+
+        if tx_hash not in self.entries:
+            return None
+        entry = self._remove(tx_hash)
+        self._compact()
+        return entry.tx
+
+    def take(self, max_bytes=BLOCK_SIZE, accept=None):
+        """
+        Remove the best transactions that fit in a block, best first
+
+        Transactions are picked in order of priority until the next one does
+        not fit in `max_bytes`.
+        :param max_bytes: Largest total size of the transactions taken
+        :param accept: Function called on each transaction in turn, which is
+            skipped and left in the pool if it returns False
+        :return: The list of transactions taken
+        """
+
+        taken = []
+        skipped = []
+        total = 0
+        while True:
+            key = self._pop_live(self.best)
+            if key is None:
+                break
+            entry = self.entries[key[2]]
+            if total + entry.size > max_bytes:
+                skipped.append(key)
+                break
+            if accept is not None and not accept(entry.tx):
+                skipped.append(key)
+                continue
+            total += entry.size
+            taken.append(self._remove(key[2]).tx)
+        for key in skipped:
+            heapq.heappush(self.best, key)
+        self._compact()
+        return taken
+
+    def peek(self, limit):
+        """
+        List the best transactions, in the order `take` would pick them,
+        leaving them in the pool
+        :param limit: Largest number of transactions listed
+        :return: The list of transactions
+        """
+
+        entries = heapq.nsmallest(
+            limit,
+            self.entries.values(),
+            key=lambda entry: (-entry.priority, entry.sequence),
+        )
+        return [entry.tx for entry in entries]
+
+    def clear(self):
+        """Remove every transaction"""
+        self.entries.clear()
+        self.best = []
+        self.worst = []
+        self.size = 0
+        self.added_total = 0.0
+
+    def stats(self, now=None):
+        """
+        Describe the depth and age of the pool
+        :param now: The current `time.monotonic()`, if already known
+        :return: <dict>
+        """
+
+        now = time.monotonic() if now is None else now
+        count = len(self.entries)
+        if count:
+            oldest = next(iter(self.entries.values()))
+            oldest_age = now - oldest.added
+            mean_age = now - self.added_total / count
+        else:
+            oldest_age = mean_age = 0.0
+        return {
+            "count": count,
+            "bytes": self.size,
+            "max_transactions": self.max_transactions,
+            "max_bytes": self.max_bytes,
+            "oldest_age": oldest_age,
+            "mean_age": mean_age,
+            "evicted": self.evicted,
+        }
+
+    def _remove(self, tx_hash):
+        """Remove an entry, leaving its heap keys to be skipped when popped"""
+        entry = self.entries.pop(tx_hash)
+        self.size -= entry.size
+        self.added_total -= entry.added
+        return entry
+
+    def _compact(self):
+        """Rebuild the heaps from the live entries if they are mostly stale"""
+        if not self.entries:
+            # Start afresh, which also drops the rounding error of `added_total`
+            self.clear()
+            return
+        if max(len(self.best), len(self.worst)) <= 2 * len(self.entries) + 64:
+            return
+        self.best = [
+            (-entry.priority, entry.sequence, tx_hash)
+            for tx_hash, entry in self.entries.items()
+        ]
+        self.worst = [
+            (entry.priority, -entry.sequence, tx_hash)
+            for tx_hash, entry in self.entries.items()
+        ]
+        heapq.heapify(self.best)
+        heapq.heapify(self.worst)
+
+    def _pop_live(self, heap):
+        """Pop the first key of a heap whose transaction is still in the pool
+        :return: The key, or None if there is none"""
+        while heap:
+            key = heapq.heappop(heap)
+            entry = self.entries.get(key[2])
+            if entry is not None and abs(key[1]) == entry.sequence:
+                return key
+        return None
@@ -0,0 +1,164 @@
+"""
+Background mining jobs
+
+`/mine` starts a `MiningJob` and answers at once, instead of holding the request
+open while the proof of work is searched. The search runs in worker processes
+(see `mining.parallel_search_nonce`) watched by a thread of the node, which
+records the attempts made so far, so the job can be polled for its progress and
+hashrate, and cancelled.
+
+A job mines on top of the block that was the tip of the chain when it started.
+Once the chain has moved on, because a neighbor's block was accepted or the
+node switched to a longer chain, the proof being searched is worthless, so the
+job is cancelled. A node runs one job at a time.
+"""
+
+import itertools
+import threading
+import time
+
+
+class MiningJob:
+    __slots__ = (
+        "id",
+        "index",
+        "previous_hash",
+        "last_block",
+        "status",
+        "reason",
+        "attempts",
+        "started",
+        "finished",
+        "block",
+        "cancelled",
+    )
+
+    def __init__(self, job_id, last_block, previous_hash):
+        self.id = job_id
+        # Index of the block being mined
+        self.index = last_block["index"] + 1
+        self.previous_hash = previous_hash
+        self.last_block = last_block
+        # "running", then "mined", "cancelled" or "failed"
+        self.status = "running"
+        self.reason = None
+        self.attempts = 0
+        self.started = time.time()
+        self.finished = None
+        # The block forged, once mined
+        self.block = None
+        self.cancelled = threading.Event()
+
+    @property
+    def running(self):
+        return self.status == "running"
+
+    def finish(self, status, reason=None):
+        self.status = status
+        self.reason = reason
+        self.finished = time.time()
+
+    def to_dict(self):
+        elapsed = (self.finished or time.time()) - self.started
+        return {
+            "id": self.id,
+            "status": self.status,
+            "reason": self.reason,
+            "index": self.index,
+            "previous_hash": self.previous_hash,
+            "attempts": self.attempts,
+            "elapsed": elapsed,
+            "hashrate": self.attempts / elapsed if elapsed > 0 else 0.0,
+            "block": self.block,
+        }
+
+
+class Miner:
+    def __init__(self, blockchain, forge):
+        """
+        Run the mining jobs of a blockchain
+        :param blockchain: The Blockchain to mine on
+        :param forge: Function called with `blockchain.lock` held, with the
+            proof and the hash of the block it extends, which adds the new
+            block to the chain and returns it, or returns None if the chain
+            no longer ends with that block
+        """
+
+        self.blockchain = blockchain
+        self.forge = forge
+        self.job = None
+        self.ids = itertools.count(1)
+        self.lock = threading.Lock()
+
+    def start(self, workers=1):
+        """
+        Start mining on top of the last block, unless a job is running
+        :param workers: Number of processes to search with, see
+            `Blockchain.proof_of_work`
+        :return: (job, started), where job is the running job and started
+            is False if it was already running
+        """
+
+        with self.lock:
+            if self.job is not None and self.job.running:
+                return self.job, False
+            with self.blockchain.lock:
+                last_block = self.blockchain.last_block
+                previous_hash = self.blockchain.hash(last_block)
+            self.job = MiningJob(next(self.ids), last_block, previous_hash)
+            job = self.job
+        threading.Thread(target=self.run, args=(job, workers), daemon=True).start()
+        return job, True
+
+    def run(self, job, workers):
+        """Search the proof of work of a job, then forge its block"""
+
+        def progress(attempts):
+            job.attempts = attempts
+
+        try:
+            proof = self.blockchain.proof_of_work(
+                job.last_block, workers, progress=progress, cancel=job.cancelled
+            )
+            with self.blockchain.lock:
+                # The job may have been cancelled after the proof was found
+                if proof is None or job.cancelled.is_set():
+                    if job.running:
+                        job.finish("cancelled", "cancelled")
+                    return
+                block = self.forge(proof, job.previous_hash)
+                if block is None:
+                    job.finish("cancelled", "a new block arrived while mining")
+                    return
+                job.block = block
+                job.finish("mined")
+        except Exception as e:
+            job.finish("failed", str(e))
+        finally:
+            job.last_block = None
+
+    def cancel(self, reason="cancelled"):
+        """
+        Cancel the running job
+        :param reason: Why it is cancelled
+        :return: The job, or None if no job is running
+        """
+
+        with self.blockchain.lock:
+            job = self.job
+            if job is None or not job.running:
+                return None
+            job.cancelled.set()
+            job.finish("cancelled", reason)
+            return job
+
+    def tip_changed(self):
+        """Cancel the running job if the chain no longer ends with the block it
+        mines on. Call it with `blockchain.lock` held after the chain changed."""
+        job = self.job
+        if (
+            job is not None
+            and job.running
+            and self.blockchain.hash(self.blockchain.last_block) != job.previous_hash
+        ):
+            self.cancel("a competing block arrived")
@@ -0,0 +1,193 @@
+"""Proof of work mining engine
+
+The data to hash is split around a nonce slot into a prefix and a suffix. The
+SHA-256 state after absorbing the prefix is computed once and copied for every
+attempt, so an attempt only hashes the nonce bytes and the suffix. In
+paynecoin-lite block headers end with a fixed-width nonce (see
+`blockchain.block_header`), so the suffix is empty and an attempt costs the same
+no matter how many transactions the block holds.
+
+`parallel_search_nonce` splits the nonce space into chunks that are searched by
+a pool of worker processes. It can report the attempts made as the chunks are
+settled, and be cancelled between two chunks, so a search can run as a
+background job.
+"""
+
+from collections import deque
+from hashlib import sha256
+from multiprocessing import Pool
+import os
+import queue
+import time
+
+# Number of leading zeros (in hex) a block hash needs
+DIFFICULTY = 5
+# Width in bytes of a fixed-width nonce
+NONCE_WIDTH = 8
+# Number of nonces a worker process searches per task
+CHUNK_SIZE = 50_000
+
+
+def encode_nonce(nonce, encoding="fixed"):
+    """Encode a nonce for hashing
+    :param nonce: <int> The nonce
+    :param encoding: "fixed" for NONCE_WIDTH big-endian bytes, "decimal" for
+        the decimal digits
+    :return: <bytes>"""
+    if encoding == "fixed":
+        return nonce.to_bytes(NONCE_WIDTH, "big")
+    if encoding == "decimal":
+        return str(nonce).encode()
+    raise ValueError(f"Unknown nonce encoding: {encoding}")
+
+
+def meets_difficulty(block_hash, difficulty=DIFFICULTY):
+    """Check that a hex hash has enough leading zeros
+    :param block_hash: The hex digest
+    :param difficulty: Number of leading hex zeros
+    :return: <bool>"""
+    return block_hash.startswith("0" * difficulty)
+
+
+def search_nonce(
+    prefix, difficulty=DIFFICULTY, start=0, stop=None, suffix=b"", encoding="fixed"
+):
+    """Search nonces in [start, stop) for a hash meeting the difficulty
+
+    The hashed data is prefix + encoded nonce + suffix.
+    :param prefix: <bytes> The data before the nonce
+    :param difficulty: Number of leading hex zeros
+    :param start: First nonce to try
+    :param stop: Nonce to stop at (exclusive), or None to search until found
+    :param suffix: <bytes> The data after the nonce
+    :param encoding: How the nonce is encoded, see `encode_nonce`
+    :return: (nonce, attempts), where nonce is the lowest solution in the range
+        or None if there is none
+    """
+    midstate = sha256(prefix)
+    # A digest with `difficulty` leading hex zeros is below this integer
+    target = 1 << (256 - 4 * difficulty)
+    nonce = start
+    while stop is None or nonce < stop:
+        attempt = midstate.copy()
+        attempt.update(encode_nonce(nonce, encoding) + suffix)
+        if int.from_bytes(attempt.digest(), "big") < target:
+            return nonce, nonce - start + 1
+        nonce += 1
+    return None, nonce - start
+
+
+def _search_chunk(prefix, suffix, encoding, difficulty, start, stop):
+    """Worker task for `parallel_search_nonce`"""
+    nonce, attempts = search_nonce(prefix, difficulty, start, stop, suffix, encoding)
+    return start, nonce, attempts
+
+
+def parallel_search_nonce(
+    prefix,
+    difficulty=DIFFICULTY,
+    suffix=b"",
+    encoding="fixed",
+    workers=None,
+    lowest=True,
+    start=0,
+    chunk_size=CHUNK_SIZE,
+    progress=None,
+    cancel=None,
+):
+    """Search for a nonce with a pool of worker processes
+
+    The nonce space from `start` is cut into chunks of `chunk_size` nonces that
+    are handed out to the workers in order. As soon as the answer is known the
+    pool is terminated, which cancels the remaining workers.
+
+    :param prefix: <bytes> The data before the nonce
+    :param difficulty: Number of leading hex zeros
+    :param suffix: <bytes> The data after the nonce
+    :param encoding: How the nonce is encoded, see `encode_nonce`
+    :param workers: Number of worker processes, defaults to the number of CPUs
+    :param lowest: If True, return the lowest valid nonce, which is the same
+        nonce a sequential search finds. If False, return the first one found.
+    :param start: First nonce to try
+    :param chunk_size: Number of nonces per task
+    :param progress: Function called with the number of attempts made so far
+        each time a chunk is settled
+    :param cancel: A `threading.Event`; once it is set, the search stops after
+        the chunk being waited for
+    :return: (nonce, attempts), where nonce is None if the search was cancelled
+    """
+    workers = workers or os.cpu_count() or 1
+    # A search that is watched or may be cancelled runs in worker processes
+    # even with a single worker, so that it does not hold the calling thread
+    if workers == 1 and progress is None and cancel is None:
+        return search_nonce(prefix, difficulty, start, None, suffix, encoding)
+
+    results = queue.Queue()
+    # Starts of the chunks handed out, in order, up to the first unsettled one
+    outstanding = deque()
+    settled = set()
+    best = None
+    attempts = 0
+    next_start = start
+    with Pool(workers) as pool:
+
+        def submit():
+            nonlocal next_start
+            stop = next_start + chunk_size
+            pool.apply_async(
+                _search_chunk,
+                (prefix, suffix, encoding, difficulty, next_start, stop),
+                callback=results.put,
+                error_callback=results.put,
+            )
+            outstanding.append(next_start)
+            next_start = stop
+
+        # Keep every worker busy with a second chunk queued behind it
+        for _ in range(2 * workers):
+            submit()
+        while True:
+            result = results.get()
+            if isinstance(result, BaseException):
+                raise result
+            chunk_start, nonce, chunk_attempts = result
+            attempts += chunk_attempts
+            if progress is not None:
+                progress(attempts)
+            if cancel is not None and cancel.is_set():
+                return None, attempts
+            if nonce is not None:
+                if not lowest:
+                    return nonce, attempts
+                best = nonce if best is None else min(best, nonce)
+            settled.add(chunk_start)
+            while outstanding and outstanding[0] in settled:
+                settled.remove(outstanding.popleft())
+            # Once every chunk below the best solution is settled, it is the
+            # lowest. Leaving the `with` block terminates the remaining workers.
+            if best is not None and (not outstanding or outstanding[0] > best):
+                return best, attempts
+            if best is None:
+                submit()
+
+
+def mine_header(prefix, difficulty=DIFFICULTY, workers=1):
+    """Find the lowest nonce that solves a header prefix
+
+    :param prefix: <bytes> The serialized header, without the nonce
+    :param difficulty: Number of leading hex zeros
+    :param workers: Number of worker processes, see `parallel_search_nonce`
+    :return: <dict> The nonce, hash, number of attempts, time taken and hashes
+        per second
+    """
+    start_time = time.time()
+    nonce, attempts = parallel_search_nonce(prefix, difficulty, workers=workers)
+    elapsed = time.time() - start_time
+    block_hash = sha256(prefix + encode_nonce(nonce)).hexdigest()
+    return {
+        "nonce": nonce,
+        "hash": block_hash,
+        "attempts": attempts,
+        "elapsed": elapsed,
+        "hashrate": attempts / elapsed if elapsed > 0 else float("inf"),
+    }
@@ -0,0 +1,245 @@
+"""Canonical binary serialization of transactions and block headers
+
+Hashes and signatures are computed over this encoding instead of
+`json.dumps(..., sort_keys=True)`. It is deterministic and unambiguous:
+
+- every value starts with a one-byte type tag, so 1, 1.0, True and "1" never
+  encode the same way, and floats are stored bit for bit as IEEE 754 doubles
+- integers are fixed-width 64-bit big-endian (larger ones are length-prefixed)
+- strings, byte fields, lists and dicts are length-prefixed, and dict keys are
+  sorted
+- lowercase hex strings of even length, such as hashes, signatures and
+  addresses, are stored as the raw bytes they spell, at half the size
+- transactions of the usual shape (address sender and receiver, integer amount
+  and timestamp, and optionally a signature) are packed into a fixed layout
+  without field names, and so are block headers of the usual shape (integer
+  index, float timestamp, previous hash and Merkle root)
+
+Objects with a `to_dict` method, such as `block.Block` and `block.Transaction`,
+are encoded as that dict. JSON remains the export view, used by the API and for
+printing. `decode` turns the binary encoding back into plain dicts and lists.
+"""
+
+import re
+import struct
+
+NONE = b"\x00"
+FALSE = b"\x01"
+TRUE = b"\x02"
+INT = b"\x03"
+BIGINT = b"\x04"
+FLOAT = b"\x05"
+STR = b"\x06"
+HEX = b"\x07"
+LIST = b"\x08"
+DICT = b"\x09"
+TRANSACTION = b"\x0a"
+SIGNED_TRANSACTION = b"\x0b"
+HEADER = b"\x0c"
+
+INT_MIN = -(2 ** 63)
+INT_MAX = 2 ** 63 - 1
+
+_int = struct.Struct(">q")
+_float = struct.Struct(">d")
+_length = struct.Struct(">I")
+_key_length = struct.Struct(">H")
+_hex = re.compile(r"(?:[0-9a-f]{2})+")
+
+# Fixed layout of a transaction: sender and receiver addresses (36 bytes each),
+# amount and timestamp, followed by the 64-byte signature if there is one
+_transaction = struct.Struct(">36s36sqq")
+_signed_transaction = struct.Struct(">36s36sqq64s")
+_address = re.compile(r"[0-9a-f]{72}")
+_signature = re.compile(r"[0-9a-f]{128}")
+_transaction_keys = {"sender", "receiver", "amount", "timestamp"}
+_signed_transaction_keys = _transaction_keys | {"signature"}
+
+# Fixed layout of a block header: index, timestamp, previous hash, Merkle root
+_header = struct.Struct(">qd32s32s")
+_hash = re.compile(r"[0-9a-f]{64}")
+_header_keys = {"index", "timestamp", "previous_hash", "merkle_root"}
+
+
+def _pack_transaction(tx):
+    """Pack a transaction of the usual shape, or return None"""
+    keys = tx.keys()
+    signed = keys == _signed_transaction_keys
+    if not signed and keys != _transaction_keys:
+        return None
+    sender, receiver = tx["sender"], tx["receiver"]
+    amount, timestamp = tx["amount"], tx["timestamp"]
+    if not (
+        type(amount) is int
+        and type(timestamp) is int
+        and INT_MIN <= amount <= INT_MAX
+        and INT_MIN <= timestamp <= INT_MAX
+        and type(sender) is str
+        and type(receiver) is str
+        and _address.fullmatch(sender)
+        and _address.fullmatch(receiver)
+    ):
+        return None
+    sender, receiver = bytes.fromhex(sender), bytes.fromhex(receiver)
+    if not signed:
+        return TRANSACTION + _transaction.pack(sender, receiver, amount, timestamp)
+    signature = tx["signature"]
+    if type(signature) is not str or not _signature.fullmatch(signature):
+        return None
+    return SIGNED_TRANSACTION + _signed_transaction.pack(
+        sender, receiver, amount, timestamp, bytes.fromhex(signature)
+    )
+
+
+def _pack_header(header):
+    """Pack a block header of the usual shape, or return None"""
+    if header.keys() != _header_keys:
+        return None
+    index, timestamp = header["index"], header["timestamp"]
+    previous_hash, merkle_root = header["previous_hash"], header["merkle_root"]
+    if not (
+        type(index) is int
+        and INT_MIN <= index <= INT_MAX
+        and type(timestamp) is float
+        and type(previous_hash) is str
+        and type(merkle_root) is str
+        and _hash.fullmatch(previous_hash)
+        and _hash.fullmatch(merkle_root)
+    ):
+        return None
+    return HEADER + _header.pack(
+        index, timestamp, bytes.fromhex(previous_hash), bytes.fromhex(merkle_root)
+    )
+
+
+def _encode(value, out):
+    """Append the encoding of a value to a list of byte strings"""
+    if value is None:
+        out.append(NONE)
+    elif value is True:
+        out.append(TRUE)
+    elif value is False:
+        out.append(FALSE)
+    elif isinstance(value, int):
+        if INT_MIN <= value <= INT_MAX:
+            out.append(INT + _int.pack(value))
+        else:
+            data = value.to_bytes((value.bit_length() + 8) // 8, "big", signed=True)
+            out.append(BIGINT + _length.pack(len(data)) + data)
+    elif isinstance(value, float):
+        out.append(FLOAT + _float.pack(value))
+    elif isinstance(value, str):
+        if _hex.fullmatch(value):
+            data = bytes.fromhex(value)
+            out.append(HEX + _length.pack(len(data)) + data)
+        else:
+            data = value.encode()
+            out.append(STR + _length.pack(len(data)) + data)
+    elif isinstance(value, dict):
+        packed = _pack_transaction(value)
+        if packed is None:
+            packed = _pack_header(value)
+        if packed is not None:
+            out.append(packed)
+            return
+        out.append(DICT + _length.pack(len(value)))
+        for key in sorted(value):
+            data = key.encode()
+            out.append(_key_length.pack(len(data)) + data)
+            _encode(value[key], out)
+    elif isinstance(value, (list, tuple)):
+        out.append(LIST + _length.pack(len(value)))
+        for item in value:
+            _encode(item, out)
+    elif hasattr(value, "to_dict"):
+        _encode(value.to_dict(), out)
+    else:
+        raise TypeError(f"Cannot serialize {type(value).__name__}")
+
+
+def encode(value) -> bytes:
+    """Serialize a transaction, header or any JSON-like value
+    :param value: A dict, list, str, int, float, bool or None
+    :return: <bytes> The canonical encoding"""
+    out = []
+    _encode(value, out)
+    return b"".join(out)
+
+
+def _decode(data, position):
+    """Decode the value starting at `position`, return it and the next position"""
+    tag = data[position : position + 1]
+    position += 1
+    if tag == INT:
+        return _int.unpack_from(data, position)[0], position + 8
+    if tag == FLOAT:
+        return _float.unpack_from(data, position)[0], position + 8
+    if tag in (STR, HEX, BIGINT):
+        (length,) = _length.unpack_from(data, position)
+        position += 4
+        raw = data[position : position + length]
+        if len(raw) != length:
+            raise ValueError("Truncated data")
+        position += length
+        if tag == STR:
+            return raw.decode(), position
+        if tag == HEX:
+            return raw.hex(), position
+        return int.from_bytes(raw, "big", signed=True), position
+    if tag == DICT:
+        (count,) = _length.unpack_from(data, position)
+        position += 4
+        value = {}
+        for _ in range(count):
+            (length,) = _key_length.unpack_from(data, position)
+            position += 2
+            key = data[position : position + length].decode()
+            position += length
+            value[key], position = _decode(data, position)
+        return value, position
+    if tag == LIST:
+        (count,) = _length.unpack_from(data, position)
+        position += 4
+        value = []
+        for _ in range(count):
+            item, position = _decode(data, position)
+            value.append(item)
+        return value, position
+    if tag in (TRANSACTION, SIGNED_TRANSACTION):
+        layout = _transaction if tag == TRANSACTION else _signed_transaction
+        fields = layout.unpack_from(data, position)
+        value = {
+            "sender": fields[0].hex(),
+            "receiver": fields[1].hex(),
+            "amount": fields[2],
+            "timestamp": fields[3],
+        }
+        if tag == SIGNED_TRANSACTION:
+            value["signature"] = fields[4].hex()
+        return value, position + layout.size
+    if tag == HEADER:
+        fields = _header.unpack_from(data, position)
+        value = {
+            "index": fields[0],
+            "timestamp": fields[1],
+            "previous_hash": fields[2].hex(),
+            "merkle_root": fields[3].hex(),
+        }
+        return value, position + _header.size
+    if tag == NONE:
+        return None, position
+    if tag == TRUE:
+        return True, position
+    if tag == FALSE:
+        return False, position
+    raise ValueError(f"Unknown type tag {tag!r}")
+
+
+def decode(data):
+    """Deserialize the output of `encode`
+    :param data: <bytes>
+    :return: The value"""
+    value, position = _decode(bytes(data), 0)
+    if position != len(data):
+        raise ValueError("Trailing data")
+    return value
@@ -4,19 +4,23 @@ The spawned nodes will be on 5001, 5002, 5003, 5004, 5005 by default with uuids
 alice, bob, carol, dave, and eve respectively.
 """
 
+import json
 import os
 import subprocess
+import time
 import requests
 import secrets
 from random import randrange
 from hashlib import sha256
 import random
 
+from analytics import ChainColumns
+
 
 def req_endpoint(endpoint, port=5001, data=None):
     """Send a request to a specific endpoint on a specific port"""
     # Check valid request
-    get_reqs = ["/nodes/resolve", "/chain", "/mine", "/wallets"]
+    get_reqs = ["/nodes/resolve", "/chain", "/mine", "/mine/status", "/wallets"]
     post_reqs = ["/nodes/register", "/transaction"]
     if endpoint not in get_reqs + post_reqs:
         print("invalid request")
@@ -36,6 +40,15 @@ def req_endpoint(endpoint, port=5001, data=None):
     return req.json()
 
 
+def mine(port):
+    """Start mining on a node and wait for the job to finish"""
+    job = req_endpoint("/mine", port=port)["job"]
+    while job["status"] == "running":
+        time.sleep(0.1)
+        job = req_endpoint("/mine/status", port=port)
+    return job
+
+
 def simulate_transaction(sender, recipient, amount):
     transaction = {"sender": sender, "recipient": recipient, "amount": amount}
     return transaction
@@ -64,7 +77,6 @@ nodes_register_body = {"nodes": [f"http://127.0.0.1:{port}" for port in ports]}
 for port in ports:
     req_endpoint("/nodes/register", port=port, data=nodes_register_body)
 
-balances = {uuid: [] for uuid in nodes_uuids}
 nperiods = 10
 
 print(f"Simulating {nperiods} periods of transactions between {nodes_uuids}")
@@ -83,33 +95,30 @@ for t in range(nperiods):
     # Send a random percentage of sender's tokens to recipient
     amount = random.random() * current_balances[sender]
     transaction = simulate_transaction(sender, recipient, amount)
-    # Broadcast transaction to all nodes
-    for port in ports:
-        req_endpoint(
-            "/transaction",
-            port=port,
-            data=transaction,
-        )
+    # Post the transaction to one node, which gossips it to the others
+    req_endpoint("/transaction", port=random.choice(ports), data=transaction)
+    time.sleep(1)
     # Randomly select a miner. This is similar but not equivalent to all miners
     # mining at the same time, with one randomly winning
     miner = random.choice(nodes_uuids)
     print(f"Miner: {miner} for period {t+1}")
-    req_endpoint("/mine", port=nodes_dict.get(miner))
+    mine(port=nodes_dict.get(miner))
 
-    # Broadcast the new block to all nodes and update their wallets
-    for node_port in nodes_dict.values():
-        req_endpoint("/nodes/resolve", port=node_port)
+    # The miner gossips the new block, and the nodes update their wallets
+    time.sleep(1)
 
-    # Update balances post-transaction and post-mining reward
-    current_balances = req_endpoint("/wallets", port=5001)
-    for uuid in nodes_uuids:
-        if uuid in current_balances.keys():
-            balances[uuid].append(current_balances[uuid]["balance"])
-        else:
-            balances[uuid].append(0)
+# Compute the balances after each block from the chain, streamed one block per
+# line, instead of asking the nodes for them after each period
+response = requests.get("http://127.0.0.1:5001/chain?format=ndjson", stream=True)
+chain = (json.loads(line) for line in response.iter_lines() if line)
+columns = ChainColumns.from_chain(chain)
+balances = dict(zip(nodes_uuids, columns.balance_matrix(nodes_uuids)))
+supply = columns.money_supply()
 
 print("Balance history is:")
 print(balances)
+print("Money supply is:")
+print(supply)
 
 # Plot balances over time for each user
 
@@ -0,0 +1,91 @@
+"""Snapshots of ledger state, to restart a node without replaying its chain
+
+A snapshot holds some state derived from a chain, such as the balances of
+paynecoin-lite or the wallets of paynecoin-full, tagged with the height (number
+of blocks) and the hash of the last block it covers. A node restarting on a
+`BlockStore` loads the newest snapshot that matches its chain and only replays
+the blocks after it.
+
+Each snapshot is a file `snapshot-<height>.bin` in the directory of the store,
+holding a magic header, a CRC-32 and the snapshot serialized with
+`serialization.encode`. It is written to a temporary file first and renamed, so
+a crash never leaves a partial snapshot under its final name. Only the newest
+`keep` snapshots are kept.
+"""
+
+import os
+import re
+import struct
+import zlib
+
+from serialization import decode, encode
+
+MAGIC = b"PAYNSNP1"
+_checksum = struct.Struct(">I")
+_file_name = re.compile(r"snapshot-(\d+)\.bin")
+
+
+def save_snapshot(directory, height, block_hash, state, keep=2):
+    """Write a snapshot and delete the older ones beyond `keep`
+    :param directory: Directory of the snapshots
+    :param height: Number of blocks the state covers
+    :param block_hash: Hash of the last block the state covers
+    :param state: The state, any value `serialization.encode` accepts
+    :param keep: Number of snapshots to keep"""
+    payload = encode({"height": height, "block_hash": block_hash, "state": state})
+    path = os.path.join(directory, f"snapshot-{height:012d}.bin")
+    with open(path + ".tmp", "wb") as file:
+        file.write(MAGIC + _checksum.pack(zlib.crc32(payload)) + payload)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(path + ".tmp", path)
+
+    for old_height in snapshot_heights(directory)[keep:]:
+        os.remove(os.path.join(directory, f"snapshot-{old_height:012d}.bin"))
+
+
+def snapshot_heights(directory):
+    """List the heights of the snapshots in a directory, newest first"""
+    heights = []
+    for name in os.listdir(directory):
+        match = _file_name.fullmatch(name)
+        if match:
+            heights.append(int(match.group(1)))
+    return sorted(heights, reverse=True)
+
+
+def read_snapshot(directory, height):
+    """Read the snapshot at a height
+    :return: <dict> The "height", "block_hash" and "state" of the snapshot, or
+        None if it is corrupt"""
+    path = os.path.join(directory, f"snapshot-{height:012d}.bin")
+    with open(path, "rb") as file:
+        data = file.read()
+    header = len(MAGIC) + _checksum.size
+    if len(data) < header or not data.startswith(MAGIC):
+        return None
+    (checksum,) = _checksum.unpack_from(data, len(MAGIC))
+    payload = data[header:]
+    if zlib.crc32(payload) != checksum:
+        return None
+    return decode(payload)
+
+
+def latest_snapshot(directory, chain, block_hash):
+    """Find the newest snapshot that matches a chain
+
+    A snapshot matches if the chain has a block at its height with its hash,
+    so snapshots of blocks dropped by `BlockStore.truncate` are skipped.
+    :param directory: Directory of the snapshots
+    :param chain: A blockchain
+    :param block_hash: The function hashing a block, `Blockchain.hash`
+    :return: The snapshot, see `read_snapshot`, or None"""
+    for height in snapshot_heights(directory):
+        if not 0 < height <= len(chain):
+            continue
+        snapshot = read_snapshot(directory, height)
+        if snapshot is not None and snapshot["block_hash"] == block_hash(
+            chain[height - 1]
+        ):
+            return snapshot
+    return None
@@ -0,0 +1,109 @@
+"""Test that the wallets follow a switch to a competing chain, through the undo
+log and past it, and report the transactions dropped with our blocks"""
+
+from collections import deque
+import tempfile
+
+from block_store import BlockStore
+from blockchain import Blockchain, Wallet, Wallets
+
+
+def build_branches():
+    """Build two chains forking after block 2: ours mines p then q in blocks 3
+    and 4, the competing one mines q and r in block 3, then an empty block"""
+    blockchain = Blockchain()
+    blockchain.new_transaction("0", "alice", 10, timestamp=1)
+    blockchain.new_block(100, None)
+    prefix = list(blockchain.chain)
+
+    p = {"sender": "alice", "recipient": "bob", "amount": 3, "timestamp": 2}
+    q = {"sender": "alice", "recipient": "carol", "amount": 2, "timestamp": 3}
+    r = {"sender": "bob", "recipient": "carol", "amount": 1, "timestamp": 4}
+    blockchain.add_transaction(p)
+    blockchain.new_block(101, None)
+    blockchain.add_transaction(q)
+    blockchain.new_block(102, None)
+    ours = list(blockchain.chain)
+
+    blockchain.chain = list(prefix)
+    blockchain.add_transaction(q)
+    blockchain.add_transaction(r)
+    blockchain.new_block(103, None)
+    blockchain.new_block(104, None)
+    theirs = list(blockchain.chain)
+    return ours, theirs, (p, q, r)
+
+
+def replayed(chain):
+    wallets = Wallets()
+    wallets.sync(chain)
+    return wallets.summaries()
+
+
+def test_wallets_reorg():
+    ours, theirs, (p, q, r) = build_branches()
+    fork = 2
+
+    # Through the undo log: q is mined again, p is dropped
+    wallets = Wallets()
+    wallets.sync(ours)
+    assert wallets.sync(theirs) == [p]
+    assert wallets.summaries() == replayed(theirs)
+
+    # Past the undo log, which only holds the block of q: q is still not
+    # reported as dropped, and p, from an older block, is not known here
+    wallets = Wallets()
+    wallets.undo = deque(maxlen=1)
+    wallets.sync(ours)
+    assert wallets.sync(theirs) == []
+    assert wallets.summaries() == replayed(theirs)
+
+    # The blockchain reports every transaction dropped with its blocks
+    blockchain = Blockchain()
+    blockchain.chain = list(ours)
+    assert blockchain.replace_chain(fork, theirs[fork:]) == [p]
+    assert blockchain.chain == theirs
+
+    # The same with a chain kept in a BlockStore, whose wallets are rebuilt
+    # from the store
+    with tempfile.TemporaryDirectory() as directory:
+        with BlockStore(directory) as store:
+            store.extend(ours)
+            blockchain = Blockchain(store=store)
+            wallets = Wallets()
+            wallets.undo = deque(maxlen=1)
+            wallets.restore(store)
+            print(f"Wallets before the switch: {wallets.summaries()}")
+            assert blockchain.replace_chain(fork, theirs[fork:]) == [p]
+            assert wallets.sync(store) == []
+            assert wallets.summaries() == replayed(theirs)
+            print(f"Wallets after the switch: {wallets.summaries()}")
+
+
+def test_wallet_amounts():
+    # Integer amounts stay integers, and exact past the precision of a float
+    wallet = Wallet()
+    big = 2 ** 53 + 1
+    wallet.update(big, 1)
+    wallet.update(-2, 2)
+    assert wallet.balance == big - 2 and type(wallet.balance) is int
+    assert wallet.history()["history"][1] == {"amount": -2, "block": 2}
+    for _ in range(1000):
+        wallet.update(3, 3)
+        wallet.pop()
+    wallet.pop()
+    assert wallet.balance == big and type(wallet.balance) is int
+
+    # Past 64 bits, and with fractional amounts, the history holds Python
+    # numbers
+    wallet.update(2 ** 63, 4)
+    wallet.update(0.5, 5)
+    assert wallet.balance == big + 2 ** 63 + 0.5
+    restored = Wallet.from_dict(wallet.to_dict())
+    assert restored.to_dict() == wallet.to_dict()
+    assert Wallet.from_dict(Wallet(7, [7], [1]).to_dict()).balance == 7
+
+
+if __name__ == "__main__":
+    test_wallets_reorg()
+    test_wallet_amounts()
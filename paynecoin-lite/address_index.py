@@ -0,0 +1,132 @@
+"""Secondary index of the transactions of a chain, by address and by hash
+
+For each address, the index keeps the transactions touching it in chain order:
+the height of their block, their position in it, the change to the balance of
+the address and its balance right after. The history of an address is then a
+slice of its entries, and its balance at any height a binary search over them,
+instead of a scan of the chain. Transactions are also located by their hash
+(see `merkle.transaction_hash`).
+
+The height of a block is its index, so the genesis block is at height 0, and
+the balance at a height is the balance after the block at that height.
+
+Blocks are added one at a time, in chain order, as they are sealed. Entries are
+kept in arrays of 64-bit integers, so an entry costs a few dozen bytes. The
+amounts and balances of an address switch to lists of Python numbers once one
+of them is not a 64-bit integer, so they are returned exactly as
+`Blockchain.get_balance` computes them.
+"""
+
+from array import array
+from bisect import bisect_right
+
+from merkle import transaction_hash
+
+INT_MIN = -(2 ** 63)
+INT_MAX = 2 ** 63 - 1
+
+
+class _History:
+    __slots__ = ("heights", "positions", "deltas", "balances")
+
+    def __init__(self):
+        self.heights = array("q")
+        self.positions = array("q")
+        self.deltas = array("q")
+        self.balances = array("q")
+
+    def __len__(self):
+        return len(self.heights)
+
+    def append(self, height, position, delta):
+        balance = (self.balances[-1] if self.balances else 0) + delta
+        if isinstance(self.deltas, array) and not (
+            type(delta) is int
+            and INT_MIN <= delta <= INT_MAX
+            and INT_MIN <= balance <= INT_MAX
+        ):
+            self.deltas = list(self.deltas)
+            self.balances = list(self.balances)
+        self.heights.append(height)
+        self.positions.append(position)
+        self.deltas.append(delta)
+        self.balances.append(balance)
+
+
+class AddressIndex:
+    def __init__(self):
+        # History of each address
+        self.addresses = {}
+        # (height, position) of each transaction by hash
+        self.transactions = {}
+        # Height of the last block added, -1 before the genesis block
+        self.height = -1
+
+    def add_block(self, block):
+        """Index the transactions of the block after the last one added
+
+        The genesis block (index 0) only credits receivers, as in
+        `Blockchain.apply_block_balances`.
+        :param block: The block"""
+        height = block["index"]
+        genesis = height == 0
+        for position, tx in enumerate(block["transactions"]):
+            self.transactions[transaction_hash(tx)] = (height, position)
+            sender = tx["sender"]
+            receiver = tx["receiver"]
+            amount = tx["amount"]
+            if genesis:
+                self._history(receiver).append(height, position, amount)
+            elif sender == receiver:
+                self._history(sender).append(height, position, 0)
+            else:
+                self._history(sender).append(height, position, -amount)
+                self._history(receiver).append(height, position, amount)
+        self.height = height
+
+    def locate(self, tx_hash):
+        """Find a transaction by its hash
+        :param tx_hash: The hash of the transaction
+        :return: (height, position) of the transaction, or None if it is not in
+            the chain"""
+        return self.transactions.get(tx_hash)
+
+    def history(self, address, offset=0, limit=None):
+        """List the transactions touching an address, oldest first
+        :param address: The address
+        :param offset: Number of entries to skip
+        :param limit: Largest number of entries, all if None
+        :return: A list of dicts with the height and position of the
+            transaction, the change to the balance and the balance after it"""
+        entries = self.addresses.get(address)
+        if entries is None:
+            return []
+        stop = len(entries) if limit is None else min(offset + limit, len(entries))
+        return [
+            {
+                "height": entries.heights[i],
+                "position": entries.positions[i],
+                "amount": entries.deltas[i],
+                "balance": entries.balances[i],
+            }
+            for i in range(offset, stop)
+        ]
+
+    def balance_at(self, address, height=None):
+        """Look up the balance of an address after the block at a height
+        :param address: The address
+        :param height: The height, the last block if None
+        :return: The balance"""
+        entries = self.addresses.get(address)
+        if entries is None:
+            return 0
+        if height is None:
+            return entries.balances[-1]
+        count = bisect_right(entries.heights, height)
+        return entries.balances[count - 1] if count else 0
+
+    def _history(self, address):
+        entries = self.addresses.get(address)
+        if entries is None:
+            entries = self.addresses[address] = _History()
+        return entries
@@ -0,0 +1,211 @@
+"""Vectorized analytics over the transactions of a chain
+
+`ChainColumns` converts a chain into one NumPy array per transaction field:
+the id of the sender and of the receiver in a table of addresses, the amount
+and the position of the block in the chain. Everything else is computed from
+those arrays without a Python loop over the transactions, for instance the
+balance of every address after every block with `balance_matrix`, a grouped
+sum followed by a cumulative sum along the blocks.
+
+A transaction is minted, crediting its receiver without debiting its sender,
+if it is in the genesis block of paynecoin-lite (index 0) or is a mining reward
+of paynecoin-full (sender "0"); its sender id is then -1. The receiver is the
+"receiver" field in paynecoin-lite and "recipient" in paynecoin-full.
+"""
+
+import numpy as np
+
+# Sender id of minted transactions
+MINTED = -1
+
+
+class ColumnConverter:
+    """Convert blocks into transaction columns, one batch of blocks at a time,
+    numbering the addresses across batches"""
+
+    def __init__(self):
+        # Id of each address, in order of first appearance
+        self.ids = {}
+        # Number of blocks converted so far
+        self.blocks = 0
+
+    def convert(self, blocks):
+        """
+        Convert the transactions of the next blocks of a chain
+        :param blocks: The blocks, any iterable
+        :return: A dict of arrays: "sender", "receiver", "amount", "block" and
+            "timestamp" (the timestamp of each transaction as a float, 0 if it
+            has none)
+        """
+
+        ids = self.ids
+        senders = []
+        receivers = []
+        amounts = []
+        timestamps = []
+        counts = []
+        start = self.blocks
+        for block in blocks:
+            self.blocks += 1
+            transactions = block["transactions"]
+            counts.append(len(transactions))
+            if not transactions:
+                continue
+            receiver_key = "receiver" if "receiver" in transactions[0] else "recipient"
+            genesis = block["index"] == 0
+            for tx in transactions:
+                sender = tx["sender"]
+                if genesis or sender == "0":
+                    senders.append(MINTED)
+                else:
+                    sender_id = ids.get(sender)
+                    if sender_id is None:
+                        sender_id = ids[sender] = len(ids)
+                    senders.append(sender_id)
+                receiver = tx[receiver_key]
+                receiver_id = ids.get(receiver)
+                if receiver_id is None:
+                    receiver_id = ids[receiver] = len(ids)
+                receivers.append(receiver_id)
+                amounts.append(tx["amount"])
+                timestamps.append(tx.get("timestamp", 0))
+        return {
+            "sender": np.array(senders, dtype=np.int32),
+            "receiver": np.array(receivers, dtype=np.int32),
+            "amount": np.array(amounts, dtype=np.float64),
+            "block": np.repeat(
+                np.arange(start, self.blocks, dtype=np.int64),
+                np.array(counts, dtype=np.int64),
+            ),
+            "timestamp": np.array(timestamps, dtype=np.float64),
+        }
+
+    def address_table(self):
+        """The addresses seen so far, as a fixed-width bytes array indexed by id"""
+        return np.array([address.encode() for address in self.ids], dtype=np.bytes_)
+
+
+class ChainColumns:
+    __slots__ = ("addresses", "sender", "receiver", "amount", "block", "blocks")
+
+    def __init__(self, addresses, sender, receiver, amount, block, blocks):
+        """
+        Hold the transactions of a chain as columns
+        :param addresses: <bytes array> The table of addresses, UTF-8 encoded,
+            indexed by id
+        :param sender: <int32 array> Id of the sender of each transaction,
+            MINTED for minted transactions
+        :param receiver: <int32 array> Id of the receiver of each transaction
+        :param amount: <float64 array> Amount of each transaction
+        :param block: <int64 array> Position in the chain of the block holding
+            each transaction, in increasing order
+        :param blocks: Number of blocks in the chain
+        """
+
+        self.addresses = addresses
+        self.sender = sender
+        self.receiver = receiver
+        self.amount = amount
+        self.block = block
+        self.blocks = blocks
+
+    def __len__(self):
+        return len(self.amount)
+
+    @classmethod
+    def from_chain(cls, chain):
+        """
+        Convert the transactions of a chain
+        :param chain: The blocks, a list, a BlockStore or any iterable
+        :return: <ChainColumns>
+        """
+
+        converter = ColumnConverter()
+        columns = converter.convert(chain)
+        return cls(
+            converter.address_table(),
+            columns["sender"],
+            columns["receiver"],
+            columns["amount"],
+            columns["block"],
+            converter.blocks,
+        )
+
+    def address(self, address_id):
+        """The address with an id, as a string"""
+        return self.addresses[address_id].decode()
+
+    def address_ids(self, addresses):
+        """
+        Look up the ids of addresses
+        :param addresses: A list of addresses, as strings
+        :return: <int array> Their ids, -1 for addresses not in the chain
+        """
+
+        # Binary search in the sorted table, which also works on a table
+        # mapped from disk without decoding it
+        wanted = np.array([address.encode() for address in addresses], dtype=np.bytes_)
+        if not len(self.addresses):
+            return np.full(len(wanted), -1, dtype=np.int64)
+        order = np.argsort(self.addresses, kind="stable")
+        found = np.searchsorted(self.addresses, wanted, sorter=order)
+        ids = order[np.minimum(found, len(order) - 1)].astype(np.int64)
+        ids[self.addresses[ids] != wanted] = -1
+        return ids
+
+    def balance_changes(self, addresses=None):
+        """
+        Sum the changes to the balance of addresses in each block
+        :param addresses: A list of addresses, all of them in the order of
+            `self.addresses` if None
+        :return: <float64 array> of shape (addresses, blocks)
+        """
+
+        if addresses is None:
+            rows = np.arange(len(self.addresses))
+        else:
+            rows = self.address_ids(addresses)
+        # Row of each address id in the result, -1 for addresses left out
+        row_of = np.full(len(self.addresses) + 1, -1, dtype=np.int64)
+        known = rows >= 0
+        row_of[rows[known]] = np.arange(len(rows))[known]
+
+        # Credits to the receivers and debits from the senders, as flat cells
+        # of the result, which bincount sums in one pass
+        receiver_rows = row_of[self.receiver]
+        # MINTED senders map to the last entry of `row_of`, which is -1
+        sender_rows = row_of[self.sender]
+        credited = receiver_rows >= 0
+        debited = sender_rows >= 0
+        cells = np.concatenate(
+            (
+                receiver_rows[credited] * self.blocks + self.block[credited],
+                sender_rows[debited] * self.blocks + self.block[debited],
+            )
+        )
+        weights = np.concatenate((self.amount[credited], -self.amount[debited]))
+        changes = np.bincount(cells, weights, minlength=len(rows) * self.blocks)
+        return changes.reshape(len(rows), self.blocks)
+
+    def balance_matrix(self, addresses=None):
+        """
+        Compute the balance of addresses after each block
+        :param addresses: A list of addresses, all of them in the order of
+            `self.addresses` if None
+        :return: <float64 array> of shape (addresses, blocks), where row i
+            column j is the balance of address i after block j
+        """
+
+        return np.cumsum(self.balance_changes(addresses), axis=1)
+
+    def money_supply(self):
+        """
+        Compute the amount minted up to each block
+        :return: <float64 array> of length blocks
+        """
+
+        minted = self.sender == MINTED
+        created = np.bincount(
+            self.block[minted], self.amount[minted], minlength=self.blocks
+        )
+        return np.cumsum(created)
@@ -0,0 +1,87 @@
+"""Measure how long computing the balances of every address after every block takes
+
+Builds an in-memory chain of `blocks` blocks of `block_size` transactions
+between `accounts` addresses, then computes the address x block balance matrix
+twice: with the nested loops `simulation.balances_over_time` used, recording
+each balance after each block, and with `analytics.ChainColumns`. The
+transactions are not signed, since balances do not depend on signatures.
+"""
+
+import os
+import time
+
+import numpy as np
+
+from analytics import ChainColumns
+from utils import bytes_to_address
+
+
+def build_chain(blocks, block_size, accounts):
+    """Build a chain of unsigned transactions between `accounts` addresses"""
+    addresses = [bytes_to_address(os.urandom(32)) for _ in range(accounts)]
+    chain = [
+        {
+            "index": 0,
+            "transactions": [
+                {"sender": address, "receiver": address, "amount": 1000}
+                for address in addresses
+            ],
+        }
+    ]
+    for index in range(1, blocks):
+        chain.append(
+            {
+                "index": index,
+                "transactions": [
+                    {
+                        "sender": addresses[(index + i) % accounts],
+                        "receiver": addresses[(index * 7 + i) % accounts],
+                        "amount": i % 10,
+                    }
+                    for i in range(block_size)
+                ],
+            }
+        )
+    return chain, addresses
+
+
+def loop_balances(chain, addresses):
+    """The balance of each address after each block, with Python loops"""
+    balances = {address: 0 for address in addresses}
+    balances_time = {address: [] for address in addresses}
+    for block in chain:
+        genesis = block["index"] == 0
+        for tx in block["transactions"]:
+            if not genesis:
+                balances[tx["sender"]] -= tx["amount"]
+            balances[tx["receiver"]] += tx["amount"]
+        for address in addresses:
+            balances_time[address].append(balances[address])
+    return balances_time
+
+
+def main(blocks=10_000, block_size=100, accounts=1000):
+    chain, addresses = build_chain(blocks, block_size, accounts)
+    transactions = sum(len(block["transactions"]) for block in chain)
+    print(f"{transactions:,} transactions in {blocks:,} blocks, {accounts} addresses")
+
+    start_time = time.perf_counter()
+    expected = loop_balances(chain, addresses)
+    print(f"Python loops: {time.perf_counter() - start_time:.2f}s")
+
+    start_time = time.perf_counter()
+    columns = ChainColumns.from_chain(chain)
+    converted = time.perf_counter()
+    matrix = columns.balance_matrix(addresses)
+    elapsed = time.perf_counter() - start_time
+    print(
+        f"ChainColumns: {elapsed:.2f}s, of which {converted - start_time:.2f}s"
+        f" converting the chain and {time.perf_counter() - converted:.2f}s"
+        " computing the matrix"
+    )
+
+    assert np.array_equal(matrix, [expected[address] for address in addresses])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+"""Measure how long exporting a chain to columns and reopening it take
+
+Writes a chain of `blocks` blocks of `block_size` transactions to a BlockStore
+(see `bench_startup.build_store`), exports it with `chain_export.export_chain`,
+then compares reloading the export, which maps the files, with converting the
+stored chain again with `analytics.ChainColumns.from_chain`, and computing the
+balance matrix from each.
+"""
+
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+
+from analytics import ChainColumns
+from bench_startup import build_store
+from block_store import BlockStore
+from blockchain import Blockchain
+from chain_export import export_chain, load_chain
+
+
+def directory_size(directory):
+    return sum(
+        os.path.getsize(os.path.join(directory, name)) for name in os.listdir(directory)
+    )
+
+
+def main(blocks=5000, block_size=200):
+    directory = tempfile.mkdtemp()
+    store_directory = os.path.join(directory, "store")
+    export_directory = os.path.join(directory, "export")
+    try:
+        build_store(store_directory, blocks, block_size)
+        with BlockStore(store_directory) as store:
+            ledger = Blockchain(starting_transactions=[], store=store)
+
+            start_time = time.perf_counter()
+            _, transactions = export_chain(ledger, export_directory)
+            print(
+                f"Exported {blocks:,} blocks and {transactions:,} transactions"
+                f" ({directory_size(export_directory) / 1e6:.0f} MB)"
+                f" in {time.perf_counter() - start_time:.2f}s"
+            )
+
+            start_time = time.perf_counter()
+            converted = ChainColumns.from_chain(store)
+            elapsed = time.perf_counter() - start_time
+            print(f"Converting the stored chain: {elapsed:.2f}s")
+
+        start_time = time.perf_counter()
+        export = load_chain(export_directory)
+        columns = export.columns()
+        print(f"Loading the export: {(time.perf_counter() - start_time) * 1000:.1f}ms")
+
+        start_time = time.perf_counter()
+        matrix = columns.balance_matrix()
+        print(
+            f"Balance matrix of the loaded export:"
+            f" {time.perf_counter() - start_time:.2f}s"
+        )
+        assert np.array_equal(matrix, converted.balance_matrix())
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    main()
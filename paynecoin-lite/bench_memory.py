@@ -0,0 +1,92 @@
+"""Measure the memory taken by a chain of plain dicts and by a chain of Blocks
+
+Builds the same chain of `n` transactions, in blocks of `block_size`, once as
+plain dicts (the shape blocks and transactions had before `block.Block`) and
+once as Blocks holding Transactions, and reports the memory allocated for each
+with `tracemalloc`. The field values are created beforehand and shared, so only
+the containers are measured. The last run also hashes every transaction, to
+include the digests that Transactions cache.
+"""
+
+import os
+import time
+import tracemalloc
+
+from block import Block
+from merkle import transactions_root
+from utils import bytes_to_address
+
+
+def measure(build):
+    """Return the object built by `build` and the bytes it allocated"""
+    tracemalloc.start()
+    value = build()
+    allocated, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return value, allocated
+
+
+def main(n=1_000_000, block_size=100):
+    addresses = [bytes_to_address(os.urandom(32)) for _ in range(1000)]
+    transactions = [
+        {
+            "sender": addresses[i % 1000],
+            "receiver": addresses[(i * 7 + 1) % 1000],
+            "amount": i % 1000,
+            "timestamp": 1_700_000_000_000_000_000 + i,
+            "signature": os.urandom(64).hex(),
+        }
+        for i in range(n)
+    ]
+    headers = [
+        {
+            "nonce": i,
+            "index": i,
+            "timestamp": time.time(),
+            "merkle_root": os.urandom(32).hex(),
+            "previous_hash": os.urandom(32).hex(),
+        }
+        for i in range(n // block_size)
+    ]
+
+    def dict_chain():
+        return [
+            dict(
+                header,
+                transactions=[
+                    dict(tx) for tx in transactions[i * block_size : (i + 1) * block_size]
+                ],
+            )
+            for i, header in enumerate(headers)
+        ]
+
+    def block_chain():
+        return [
+            Block(
+                header,
+                transactions=transactions[i * block_size : (i + 1) * block_size],
+            )
+            for i, header in enumerate(headers)
+        ]
+
+    def hashed_block_chain():
+        chain = block_chain()
+        for block in chain:
+            transactions_root(block["transactions"])
+        return chain
+
+    for name, build in (
+        ("dicts", dict_chain),
+        ("Blocks", block_chain),
+        ("Blocks, hashed", hashed_block_chain),
+    ):
+        chain, allocated = measure(build)
+        print(
+            f"{name:>14}: {allocated / 2 ** 20:8.1f} MiB for {n:,} transactions,"
+            f" {allocated / n:6.1f} B per transaction"
+        )
+        del chain
+
+
+if __name__ == "__main__":
+    main()
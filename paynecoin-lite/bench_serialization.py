@@ -0,0 +1,74 @@
+"""Benchmark the binary serialization against the JSON path it replaces
+
+Measures encoding and decoding throughput, and encoded size, of transactions and
+block headers with `serialization` and with `json.dumps(..., sort_keys=True)`.
+"""
+
+import json
+import time
+
+from blockchain import header_fields
+from merkle import transactions_root
+from serialization import decode, encode
+from utils import generate_keys, create_transaction, public_key_to_address
+
+
+def throughput(function, values, repeat=3):
+    """Return the best number of calls per second over `repeat` runs"""
+    best = 0
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        for value in values:
+            function(value)
+        elapsed = time.perf_counter() - start_time
+        best = max(best, len(values) / elapsed)
+    return best
+
+
+def json_encode(value):
+    return json.dumps(value, sort_keys=True).encode()
+
+
+def main(n=20_000):
+    keys = [generate_keys() for _ in range(10)]
+    addresses = [public_key_to_address(public_key) for _, public_key in keys]
+    transactions = [
+        create_transaction(
+            keys[i % 10][0], addresses[i % 10], addresses[(i + 1) % 10], i
+        )
+        for i in range(n)
+    ]
+    headers = [
+        header_fields(
+            {
+                "index": i,
+                "timestamp": time.time(),
+                "transactions": [],
+                "merkle_root": transactions_root(transactions[i : i + 1]),
+                "previous_hash": transactions_root(transactions[i + 1 : i + 2]),
+            }
+        )
+        for i in range(n)
+    ]
+
+    for name, values in (("transactions", transactions), ("headers", headers)):
+        binary = [encode(value) for value in values]
+        text = [json_encode(value) for value in values]
+        print(f"{name} ({n:,}):")
+        print(
+            f"  size    json {sum(map(len, text)) / n:8.1f} B"
+            f"   binary {sum(map(len, binary)) / n:8.1f} B"
+        )
+        print(
+            f"  encode  json {throughput(json_encode, values):10,.0f}/s"
+            f"   binary {throughput(encode, values):10,.0f}/s"
+        )
+        print(
+            f"  decode  json {throughput(json.loads, text):10,.0f}/s"
+            f"   binary {throughput(decode, binary):10,.0f}/s"
+        )
+        assert [decode(data) for data in binary] == values
+
+
+if __name__ == "__main__":
+    main()
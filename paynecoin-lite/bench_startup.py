@@ -0,0 +1,94 @@
+"""Measure how long a node takes to restart on a large stored chain
+
+Writes a chain of `blocks` blocks of `block_size` transactions to a BlockStore,
+then times opening a `Blockchain` on it, first replaying the whole chain and
+then from a snapshot taken `behind` blocks before the tip. The transactions are
+not signed, since restoring the balances does not verify signatures.
+"""
+
+import os
+import shutil
+import tempfile
+import time
+
+from block_store import BlockStore
+from blockchain import Blockchain
+from snapshot import save_snapshot
+from utils import bytes_to_address
+
+
+def build_store(directory, blocks, block_size):
+    """Write a chain of unsigned transactions between 1000 addresses"""
+    addresses = [bytes_to_address(os.urandom(32)) for _ in range(1000)]
+    with BlockStore(directory, sync_every=1000) as store:
+        genesis = [
+            {"sender": address, "receiver": address, "amount": 10 ** 9, "timestamp": 0}
+            for address in addresses
+        ]
+        previous_hash = "1"
+        for index in range(blocks):
+            transactions = genesis if index == 0 else [
+                {
+                    "sender": addresses[(index + i) % 1000],
+                    "receiver": addresses[(index * 7 + i) % 1000],
+                    "amount": i,
+                    "timestamp": index,
+                    "signature": os.urandom(64).hex(),
+                }
+                for i in range(block_size)
+            ]
+            block = {
+                "nonce": 0,
+                "index": index,
+                "timestamp": time.time(),
+                "transactions": transactions,
+                "merkle_root": os.urandom(32).hex(),
+                "previous_hash": previous_hash,
+            }
+            store.append(block)
+            previous_hash = Blockchain.hash(store[-1])
+
+
+def open_ledger(directory):
+    """Open a Blockchain on the store, return it and the seconds it took"""
+    start_time = time.perf_counter()
+    store = BlockStore(directory)
+    ledger = Blockchain(starting_transactions=[], store=store)
+    return ledger, time.perf_counter() - start_time
+
+
+def main(blocks=5000, block_size=100, behind=100):
+    directory = tempfile.mkdtemp()
+    try:
+        start_time = time.perf_counter()
+        build_store(directory, blocks, block_size)
+        print(
+            f"Wrote {blocks:,} blocks of {block_size} transactions"
+            f" in {time.perf_counter() - start_time:.1f}s"
+        )
+
+        ledger, elapsed = open_ledger(directory)
+        print(f"Restart replaying the whole chain: {elapsed:.2f}s")
+        balances = ledger.get_balances()
+
+        # Snapshot the balances `behind` blocks before the tip
+        height = blocks - behind
+        snapshot_balances = dict(balances)
+        for position in reversed(range(height, blocks)):
+            ledger.revert_block_balances(snapshot_balances, ledger.chain[position])
+        save_snapshot(
+            directory, height, Blockchain.hash(ledger.chain[height - 1]), snapshot_balances
+        )
+        ledger.chain.close()
+
+        ledger, elapsed = open_ledger(directory)
+        assert ledger.snapshot_height == height
+        assert ledger.get_balances() == balances
+        print(f"Restart from a snapshot {behind} blocks behind: {elapsed:.2f}s")
+        ledger.chain.close()
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""Measure how long validating a synced chain takes, sequentially and in parallel
+
+Builds an in-memory chain of `blocks` blocks of `block_size` signed
+transactions between `accounts` addresses, then validates it with fresh
+Blockchains, so that nothing is cached from an earlier validation: with
+`valid_chain` as it runs by default, with `valid_chain` verifying signatures
+over `workers` processes, and with `first_invalid_block` checking shards of the
+chain over `workers` processes.
+"""
+
+import os
+import time
+
+from blockchain import Blockchain
+from utils import create_transaction, generate_keys, public_key_to_address
+
+
+def build_chain(blocks, block_size, accounts):
+    """Build a valid chain of signed transactions between `accounts` addresses"""
+    keys = []
+    for _ in range(accounts):
+        private_key, public_key = generate_keys()
+        keys.append((private_key, public_key_to_address(public_key)))
+    genesis = [
+        create_transaction(private_key, address, address, 1_000_000)
+        for private_key, address in keys
+    ]
+    ledger = Blockchain(starting_transactions=genesis)
+    for index in range(1, blocks):
+        transactions = []
+        for i in range(block_size):
+            private_key, sender = keys[(index + i) % accounts]
+            receiver = keys[(index * 7 + i) % accounts][1]
+            transactions.append(
+                create_transaction(private_key, sender, receiver, i % 10 + 1)
+            )
+        ledger.new_block(
+            previous_hash=Blockchain.hash(ledger.chain[-1]),
+            transactions=transactions,
+        )
+    return genesis, ledger.chain
+
+
+def main(blocks=2000, block_size=50, accounts=100, workers=None):
+    workers = workers or os.cpu_count()
+    genesis, chain = build_chain(blocks, block_size, accounts)
+    transactions = sum(len(block["transactions"]) for block in chain)
+    print(f"{transactions:,} signed transactions in {blocks:,} blocks")
+
+    ledger = Blockchain(starting_transactions=genesis)
+    start_time = time.perf_counter()
+    assert ledger.valid_chain(chain)
+    sequential = time.perf_counter() - start_time
+    print(f"valid_chain: {sequential:.2f}s")
+
+    ledger = Blockchain(starting_transactions=genesis)
+    ledger.verify_workers = workers
+    start_time = time.perf_counter()
+    assert ledger.valid_chain(chain)
+    elapsed = time.perf_counter() - start_time
+    print(
+        f"valid_chain, signatures over {workers} processes: {elapsed:.2f}s"
+        f" ({sequential / elapsed:.1f}x)"
+    )
+
+    ledger = Blockchain(starting_transactions=genesis)
+    start_time = time.perf_counter()
+    assert ledger.first_invalid_block(chain, workers) is None
+    elapsed = time.perf_counter() - start_time
+    print(
+        f"first_invalid_block, {workers} processes: {elapsed:.2f}s"
+        f" ({sequential / elapsed:.1f}x)"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,19 +1,143 @@
 from hashlib import sha256
 import json
+from multiprocessing import Pool
 from time import time
 from urllib.parse import urlparse
 import requests
 
+from address_index import AddressIndex
+from block import Block
+from block_store import BlockStore
+from mempool import BLOCK_SIZE, Mempool
+from merkle import merkle_proof, transaction_hash, transactions_root
+from mining import encode_nonce
+from serialization import encode
+from snapshot import latest_snapshot, save_snapshot
+from utils import (
+    has_canonical_fields,
+    is_address,
+    is_from_sender,
+    to_address,
+    verify_transactions,
+)
+
+
+def header_fields(block):
+    """Collect the fields of a block header, except the nonce
+
+    The header holds every field of the block except the transactions, which
+    enter only through their Merkle root. Blocks built without a `merkle_root`
+    field get one computed from their transactions.
+    :param block: Block dict
+    :return: <dict>"""
+    header = {k: v for k, v in block.items() if k not in ("transactions", "nonce")}
+    if "merkle_root" not in header:
+        header["merkle_root"] = transactions_root(block["transactions"])
+    return header
+
+
+def block_header_prefix(block):
+    """Serialize every field of a block header except the nonce
+
+    A miner can serialize the prefix once and vary nothing but the nonce.
+    :param block: Block dict
+    :return: <bytes>"""
+    return encode(header_fields(block))
+
+
+def block_header(block):
+    """Serialize a block header, ending with the fixed-width nonce
+    :param block: Block dict
+    :return: <bytes>"""
+    return block_header_prefix(block) + encode_nonce(block["nonce"])
+
+
+def check_shard(blocks, previous_hash):
+    """Check a run of consecutive blocks for `Blockchain.first_invalid_block`
+
+    Only the checks that do not depend on the balances are made: the
+    signatures of the transactions, the Merkle roots and the hash links, so
+    runs can be checked independently, in worker processes.
+    :param blocks: The blocks
+    :param previous_hash: Hash of the block before the run, None if the run
+        starts the chain
+    :return: The position in the run of the first invalid block, or None"""
+    signed = verify_transactions(
+        [tx for block in blocks for tx in block["transactions"]]
+    )
+    end = 0
+    for position, block in enumerate(blocks):
+        start, end = end, end + len(block["transactions"])
+        if not all(signed[start:end]) or not Blockchain.valid_merkle_root(block):
+            return position
+        if previous_hash is not None and block["previous_hash"] != previous_hash:
+            return position
+        previous_hash = Blockchain.hash(block)
+    return None
+
 
 class Blockchain:
-    def __init__(self, starting_transactions):
+    # Number of processes used to verify signatures, see `utils.verify_transactions`
+    verify_workers = 1
+    # Number of blocks `valid_chain` checks at a time, and so holds in memory
+    validate_window = 1000
+    # Number of processes `valid_chain` spreads the blocks over, see
+    # `first_invalid_block`
+    validate_workers = 1
+    # Number of blocks between two snapshots of the balances of a chain kept in
+    # a BlockStore, see `take_snapshot`
+    snapshot_interval = 1000
+    # Largest total size of the transactions of a block, in bytes
+    block_size = BLOCK_SIZE
+
+    def __init__(self, starting_transactions, store=None, mempool=None):
         """Initialize the blockchain.
 
-        :param starting_transactions: A list of transactions to start the blockchain with"""
-        self.current_transactions = starting_transactions
-        self.chain = []
-        # Spawn the genesis block
-        self.new_block(previous_hash="1")
+        :param starting_transactions: A list of transactions to start the blockchain with
+        :param store: A `BlockStore` to keep the chain in, instead of a list. If
+            the store already holds a chain, the blockchain continues it,
+            restoring the balances from its newest snapshot (see
+            `load_balances`), and `starting_transactions` are ignored.
+        :param mempool: The `Mempool` holding the pending transactions, a
+            default one if None"""
+        self.mempool = Mempool() if mempool is None else mempool
+        self.chain = [] if store is None else store
+        # Materialized balance index: `confirmed_balances` holds the balances
+        # after the last sealed block, `pending_balances` holds the net effect
+        # of the transactions waiting in the mempool
+        self.confirmed_balances = {}
+        self.pending_balances = {}
+        # Height of the last snapshot of `confirmed_balances`
+        self.snapshot_height = 0
+        # Index of the transactions by address and hash, see `address_index`.
+        # A stored chain is indexed on the first query rather than on opening.
+        self._address_index = None if len(self.chain) else AddressIndex()
+        # Verified-prefix cache: the blocks of the last chain that passed
+        # `valid_chain`, and the balances after them
+        self.verified_blocks = []
+        self.verified_balances = {}
+        self.verified_mutations = Block.mutations
+        # For a BlockStore, the store, its truncation count and its length
+        # instead of the blocks
+        self.verified_store = None
+        if len(self.chain):
+            # The genesis block is already stored
+            self.load_balances()
+        else:
+            # Spawn the genesis block
+            self.new_block(previous_hash="1", transactions=starting_transactions)
+
+    @property
+    def current_transactions(self):
+        """The pending transactions, oldest first"""
+        return list(self.mempool)
+
+    @current_transactions.setter
+    def current_transactions(self, transactions):
+        # Call `rebuild_balances` afterwards
+        self.mempool.clear()
+        for tx in transactions:
+            self.mempool.add(tx)
 
     def add_transaction(self, tx: dict) -> int:
         """
@@ -21,122 +145,515 @@ class Blockchain:
         :param tx: The transaction dict
         :return: The index of the Block that will hold this transaction
         """
-        # TODO: Verify that the transaction is validly signed
+        # Verify that the transaction is validly signed
+        if not is_from_sender(tx):
+            raise ValueError("Invalid signature")
+
+        return self._admit_transaction(tx)
+
+    def add_transactions(self, transactions) -> list:
+        """
+        Adds many transactions, verifying their signatures as one batch
+        :param transactions: An iterable of transaction dicts
+        :return: A list with, for each transaction, the index of the Block that
+            will hold it or the ValueError it was rejected with
+        """
+        transactions = list(transactions)
+        signed = verify_transactions(transactions, self.verify_workers)
+        results = []
+        for tx, is_signed in zip(transactions, signed):
+            try:
+                if not is_signed:
+                    raise ValueError("Invalid signature")
+                results.append(self._admit_transaction(tx))
+            except ValueError as e:
+                results.append(e)
+        return results
 
-        # end TODO
+    def _admit_transaction(self, tx):
+        """Add a transaction whose signature was verified to the pending pool"""
+        # The mempool detects duplicates by hash, which unsigned fields change
+        if not has_canonical_fields(tx):
+            raise ValueError("Unexpected transaction fields")
+        # Coins sent to anything but an address could never be spent
+        if not is_address(tx["receiver"]):
+            raise ValueError("Invalid receiver address")
 
         # Verify that the sender has enough funds to send this amount
-        balances = self.get_balances()
         sender = tx["sender"]
         receiver = tx["receiver"]
         amount = tx["amount"]
-        if (sender not in balances.keys()) or (amount > balances[sender]):
+        known = sender in self.confirmed_balances or sender in self.pending_balances
+        balance = self.confirmed_balances.get(sender, 0) + self.pending_balances.get(
+            sender, 0
+        )
+        if (not known) or (amount > balance):
             raise ValueError("Not enough money to send")
-        else:
-            self.current_transactions.append(tx)
+        evicted = self.mempool.add(tx)
+        self.apply_pending(tx, 1)
+        for old_tx in evicted:
+            self.apply_pending(old_tx, -1)
         return self.last_block["index"] + 1
 
+    def apply_pending(self, tx, sign):
+        """Add (sign 1) or remove (sign -1) the effect of a pending transaction
+        on `pending_balances`"""
+        amount = sign * tx["amount"]
+        sender = tx["sender"]
+        receiver = tx["receiver"]
+        self.pending_balances[sender] = self.pending_balances.get(sender, 0) - amount
+        self.pending_balances[receiver] = (
+            self.pending_balances.get(receiver, 0) + amount
+        )
+
+    def take_transactions(self):
+        """Take the best pending transactions that fit in a block
+
+        Transactions are taken in order of priority (see `mempool.Mempool`)
+        while they fit in `block_size` bytes. A transaction its sender cannot
+        pay for with the confirmed balance and the transactions taken before
+        it, such as one spending a pending payment that is not taken, is left
+        in the mempool for a later block.
+        :return: The list of transactions"""
+        deltas = {}
+
+        def affordable(tx):
+            sender = tx["sender"]
+            receiver = tx["receiver"]
+            amount = tx["amount"]
+            balance = self.confirmed_balances.get(sender, 0) + deltas.get(sender, 0)
+            if amount > balance:
+                return False
+            deltas[sender] = deltas.get(sender, 0) - amount
+            deltas[receiver] = deltas.get(receiver, 0) + amount
+            return True
+
+        transactions = self.mempool.take(self.block_size, accept=affordable)
+        for tx in transactions:
+            self.apply_pending(tx, -1)
+        return transactions
+
+    def get_balance(self, public_key):
+        """Look up the balance of a single public key, including pending transactions
+        :param public_key: The address or public key, as a string
+        :return: The balance"""
+        public_key = to_address(public_key)
+        return self.confirmed_balances.get(public_key, 0) + self.pending_balances.get(
+            public_key, 0
+        )
+
     def get_balances(self):
-        """Generate a dict of balances for each public key
+        """Generate a dict of balances for each address
+
+        Reads the materialized balance index rather than replaying the chain.
         :return: A dict of balances"""
-        balances = {}
-        # Start with whatever was received in the genesis block
-        for tx in self.chain[0]["transactions"]:
+        balances = dict(self.confirmed_balances)
+        for key, delta in self.pending_balances.items():
+            balances[key] = balances.get(key, 0) + delta
+        return balances
+
+    @staticmethod
+    def apply_block_balances(balances, block):
+        """Apply the transactions of a block to a dict of balances in place
+
+        The genesis block (index 0) only credits receivers.
+        :param balances: A dict of balances
+        :param block: The block to apply
+        :return: The updated dict of balances"""
+        genesis = block["index"] == 0
+        for tx in block["transactions"]:
             receiver = tx["receiver"]
-            if receiver in balances.keys():
-                balances[receiver] += tx["amount"]
-            else:
-                balances[receiver] = tx["amount"]
-        # Cycle through subsequent blocks and add or subtract amounts
-        for block in self.chain[1:]:
-            for tx in block["transactions"]:
+            amount = tx["amount"]
+            if not genesis:
                 sender = tx["sender"]
-                receiver = tx["receiver"]
-                amount = tx["amount"]
-                balances[sender] -= amount
-                if receiver in balances.keys():
-                    balances[receiver] += amount
-                else:
-                    balances[receiver] = amount
-        # Cycle through current pending transactions and add or subtract amounts
-        for tx in self.current_transactions:
-            sender = tx["sender"]
-            receiver = tx["receiver"]
+                balances[sender] = balances.get(sender, 0) - amount
+            balances[receiver] = balances.get(receiver, 0) + amount
+        return balances
+
+    @staticmethod
+    def revert_block_balances(balances, block):
+        """Undo `apply_block_balances` for a block, in place
+        :param balances: A dict of balances
+        :param block: The block to revert
+        :return: The updated dict of balances"""
+        genesis = block["index"] == 0
+        for tx in block["transactions"]:
             amount = tx["amount"]
-            balances[sender] -= amount
-            if receiver in balances.keys():
-                balances[receiver] += amount
-            else:
-                balances[receiver] = amount
+            if not genesis:
+                balances[tx["sender"]] += amount
+            balances[tx["receiver"]] -= amount
         return balances
 
+    def rebuild_balances(self):
+        """Rebuild the balance index by replaying the chain and the pending pool
+
+        Only needed if `chain` or `current_transactions` were modified directly.
+        The address index is rebuilt on the next query.
+        """
+        self._address_index = None
+        self.confirmed_balances = {}
+        for block in self.chain:
+            self.apply_block_balances(self.confirmed_balances, block)
+        self.pending_balances = {}
+        for tx in self.mempool:
+            self.apply_pending(tx, 1)
+
+    @property
+    def address_index(self):
+        """The `AddressIndex` of the chain, built by replaying it if needed"""
+        if self._address_index is None:
+            index = AddressIndex()
+            for block in self.chain:
+                index.add_block(block)
+            self._address_index = index
+        return self._address_index
+
+    def address_history(self, public_key, offset=0, limit=None):
+        """List the confirmed transactions touching an address, oldest first
+        :param public_key: The address or public key, as a string
+        :param offset: Number of entries to skip
+        :param limit: Largest number of entries, all if None
+        :return: A list of dicts, see `AddressIndex.history`"""
+        return self.address_index.history(to_address(public_key), offset, limit)
+
+    def balance_at(self, public_key, height=None):
+        """Look up the confirmed balance of an address after a block
+        :param public_key: The address or public key, as a string
+        :param height: Index of the block, the last one if None
+        :return: The balance"""
+        return self.address_index.balance_at(to_address(public_key), height)
+
+    def locate_transaction(self, tx_hash):
+        """Find a confirmed transaction by its hash
+        :param tx_hash: The hash of the transaction, see `merkle.transaction_hash`
+        :return: (block index, position), or None if it is not in the chain"""
+        return self.address_index.locate(tx_hash)
+
+    def load_balances(self):
+        """Restore the balance index of a stored chain from its newest snapshot
+
+        Only the blocks after the snapshot are replayed, or the whole chain if
+        no snapshot matches it.
+        :return: The height of the snapshot used, or 0"""
+        snapshot = latest_snapshot(self.chain.directory, self.chain, self.hash)
+        if snapshot is None:
+            self.rebuild_balances()
+            return 0
+        self.confirmed_balances = snapshot["state"]
+        for position in range(snapshot["height"], len(self.chain)):
+            self.apply_block_balances(self.confirmed_balances, self.chain[position])
+        self.pending_balances = {}
+        self.snapshot_height = snapshot["height"]
+        return self.snapshot_height
+
+    def take_snapshot(self):
+        """Snapshot the confirmed balances of a chain kept in a BlockStore"""
+        # The snapshot must not cover blocks that could still be lost
+        self.chain.sync()
+        save_snapshot(
+            self.chain.directory,
+            len(self.chain),
+            self.hash(self.chain[-1]),
+            self.confirmed_balances,
+        )
+        self.snapshot_height = len(self.chain)
+
+    def seal_block(self, block):
+        """Append a block built from transactions taken from the mempool (see
+        `take_transactions`) and confirm them
+        :param block: The new block
+        :return: The new block"""
+        block = Block(block)
+        self.chain.append(block)
+        self.apply_block_balances(self.confirmed_balances, block)
+        if self._address_index is not None:
+            self._address_index.add_block(block)
+        if (
+            isinstance(self.chain, BlockStore)
+            and len(self.chain) - self.snapshot_height >= self.snapshot_interval
+        ):
+            self.take_snapshot()
+        return block
+
+    def verified_prefix(self, chain):
+        """Count the blocks at the start of a chain that were already verified
+
+        These are the leading blocks of `chain` that are the very same Block
+        objects as in the last chain that passed `valid_chain`, or for a
+        BlockStore, the blocks it held when it passed `valid_chain`. Modifying
+        any Block since then empties the cache.
+        :param chain: A blockchain
+        :return: The number of verified blocks"""
+        if Block.mutations != self.verified_mutations:
+            self.verified_blocks = []
+            self.verified_balances = {}
+            self.verified_mutations = Block.mutations
+            self.verified_store = None
+        if isinstance(chain, BlockStore):
+            # Stored blocks only change when the store is truncated
+            if self.verified_store is None:
+                return 0
+            store, truncations, length = self.verified_store
+            if store is not chain or truncations != chain.truncations:
+                return 0
+            return length
+        count = 0
+        for block, verified in zip(chain, self.verified_blocks):
+            if block is not verified:
+                break
+            count += 1
+        return count
+
+    def remember_verified(self, chain, balances):
+        """Cache a chain that passed `valid_chain`
+
+        Only the leading Block objects are cached, since plain dicts cannot
+        report modifications. A BlockStore is cached whole.
+        :param chain: The verified blockchain
+        :param balances: The balances after the whole chain"""
+        self.verified_mutations = Block.mutations
+        if isinstance(chain, BlockStore):
+            self.verified_blocks = []
+            self.verified_balances = dict(balances)
+            self.verified_store = (chain, chain.truncations, len(chain))
+            return
+        self.verified_store = None
+        count = 0
+        for block in chain:
+            if not isinstance(block, Block):
+                break
+            count += 1
+        balances = dict(balances)
+        for block in reversed(chain[count:]):
+            self.revert_block_balances(balances, block)
+        self.verified_blocks = chain[:count]
+        self.verified_balances = balances
+
     def valid_chain(self, chain):
         """
         Determine if a given blockchain is valid
+
+        Blocks already verified as the start of a previous chain (see
+        `verified_prefix`) are not checked again, so validating a chain that
+        extends a valid one only checks the new blocks. The new blocks are
+        checked `validate_window` at a time, so a chain kept in a BlockStore is
+        never loaded into memory whole.
         :param chain: A blockchain
         :return: True if valid, False if not
         """
 
-        # Check that balances are positive
-        balances = self.get_balances()
-        for sender, balance in balances.items():
-            if balance < 0:
-                return False
+        if self.validate_workers > 1:
+            return self.first_invalid_block(chain, self.validate_workers) is None
 
-        # Cycle through each block in the chain and check conditions
-        last_block = chain[0]
-        current_index = 1
-        while current_index < len(chain):
-            block = chain[current_index]
+        verified = self.verified_prefix(chain)
 
-            # Check that the hash of the block is correct
-            last_block_hash = self.hash(last_block)
-            if block["previous_hash"] != last_block_hash:
-                return False
+        if verified:
+            # Roll the cached balances back to the end of the shared prefix
+            balances = dict(self.verified_balances)
+            for block in reversed(self.verified_blocks[verified:]):
+                self.revert_block_balances(balances, block)
+            last_block = chain[verified - 1]
+        else:
+            balances = {}
+            last_block = None
+
+        # One pool verifies the signatures of every window
+        pool = Pool(self.verify_workers) if self.verify_workers > 1 else None
+        try:
+            for start in range(verified, len(chain), self.validate_window):
+                blocks = chain[start : start + self.validate_window]
 
-            # If this blockchain implemented proof of work, we would need to check
-            # that here for each block
+                # Check that transactions are all validly signed in the new blocks,
+                # verifying them as one batch
+                new_transactions = [
+                    tx for block in blocks for tx in block["transactions"]
+                ]
+                if not all(verify_transactions(new_transactions, pool=pool)):
+                    return False
 
-            # TODO: check that transactions are all validly signed in this block
+                # Cycle through each new block in the chain and check conditions
+                for block in blocks:
+                    # Replay balances block by block and check that they stay positive
+                    self.apply_block_balances(balances, block)
+                    if last_block is not None and any(
+                        balances[tx["sender"]] < 0 for tx in block["transactions"]
+                    ):
+                        return False
 
-            # end TODO
+                    # Check that the transactions match the Merkle root in the header
+                    if not self.valid_merkle_root(block):
+                        return False
 
-            last_block = block
-            current_index += 1
+                    # Check that the hash of the block is correct
+                    if last_block is not None:
+                        last_block_hash = self.hash(last_block)
+                        if block["previous_hash"] != last_block_hash:
+                            return False
 
+                    # If this blockchain implemented proof of work, we would need to
+                    # check that here for each block
+
+                    last_block = block
+        finally:
+            if pool is not None:
+                pool.terminate()
+
+        self.remember_verified(chain, balances)
         return True
 
-    def new_block(self, previous_hash):
+    def first_invalid_block(self, chain, workers=1):
+        """
+        Find the first invalid block of a chain, checking the blocks in
+        parallel
+
+        The checks of `valid_chain` that do not depend on the balances (see
+        `check_shard`) are independent from one block to the next, given the
+        hash of the block before. The new blocks are cut into shards that a
+        pool of `workers` processes checks at the same time, `validate_window`
+        blocks per worker at a time, while the balances are replayed here in
+        chain order. The result is the block at which `valid_chain` would stop.
+        :param chain: A blockchain
+        :param workers: Number of processes
+        :return: The position of the first invalid block in the chain, or None
+            if the chain is valid
+        """
+
+        verified = self.verified_prefix(chain)
+
+        if verified:
+            # Roll the cached balances back to the end of the shared prefix
+            balances = dict(self.verified_balances)
+            for block in reversed(self.verified_blocks[verified:]):
+                self.revert_block_balances(balances, block)
+            last_block = chain[verified - 1]
+        else:
+            balances = {}
+            last_block = None
+
+        # Several shards per worker, so that a slow shard does not hold up the
+        # others
+        shards = 4 * workers
+        window = self.validate_window * workers
+        pool = Pool(workers) if workers > 1 else None
+        try:
+            for start in range(verified, len(chain), window):
+                blocks = chain[start : start + window]
+                size = -(-len(blocks) // shards)
+                tasks = []
+                for offset in range(0, len(blocks), size):
+                    before = blocks[offset - 1] if offset else last_block
+                    tasks.append(
+                        (
+                            blocks[offset : offset + size],
+                            None if before is None else self.hash(before),
+                        )
+                    )
+                if pool is None:
+                    results = [check_shard(*task) for task in tasks]
+                else:
+                    results = pool.starmap(check_shard, tasks, chunksize=1)
+                offsets = range(0, len(blocks), size)
+                invalid = min(
+                    (
+                        offset + position
+                        for offset, position in zip(offsets, results)
+                        if position is not None
+                    ),
+                    default=len(blocks),
+                )
+
+                # Replay balances block by block and check that they stay
+                # positive, up to the first block that failed the other checks
+                for position, block in enumerate(blocks[:invalid]):
+                    self.apply_block_balances(balances, block)
+                    if last_block is not None and any(
+                        balances[tx["sender"]] < 0 for tx in block["transactions"]
+                    ):
+                        return start + position
+                    last_block = block
+                if invalid < len(blocks):
+                    return start + invalid
+        finally:
+            if pool is not None:
+                pool.terminate()
+
+        self.remember_verified(chain, balances)
+        return None
+
+    def new_block(self, previous_hash, transactions=None):
         """
         Create a new Block in the Blockchain
         :param previous_hash: Hash of previous Block
+        :param transactions: The transactions of the block, taken from the
+            mempool if None (see `take_transactions`)
         :return: New Block
         """
 
+        if transactions is None:
+            transactions = self.take_transactions()
         block = {
             "nonce": 0,
             "index": len(self.chain),
             "timestamp": time(),
-            "transactions": self.current_transactions,
+            "transactions": transactions,
+            "merkle_root": transactions_root(transactions),
             "previous_hash": previous_hash or self.hash(self.chain[-1]),
         }
 
-        # Reset the current list of transactions
-        self.current_transactions = []
-
-        self.chain.append(block)
-        return block
+        return self.seal_block(block)
 
     @property
     def last_block(self):
         return self.chain[-1]
 
+    @staticmethod
+    def valid_merkle_root(block):
+        """Check that the transactions of a block match its Merkle root
+        :param block: Block dict
+        :return: <bool>"""
+        if "merkle_root" not in block:
+            return True
+        return block["merkle_root"] == transactions_root(block["transactions"])
+
+    def transaction_proof(self, block_index, position):
+        """Build a Merkle inclusion proof for a transaction in the chain
+
+        A light client holding the header can check the proof with
+        `merkle.verify_merkle_proof(transaction_hash, proof, header["merkle_root"])`
+        and the header itself against the chain of block hashes.
+        :param block_index: Index of the block holding the transaction
+        :param position: Position of the transaction in the block
+        :return: <dict> The block header, the transaction hash and the proof"""
+        block = self.chain[block_index]
+        tx_hashes = [transaction_hash(tx) for tx in block["transactions"]]
+        header = header_fields(block)
+        header["nonce"] = block["nonce"]
+        return {
+            "header": header,
+            "block_hash": self.hash(block),
+            "transaction_hash": tx_hashes[position],
+            "proof": merkle_proof(tx_hashes, position),
+        }
+
     @staticmethod
     def hash(block):
         """
         Create a SHA-256 hash of a Block (or any dictionary)
+
+        Blocks are identified by the hash of their binary header (see
+        `block_header`), which a Block caches along with the hash, so a header
+        returned by `transaction_proof` hashes to its block's hash.
         :param block: Dict
         """
+        if isinstance(block, Block):
+            # Blocks cache their hash until they are modified
+            if block.cached_hash is None:
+                if block.cached_header is None:
+                    block.cached_header = block_header(block)
+                block.cached_hash = sha256(block.cached_header).hexdigest()
+            return block.cached_hash
+        if "nonce" in block and ("transactions" in block or "merkle_root" in block):
+            return sha256(block_header(block)).hexdigest()
         # Note: recent versions of python use ordered dicts, so the
         # sort_keys=True parameter is not needed
         block_string = json.dumps(block, sort_keys=True).encode()
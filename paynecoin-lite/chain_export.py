@@ -0,0 +1,214 @@
+"""Columnar export of a chain, reopened by memory mapping
+
+`export_chain` writes the blocks and transactions of a `Blockchain` of either
+package as two tables of fixed-width columns, one file of raw little-endian
+values per column, plus a table of addresses that the transactions refer to by
+id (see `analytics.ColumnConverter`):
+
+- `transactions.<column>.bin`: sender, receiver, amount, block (position of its
+  block in the chain) and timestamp
+- `blocks.<column>.bin`: index, timestamp, nonce (the "proof" in
+  paynecoin-full), first (position of its first transaction), hash,
+  previous_hash and merkle_root, the hashes as ASCII hex
+- `addresses.bin`: the addresses, UTF-8 encoded and padded to the longest
+- `index.json`: the format version and the dtype and length of each file
+
+The chain is converted and written a batch of blocks at a time, so exporting
+holds one batch in memory, not the whole chain. `index.json` is written last,
+so a directory whose export did not finish cannot be loaded.
+
+`load_chain` maps the files into memory with `numpy.memmap` instead of reading
+them, so it takes the same time whatever the size of the chain, and pages are
+read from disk as they are used.
+"""
+
+import json
+import os
+
+import numpy as np
+
+from analytics import ChainColumns, ColumnConverter
+
+FORMAT = "paynecoin-columns"
+VERSION = 1
+INDEX = "index.json"
+# Number of blocks converted and written at a time
+BATCH_BLOCKS = 10_000
+
+TRANSACTION_DTYPES = {
+    "sender": "<i4",
+    "receiver": "<i4",
+    "amount": "<f8",
+    "block": "<i8",
+    "timestamp": "<f8",
+}
+BLOCK_DTYPES = {
+    "index": "<i8",
+    "timestamp": "<f8",
+    "nonce": "<i8",
+    "first": "<i8",
+    "hash": "S64",
+    "previous_hash": "S64",
+    "merkle_root": "S64",
+}
+
+
+def export_chain(blockchain, directory, batch_blocks=BATCH_BLOCKS):
+    """
+    Write the chain of a Blockchain as columns
+    :param blockchain: The Blockchain, of paynecoin-lite or paynecoin-full
+    :param directory: Directory to write to, created if needed. An export
+        already there is replaced.
+    :param batch_blocks: Number of blocks converted at a time
+    :return: The number of blocks and of transactions written
+    """
+
+    os.makedirs(directory, exist_ok=True)
+    index_path = os.path.join(directory, INDEX)
+    if os.path.exists(index_path):
+        os.remove(index_path)
+
+    chain = blockchain.chain
+    converter = ColumnConverter()
+    transactions = 0
+    dtypes = {}
+    for table, table_dtypes in (
+        ("transactions", TRANSACTION_DTYPES),
+        ("blocks", BLOCK_DTYPES),
+    ):
+        dtypes.update({(table, name): dtype for name, dtype in table_dtypes.items()})
+    files = {}
+    try:
+        for table, name in dtypes:
+            path = os.path.join(directory, f"{table}.{name}.bin")
+            files[table, name] = open(path, "wb")
+
+        for start in range(0, len(chain), batch_blocks):
+            stop = min(start + batch_blocks, len(chain))
+            blocks = [chain[i] for i in range(start, stop)]
+            columns = converter.convert(blocks)
+            counts = np.array([len(block["transactions"]) for block in blocks])
+            first = transactions + np.cumsum(counts) - counts
+            transactions += int(counts.sum())
+            columns = {("transactions", name): array for name, array in columns.items()}
+            columns["blocks", "index"] = [block["index"] for block in blocks]
+            columns["blocks", "timestamp"] = [block["timestamp"] for block in blocks]
+            columns["blocks", "nonce"] = [
+                block["nonce"] if "nonce" in block else block["proof"]
+                for block in blocks
+            ]
+            columns["blocks", "first"] = first
+            columns["blocks", "hash"] = [
+                blockchain.hash(block).encode() for block in blocks
+            ]
+            columns["blocks", "previous_hash"] = [
+                str(block["previous_hash"]).encode() for block in blocks
+            ]
+            columns["blocks", "merkle_root"] = [
+                block.get("merkle_root", "").encode() for block in blocks
+            ]
+            for key, values in columns.items():
+                files[key].write(np.asarray(values, dtype=dtypes[key]).tobytes())
+    finally:
+        for file in files.values():
+            file.close()
+
+    addresses = converter.address_table()
+    with open(os.path.join(directory, "addresses.bin"), "wb") as file:
+        file.write(addresses.tobytes())
+
+    index = {
+        "format": FORMAT,
+        "version": VERSION,
+        "blocks": converter.blocks,
+        "transactions": transactions,
+        "addresses": {"dtype": addresses.dtype.str, "length": len(addresses)},
+        "tables": {
+            "transactions": TRANSACTION_DTYPES,
+            "blocks": BLOCK_DTYPES,
+        },
+    }
+    with open(index_path + ".tmp", "w") as file:
+        json.dump(index, file)
+    os.replace(index_path + ".tmp", index_path)
+    return converter.blocks, transactions
+
+
+def _map(path, dtype, length):
+    """Map a file of `length` values, or make an empty array for an empty file,
+    which cannot be mapped"""
+    if length == 0:
+        return np.empty(0, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode="r", shape=(length,))
+
+
+class ChainExport:
+    __slots__ = ("directory", "blocks", "transactions", "addresses")
+
+    def __init__(self, directory, blocks, transactions, addresses):
+        self.directory = directory
+        # Columns of the blocks and of the transactions, by name
+        self.blocks = blocks
+        self.transactions = transactions
+        self.addresses = addresses
+
+    def __len__(self):
+        """The number of blocks"""
+        return len(self.blocks["index"])
+
+    def block_transactions(self, position):
+        """
+        Find the transactions of a block
+        :param position: Position of the block in the chain
+        :return: The slice of the transaction columns holding them
+        """
+
+        first = self.blocks["first"]
+        if position + 1 < len(first):
+            stop = first[position + 1]
+        else:
+            stop = len(self.transactions["block"])
+        return slice(int(first[position]), int(stop))
+
+    def columns(self):
+        """View the transactions as `analytics.ChainColumns`, without copying"""
+        return ChainColumns(
+            self.addresses,
+            self.transactions["sender"],
+            self.transactions["receiver"],
+            self.transactions["amount"],
+            self.transactions["block"],
+            len(self),
+        )
+
+
+def load_chain(directory):
+    """
+    Map a chain written by `export_chain`
+    :param directory: The directory of the export
+    :return: <ChainExport>
+    :raise ValueError: If the directory holds no finished export of this
+        format
+    """
+
+    try:
+        with open(os.path.join(directory, INDEX)) as file:
+            index = json.load(file)
+    except FileNotFoundError:
+        raise ValueError(f"No chain export in {directory}") from None
+    if index.get("format") != FORMAT or index.get("version") != VERSION:
+        raise ValueError(f"Unknown chain export format in {directory}")
+
+    tables = {}
+    for table, dtypes in index["tables"].items():
+        length = index[table]
+        tables[table] = {
+            name: _map(os.path.join(directory, f"{table}.{name}.bin"), dtype, length)
+            for name, dtype in dtypes.items()
+        }
+    addresses = _map(
+        os.path.join(directory, "addresses.bin"),
+        index["addresses"]["dtype"],
+        index["addresses"]["length"],
+    )
+    return ChainExport(directory, tables["blocks"], tables["transactions"], addresses)
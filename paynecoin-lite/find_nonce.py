@@ -1,11 +1,17 @@
 """Find a nonce that produces a hash with 5 leading zeros"""
 
 from blockchain import Blockchain
+from mining import parallel_search_nonce
+import json
+import os
 import time
 
-def find_nonce_with_leading_zeros():
+def find_nonce_with_leading_zeros(workers=1):
+    """Search for the nonce, on `workers` processes if more than one"""
     message = "The quick brown fox jumps over the lazy dog"
     target = "00000"  # 5 leading zeros
+    if workers > 1:
+        return find_nonce_parallel(message, len(target), workers)
     nonce = 0
     attempts = 0
     start_time = time.time()
@@ -41,12 +47,38 @@ def find_nonce_with_leading_zeros():
             
         nonce += 1
 
+
+def find_nonce_parallel(message, difficulty, workers):
+    """Search for the lowest nonce with a pool of worker processes
+
+    The data hashed by `Blockchain.hash` is split around the nonce, so workers
+    only hash the nonce digits and the rest of the message.
+    """
+    # The nonce goes where json escapes the placeholder character
+    data = json.dumps({"data": "\0" + message}, sort_keys=True)
+    prefix, suffix = data.split("\\u0000")
+    start_time = time.time()
+    nonce, attempts = parallel_search_nonce(
+        prefix.encode(),
+        difficulty,
+        suffix=suffix.encode(),
+        encoding="decimal",
+        workers=workers,
+    )
+    elapsed = time.time() - start_time
+    current_hash = Blockchain.hash({"data": str(nonce) + message})
+    print(f"\nFound solution after {attempts:,} attempts and {elapsed:.1f} seconds!")
+    print(f"Nonce: {nonce}")
+    print(f"Hash: {current_hash}")
+    return nonce
+
+
 if __name__ == "__main__":
     print("Searching for nonce that produces hash with 5 leading zeros...")
     print("Message: 'The quick brown fox jumps over the lazy dog'")
     print("This may take a while...\n")
     
-    nonce = find_nonce_with_leading_zeros()
+    nonce = find_nonce_with_leading_zeros(workers=os.cpu_count())
     
     print("""
 Why can't we use optimization algorithms to find the nonce?
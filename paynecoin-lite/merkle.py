@@ -0,0 +1,104 @@
+"""Merkle trees over the transactions of a block
+
+A block header commits to its transactions through the root of a Merkle tree
+built from the transaction hashes. A Merkle proof is the list of sibling hashes
+on the path from a transaction to the root, so a light client that only has the
+block header can check that a transaction is in the block without downloading
+the block.
+
+Leaves and inner nodes are hashed with different prefixes so that an inner node
+can never be passed off as a transaction. A level with an odd number of nodes
+promotes its last node to the level above unchanged. Pairing it with itself
+instead would give a block whose last transactions are repeated the same root
+as the block without the copies (CVE-2012-2459), so a valid block could be
+passed off with transactions credited twice under the same hash.
+"""
+
+from hashlib import sha256
+
+from block import Transaction
+from serialization import encode
+
+LEAF_PREFIX = b"\x00"
+NODE_PREFIX = b"\x01"
+
+
+def transaction_hash(tx):
+    """Create a SHA-256 hash of a transaction
+    :param tx: The transaction dict
+    :return: The hex digest"""
+    if isinstance(tx, Transaction):
+        # Transactions held by a Block cache their digest until they are
+        # modified
+        if tx.cached_digest is None:
+            tx.cached_digest = sha256(LEAF_PREFIX + encode(tx)).digest()
+        return tx.cached_digest.hex()
+    return sha256(LEAF_PREFIX + encode(tx)).hexdigest()
+
+
+def _parent(left, right):
+    """Hash two hex child hashes into their parent"""
+    return sha256(NODE_PREFIX + bytes.fromhex(left) + bytes.fromhex(right)).hexdigest()
+
+
+def _next_level(level):
+    """Hash the nodes of a level in pairs, promoting an odd last node"""
+    parents = [_parent(level[i], level[i + 1]) for i in range(0, len(level) - 1, 2)]
+    if len(level) % 2:
+        parents.append(level[-1])
+    return parents
+
+
+def merkle_root(tx_hashes):
+    """Compute the Merkle root of a list of transaction hashes
+    :param tx_hashes: A list of hex transaction hashes
+    :return: The hex root. The root of no transactions is the hash of nothing."""
+    level = list(tx_hashes)
+    if not level:
+        return sha256(b"").hexdigest()
+    while len(level) > 1:
+        level = _next_level(level)
+    return level[0]
+
+
+def transactions_root(transactions):
+    """Compute the Merkle root of a list of transactions
+    :param transactions: A list of transaction dicts
+    :return: The hex root"""
+    return merkle_root([transaction_hash(tx) for tx in transactions])
+
+
+def merkle_proof(tx_hashes, position):
+    """Build the inclusion proof of one transaction
+    :param tx_hashes: A list of hex transaction hashes, in block order
+    :param position: Position of the transaction in the list
+    :return: A list of {"hash": sibling hash, "side": "left" or "right"}, from
+        the leaf up to the root"""
+    if not 0 <= position < len(tx_hashes):
+        raise IndexError("Transaction position out of range")
+    proof = []
+    level = list(tx_hashes)
+    while len(level) > 1:
+        # A promoted node has no sibling on this level
+        if position % 2:
+            proof.append({"hash": level[position - 1], "side": "left"})
+        elif position + 1 < len(level):
+            proof.append({"hash": level[position + 1], "side": "right"})
+        level = _next_level(level)
+        position //= 2
+    return proof
+
+
+def verify_merkle_proof(tx_hash, proof, root):
+    """Check an inclusion proof against a Merkle root
+    :param tx_hash: The hex hash of the transaction, see `transaction_hash`
+    :param proof: The proof, see `merkle_proof`
+    :param root: The Merkle root from the block header
+    :return: <bool>"""
+    node = tx_hash
+    for step in proof:
+        if step["side"] == "left":
+            node = _parent(step["hash"], node)
+        else:
+            node = _parent(node, step["hash"])
+    return node == root
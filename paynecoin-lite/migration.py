@@ -0,0 +1,52 @@
+"""Migrate chains from PEM public keys to compact addresses
+
+Chains built before addresses were introduced store senders and receivers as
+PEM strings. Migrating a transaction converts both to addresses and keeps the
+signature, which `utils.is_from_sender` still verifies (see
+`utils.migrate_transaction`).
+
+Changing the transactions changes the Merkle root and so the hash of every
+block, so migrated blocks are linked to each other again. Blocks mined with
+proof of work need to be mined again, which `migrate_chain` does when given a
+difficulty.
+"""
+
+from block import Block
+from blockchain import Blockchain, block_header_prefix
+from merkle import transactions_root
+from mining import mine_header
+from utils import migrate_transaction
+
+
+def migrate_chain(chain, difficulty=None, workers=1):
+    """Rebuild a chain with addresses in place of PEM strings
+    :param chain: A blockchain
+    :param difficulty: If given, mine every block again to this difficulty
+    :param workers: Number of processes to mine with
+    :return: The migrated blockchain, as a new list of Blocks"""
+    migrated = []
+    for block in chain:
+        new_block = dict(block)
+        new_block["transactions"] = [
+            migrate_transaction(tx) for tx in block["transactions"]
+        ]
+        new_block["merkle_root"] = transactions_root(new_block["transactions"])
+        if migrated:
+            new_block["previous_hash"] = Blockchain.hash(migrated[-1])
+        if difficulty is not None:
+            stats = mine_header(block_header_prefix(new_block), difficulty, workers)
+            new_block["nonce"] = stats["nonce"]
+        migrated.append(Block(new_block))
+    return migrated
+
+
+def migrate_ledger(ledger, difficulty=None, workers=1):
+    """Migrate a Blockchain in place, with its pending transactions
+    :param ledger: The Blockchain
+    :param difficulty: If given, mine every block again to this difficulty
+    :param workers: Number of processes to mine with"""
+    ledger.chain = migrate_chain(ledger.chain, difficulty, workers)
+    ledger.current_transactions = [
+        migrate_transaction(tx) for tx in ledger.current_transactions
+    ]
+    ledger.rebuild_balances()
@@ -4,21 +4,29 @@ Creates a sample blockchain with proof-of-work mining for each block.
 Each block's hash must have at least 5 leading zeros.
 """
 
-from blockchain import Blockchain
+from blockchain import Blockchain, block_header_prefix
+from merkle import transactions_root
+from mining import DIFFICULTY, mine_header
 from utils import (
     generate_keys,
     create_transaction,
-    public_key_to_string,
+    public_key_to_address,
 )
+import os
 import time
-from hashlib import sha256
-import json
 
 
 class PoWBlockchain(Blockchain):
+    difficulty = DIFFICULTY
+    # Number of processes searching for the nonce, see `mining.parallel_search_nonce`
+    workers = 1
+
     def mine_block(self, previous_hash=None):
         """Create a new Block in the Blockchain with proof of work
-        
+
+        The header is serialized once and only the nonce is varied, see
+        `mining.mine_header`. Statistics of the search, including hashes per
+        second, are kept in `last_mining_stats`.
         :param previous_hash: Hash of previous Block
         :return: New Block, time taken to mine
         """
@@ -26,29 +34,28 @@ class PoWBlockchain(Blockchain):
             previous_hash = self.hash(self.chain[-1])
             
         # Create block template (nonce will be adjusted)
+        transactions = self.take_transactions()
         block = {
             "nonce": 0,
             "index": len(self.chain),
             "timestamp": time.time(),
-            "transactions": self.current_transactions,
+            "transactions": transactions,
+            "merkle_root": transactions_root(transactions),
             "previous_hash": previous_hash
         }
         
         # Mine the block (find nonce that gives enough leading zeros)
-        start_time = time.time()
-        while True:
-            block_hash = self.hash(block)
-            if block_hash.startswith("00000"):
-                mining_time = time.time() - start_time
-                # Reset the current list of transactions
-                self.current_transactions = []
-                self.chain.append(block)
-                return block, mining_time
-            block["nonce"] += 1
+        stats = mine_header(block_header_prefix(block), self.difficulty, self.workers)
+        block["nonce"] = stats["nonce"]
+        self.last_mining_stats = stats
+        block = self.seal_block(block)
+        return block, stats["elapsed"]
+
 
+def build_pow_blockchain(workers=1):
+    """Create a sample blockchain with proof-of-work for each block
 
-def build_pow_blockchain():
-    """Create a sample blockchain with proof-of-work for each block"""
+    :param workers: Number of processes to mine with"""
     
     # Generate keys for participants
     key_dict = {}
@@ -59,13 +66,14 @@ def build_pow_blockchain():
     # Initial transaction giving you 100 tokens
     tx0 = create_transaction(
         private_key=key_dict["You"]["private_key"],
-        public_key=public_key_to_string(key_dict["You"]["public_key"]),
-        receiver=public_key_to_string(key_dict["You"]["public_key"]),
+        public_key=public_key_to_address(key_dict["You"]["public_key"]),
+        receiver=public_key_to_address(key_dict["You"]["public_key"]),
         amount=100,
     )
     
     # Initialize blockchain
     ledger = PoWBlockchain(starting_transactions=[tx0])
+    ledger.workers = workers
     
     # Helper to create valid transactions
     def make_tx(sender_name, receiver_name, amount):
@@ -73,8 +81,8 @@ def build_pow_blockchain():
         receiver = key_dict[receiver_name]
         tx = create_transaction(
             private_key=sender["private_key"],
-            public_key=public_key_to_string(sender["public_key"]),
-            receiver=public_key_to_string(receiver["public_key"]),
+            public_key=public_key_to_address(sender["public_key"]),
+            receiver=public_key_to_address(receiver["public_key"]),
             amount=amount,
         )
         return tx
@@ -110,6 +118,7 @@ def build_pow_blockchain():
         block, mining_time = ledger.mine_block()
         total_mining_time += mining_time
         print(f"Mined block with nonce {block['nonce']} in {mining_time:.2f}s")
+        print(f"Hashrate: {ledger.last_mining_stats['hashrate']:,.0f} hashes/s")
         print(f"Block hash: {PoWBlockchain.hash(block)}")
     
     print(f"\nTotal time spent mining: {total_mining_time:.2f}s")
@@ -121,7 +130,7 @@ def main():
     print("Each block must have a hash with 5 leading zeros\n")
     
     start_time = time.time()
-    ledger, key_dict = build_pow_blockchain()
+    ledger, key_dict = build_pow_blockchain(workers=os.cpu_count())
     total_time = time.time() - start_time
     
     print(f"\nBlockchain built in {total_time:.2f}s")
@@ -132,7 +141,7 @@ def main():
     balances = ledger.get_balances()
     print("\nFinal balances:")
     for name, keys in key_dict.items():
-        pub = public_key_to_string(keys["public_key"])
+        pub = public_key_to_address(keys["public_key"])
         print(f"{name}: {balances.get(pub, 0)} tokens")
 
 
@@ -10,12 +10,13 @@ This script:
 Run interactively (it will open a matplotlib window) or from a notebook.
 """
 
+from analytics import ChainColumns
 from blockchain import Blockchain
 from utils import (
     generate_keys,
     create_transaction,
     is_from_sender,
-    public_key_to_string,
+    public_key_to_address,
 )
 
 import matplotlib.pyplot as plt
@@ -31,8 +32,8 @@ def build_sample_blockchain():
     # Genesis transaction: You receive 100 tokens
     tx0 = create_transaction(
         private_key=key_dict["You"]["private_key"],
-        public_key=public_key_to_string(key_dict["You"]["public_key"]),
-        receiver=public_key_to_string(key_dict["You"]["public_key"]),
+        public_key=public_key_to_address(key_dict["You"]["public_key"]),
+        receiver=public_key_to_address(key_dict["You"]["public_key"]),
         amount=100,
     )
     assert is_from_sender(tx0)
@@ -46,8 +47,8 @@ def build_sample_blockchain():
         receiver = key_dict[receiver_name]
         tx = create_transaction(
             private_key=sender["private_key"],
-            public_key=public_key_to_string(sender["public_key"]),
-            receiver=public_key_to_string(receiver["public_key"]),
+            public_key=public_key_to_address(sender["public_key"]),
+            receiver=public_key_to_address(receiver["public_key"]),
             amount=amount,
         )
         if not is_from_sender(tx):
@@ -97,31 +98,11 @@ def build_sample_blockchain():
 
 
 def balances_over_time(ledger, key_dict):
-    # For each block, compute balances incrementally
-    pub_strings = {name: public_key_to_string(key_dict[name]["public_key"]) for name in key_dict}
-    
-    # Initialize balances tracking
+    # Compute everyone's balance after each block from the columns of the chain
     names = ["You", "Alice", "Bob"]
-    balances_time = {name: [] for name in names}
-    # Initialize balances (You starts with 100 from genesis block)
-    balances = {pub_strings[name]: 100 if name == "You" else 0 for name in names}
-    
-    # Process blocks one at a time
-    for block in ledger.chain:
-        # Apply all transactions in this block
-        for tx in block["transactions"]:
-            sender = tx["sender"]
-            receiver = tx["receiver"]
-            amount = tx["amount"]
-            balances[sender] -= amount
-            balances[receiver] += amount
-            
-        # Record everyone's balance after this block
-        for name in names:
-            pub = pub_strings[name]
-            balances_time[name].append(balances[pub])
-
-    return balances_time
+    addresses = [public_key_to_address(key_dict[name]["public_key"]) for name in names]
+    matrix = ChainColumns.from_chain(ledger.chain).balance_matrix(addresses)
+    return dict(zip(names, matrix))
 
 
 def plot_balances(balances_time):
@@ -0,0 +1,113 @@
+"""Test compact addresses and the migration of PEM-keyed transactions"""
+
+from blockchain import Blockchain
+from merkle import transactions_root
+from migration import migrate_chain
+from utils import (
+    generate_keys,
+    address_to_string,
+    create_transaction,
+    is_address,
+    is_from_sender,
+    public_key_to_address,
+    public_key_to_string,
+    string_to_address,
+    legacy_transaction_message,
+    to_address,
+    transaction_message,
+)
+
+
+def sign_with_pem(private_key, sender, receiver, amount):
+    """Create a transaction the way it was done before addresses"""
+    tx = {"sender": sender, "receiver": receiver, "amount": amount, "timestamp": 0}
+    tx["signature"] = private_key.sign(legacy_transaction_message(tx)).hex()
+    return tx
+
+
+def test_address():
+    private_key, public_key = generate_keys()
+    address = public_key_to_address(public_key)
+    pem = public_key_to_string(public_key)
+    print(f"Address ({len(address)} chars): {address}")
+    print(f"PEM string: {len(pem)} chars")
+
+    assert len(address) < len(pem)
+    assert is_address(address)
+    assert string_to_address(pem) == address
+    assert address_to_string(address) == pem
+
+    # A typo breaks the checksum, and an address has a single spelling
+    typo = ("0" if address[0] != "0" else "1") + address[1:]
+    assert not is_address(typo)
+    assert not is_address(pem)
+    assert not is_address(address.upper())
+    assert to_address(address) == address
+
+    # Coins cannot be sent to anything but an address
+    tx0 = create_transaction(private_key, address, address, 100)
+    ledger = Blockchain(starting_transactions=[tx0])
+    for receiver in (typo, "not an address at all"):
+        try:
+            create_transaction(private_key, address, receiver, 10)
+            raise AssertionError("Transaction to an invalid address was created")
+        except ValueError as e:
+            print(f"Transaction refused as expected: {str(e)}")
+        tx = {"sender": address, "receiver": receiver, "amount": 10, "timestamp": 0}
+        tx["signature"] = private_key.sign(transaction_message(tx)).hex()
+        assert is_from_sender(tx)
+        try:
+            ledger.add_transaction(tx)
+            raise AssertionError("Transaction to an invalid address was accepted")
+        except ValueError as e:
+            print(f"Transaction rejected as expected: {str(e)}")
+    assert ledger.get_balances() == {address: 100}
+
+    # Transactions store addresses, even when given PEM strings
+    tx = create_transaction(private_key, pem, pem, 10)
+    assert tx["sender"] == address and tx["receiver"] == address
+    assert is_from_sender(tx)
+
+
+def test_migration():
+    alice_private, alice_public = generate_keys()
+    bob_private, bob_public = generate_keys()
+    alice_pem = public_key_to_string(alice_public)
+    bob_pem = public_key_to_string(bob_public)
+
+    # Build a chain the old way, with PEM strings as keys
+    ledger = Blockchain(
+        starting_transactions=[sign_with_pem(alice_private, alice_pem, alice_pem, 100)]
+    )
+    payment = sign_with_pem(alice_private, alice_pem, bob_pem, 30)
+    ledger.new_block(
+        previous_hash=Blockchain.hash(ledger.chain[-1]), transactions=[payment]
+    )
+    assert ledger.valid_chain(ledger.chain)
+
+    # New transactions must pay an address
+    try:
+        ledger.add_transaction(sign_with_pem(alice_private, alice_pem, bob_pem, 1))
+        raise AssertionError("Payment to a PEM string was accepted")
+    except ValueError as e:
+        print(f"Transaction rejected as expected: {str(e)}")
+
+    migrated = migrate_chain(ledger.chain)
+    for block in migrated:
+        for tx in block["transactions"]:
+            assert is_address(tx["sender"]) and is_address(tx["receiver"])
+            # The old signature still verifies
+            assert is_from_sender(tx)
+        assert block["merkle_root"] == transactions_root(block["transactions"])
+    assert migrated[1]["previous_hash"] == Blockchain.hash(migrated[0])
+    assert ledger.valid_chain(migrated)
+
+    ledger.chain = migrated
+    ledger.rebuild_balances()
+    assert ledger.get_balance(alice_pem) == 70
+    assert ledger.get_balance(public_key_to_address(bob_public)) == 30
+
+
+if __name__ == "__main__":
+    test_address()
+    test_migration()
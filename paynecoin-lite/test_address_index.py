@@ -0,0 +1,104 @@
+"""Test that the address index answers history and balance queries like a
+replay of the chain"""
+
+import tempfile
+
+from address_index import AddressIndex
+from block_store import BlockStore
+from blockchain import Blockchain
+from merkle import transaction_hash
+from pow_blockchain import PoWBlockchain
+from utils import (
+    generate_keys,
+    create_transaction,
+    public_key_to_address,
+)
+
+
+def test_address_index():
+    alice_private, alice_public = generate_keys()
+    bob_private, bob_public = generate_keys()
+    alice = public_key_to_address(alice_public)
+    bob = public_key_to_address(bob_public)
+    tx0 = create_transaction(alice_private, alice, alice, 100)
+    ledger = Blockchain(starting_transactions=[tx0])
+
+    payments = [(alice_private, alice, bob, 30), (bob_private, bob, alice, 10)]
+    for i in range(3):
+        for private_key, sender, receiver, amount in payments:
+            ledger.add_transaction(
+                create_transaction(private_key, sender, receiver, amount)
+            )
+        ledger.new_block(previous_hash=Blockchain.hash(ledger.chain[-1]))
+
+    # Balances at every height match a replay of the chain up to that block
+    balances = {}
+    for block in ledger.chain:
+        Blockchain.apply_block_balances(balances, block)
+        for address in (alice, bob):
+            assert ledger.balance_at(address, block["index"]) == balances.get(address, 0)
+    assert ledger.balance_at(bob_public) == ledger.get_balance(bob) == 60
+    assert type(ledger.balance_at(bob)) is int
+    assert ledger.balance_at(bob, 0) == 0
+
+    # The history lists every transaction touching the address, in order
+    history = ledger.address_history(bob)
+    print(f"History of Bob: {history}")
+    assert [(entry["height"], entry["amount"]) for entry in history] == [
+        (1, 30), (1, -10), (2, 30), (2, -10), (3, 30), (3, -10)
+    ]
+    assert history[-1]["balance"] == 60
+    assert ledger.address_history(bob, offset=4, limit=1) == history[4:5]
+    assert len(ledger.address_history(alice)) == 7
+
+    # Transactions are located by hash
+    tx = ledger.chain[2]["transactions"][1]
+    assert ledger.locate_transaction(transaction_hash(tx)) == (2, 1)
+    assert ledger.locate_transaction(transaction_hash(tx0)) == (0, 0)
+    assert ledger.locate_transaction("00" * 32) is None
+
+    # A rebuilt index agrees with the incrementally maintained one
+    ledger.rebuild_balances()
+    assert ledger.address_history(bob) == history
+
+    # A stored chain is indexed on the first query after it is reopened
+    with tempfile.TemporaryDirectory() as directory:
+        with BlockStore(directory) as store:
+            for block in ledger.chain:
+                store.append(block)
+        with BlockStore(directory) as store:
+            reopened = Blockchain(starting_transactions=[], store=store)
+            assert reopened.address_history(bob) == history
+
+    # Mined blocks are indexed too
+    pow_ledger = PoWBlockchain(starting_transactions=[tx0])
+    pow_ledger.difficulty = 2
+    pow_ledger.add_transaction(create_transaction(alice_private, alice, bob, 5))
+    pow_ledger.mine_block()
+    assert pow_ledger.balance_at(bob, 1) == 5 and pow_ledger.balance_at(alice, 0) == 100
+
+
+    # Amounts are kept exact, past the precision of a float, and past 64 bits
+    index = AddressIndex()
+    big = 2 ** 53 + 1
+    index.add_block(
+        {"index": 0, "transactions": [{"sender": alice, "receiver": alice, "amount": big}]}
+    )
+    index.add_block(
+        {
+            "index": 1,
+            "transactions": [
+                {"sender": alice, "receiver": bob, "amount": 1},
+                {"sender": alice, "receiver": bob, "amount": 2 ** 63},
+                {"sender": bob, "receiver": alice, "amount": 0.5},
+            ],
+        }
+    )
+    assert index.balance_at(alice, 0) == big
+    assert type(index.balance_at(alice, 0)) is int
+    assert index.history(alice)[1]["balance"] == big - 1
+    assert index.history(bob)[1]["balance"] == 2 ** 63 + 1
+
+
+if __name__ == "__main__":
+    test_address_index()
@@ -0,0 +1,57 @@
+"""Test that the vectorized balance matrix matches a replay of the chain"""
+
+import numpy as np
+
+from analytics import ChainColumns
+from blockchain import Blockchain
+from utils import (
+    generate_keys,
+    create_transaction,
+    public_key_to_address,
+)
+
+
+def test_analytics():
+    keys = [generate_keys() for _ in range(3)]
+    addresses = [public_key_to_address(public_key) for _, public_key in keys]
+    genesis = [
+        create_transaction(private_key, address, address, 100)
+        for (private_key, _), address in zip(keys, addresses)
+    ]
+    ledger = Blockchain(starting_transactions=genesis)
+    rng = np.random.default_rng(0)
+    for _ in range(6):
+        for _ in range(4):
+            sender, receiver = rng.choice(3, size=2)
+            amount = float(rng.integers(1, 10))
+            ledger.add_transaction(
+                create_transaction(
+                    keys[sender][0], addresses[sender], addresses[receiver], amount
+                )
+            )
+        ledger.new_block(previous_hash=Blockchain.hash(ledger.chain[-1]))
+
+    columns = ChainColumns.from_chain(ledger.chain)
+    assert len(columns) == sum(len(block["transactions"]) for block in ledger.chain)
+    matrix = columns.balance_matrix()
+    assert matrix.shape == (3, len(ledger.chain))
+
+    # Each column is the balances after a block, as a replay finds them
+    balances = {}
+    for block in ledger.chain:
+        Blockchain.apply_block_balances(balances, block)
+        expected = [balances.get(address.decode(), 0) for address in columns.addresses]
+        assert np.allclose(matrix[:, block["index"]], expected)
+
+    # Rows can be picked, in any order, including unknown addresses
+    picked = columns.balance_matrix([addresses[2], "unknown", addresses[0]])
+    rows = columns.address_ids([addresses[2], addresses[0]])
+    assert np.array_equal(picked[[0, 2]], matrix[rows])
+    assert not picked[1].any()
+
+    # Only the genesis block creates money
+    assert np.array_equal(columns.money_supply(), np.full(len(ledger.chain), 300.0))
+
+
+if __name__ == "__main__":
+    test_analytics()
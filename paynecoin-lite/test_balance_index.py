@@ -0,0 +1,57 @@
+"""Test that the materialized balance index matches a full replay of the chain"""
+
+from blockchain import Blockchain
+from utils import (
+    generate_keys,
+    create_transaction,
+    public_key_to_address,
+)
+
+
+def test_balance_index():
+    alice_private, alice_public = generate_keys()
+    bob_private, bob_public = generate_keys()
+    alice_pub_str = public_key_to_address(alice_public)
+    bob_pub_str = public_key_to_address(bob_public)
+
+    # Genesis transaction: Alice starts with 100 tokens
+    tx0 = create_transaction(
+        private_key=alice_private,
+        public_key=alice_pub_str,
+        receiver=alice_pub_str,
+        amount=100,
+    )
+    ledger = Blockchain(starting_transactions=[tx0])
+
+    # One sealed block and one pending transaction
+    ledger.add_transaction(
+        create_transaction(alice_private, alice_pub_str, bob_pub_str, 30)
+    )
+    ledger.new_block(previous_hash=Blockchain.hash(ledger.chain[-1]))
+    ledger.add_transaction(
+        create_transaction(bob_private, bob_pub_str, alice_pub_str, 10)
+    )
+
+    balances = ledger.get_balances()
+    print(f"Confirmed balances: {ledger.confirmed_balances}")
+    print(f"Pending deltas: {ledger.pending_balances}")
+    assert balances == {alice_pub_str: 80, bob_pub_str: 20}
+    assert ledger.confirmed_balances == {alice_pub_str: 70, bob_pub_str: 30}
+    assert ledger.get_balance(bob_pub_str) == 20
+
+    # Pending transactions are spendable only up to the pending balance
+    try:
+        ledger.add_transaction(
+            create_transaction(bob_private, bob_pub_str, alice_pub_str, 25)
+        )
+        raise AssertionError("Overspending transaction was accepted")
+    except ValueError as e:
+        print(f"Transaction rejected as expected: {str(e)}")
+
+    # A replay of the chain agrees with the incrementally maintained index
+    ledger.rebuild_balances()
+    assert ledger.get_balances() == balances
+
+
+if __name__ == "__main__":
+    test_balance_index()
@@ -0,0 +1,63 @@
+"""Test batch signature verification of transactions"""
+
+from multiprocessing import Pool
+
+from blockchain import Blockchain
+from utils import (
+    generate_keys,
+    create_transaction,
+    is_from_sender,
+    public_key_to_address,
+    verify_transactions,
+)
+
+
+def test_batch_verify():
+    alice_private, alice_public = generate_keys()
+    bob_private, bob_public = generate_keys()
+    alice_pub_str = public_key_to_address(alice_public)
+    bob_pub_str = public_key_to_address(bob_public)
+
+    transactions = []
+    for amount in range(1, 11):
+        transactions.append(
+            create_transaction(alice_private, alice_pub_str, bob_pub_str, amount)
+        )
+        transactions.append(
+            create_transaction(bob_private, bob_pub_str, alice_pub_str, amount)
+        )
+    # Bob signs as Alice, a tampered amount, a bad key and a missing signature
+    transactions.append(
+        create_transaction(bob_private, alice_pub_str, bob_pub_str, 50)
+    )
+    transactions.append(dict(transactions[0], amount=1000))
+    transactions.append(dict(transactions[1], sender="not a key"))
+    transactions.append({k: v for k, v in transactions[2].items() if k != "signature"})
+
+    expected = [is_from_sender(tx) for tx in transactions]
+    assert expected == [True] * 20 + [False] * 4
+    assert verify_transactions(transactions) == expected
+    assert verify_transactions(transactions, workers=2) == expected
+    with Pool(2) as pool:
+        assert verify_transactions(transactions, pool=pool) == expected
+        assert verify_transactions(transactions[:2], pool=pool) == expected[:2]
+
+    # Batch admission reports each transaction's outcome
+    tx0 = create_transaction(alice_private, alice_pub_str, alice_pub_str, 100)
+    ledger = Blockchain(starting_transactions=[tx0])
+    results = ledger.add_transactions(
+        [
+            create_transaction(alice_private, alice_pub_str, bob_pub_str, 60),
+            create_transaction(bob_private, alice_pub_str, bob_pub_str, 10),
+            create_transaction(alice_private, alice_pub_str, bob_pub_str, 60),
+        ]
+    )
+    print(f"Batch admission results: {results}")
+    assert results[0] == 1
+    assert str(results[1]) == "Invalid signature"
+    assert str(results[2]) == "Not enough money to send"
+    assert len(ledger.current_transactions) == 1
+
+
+if __name__ == "__main__":
+    test_batch_verify()
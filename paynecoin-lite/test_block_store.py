@@ -0,0 +1,67 @@
+"""Test that a chain kept on disk survives a restart and a torn append"""
+
+import os
+import tempfile
+
+from block_store import BlockStore, DATA_FILE, INDEX_FILE
+from blockchain import Blockchain
+from utils import (
+    generate_keys,
+    create_transaction,
+    public_key_to_address,
+)
+
+
+def test_block_store():
+    private_key, public_key = generate_keys()
+    pub_str = public_key_to_address(public_key)
+    tx0 = create_transaction(private_key, pub_str, pub_str, 100)
+
+    with tempfile.TemporaryDirectory() as directory:
+        with BlockStore(directory, sync_every=4) as store:
+            ledger = Blockchain(starting_transactions=[tx0], store=store)
+            ledger.validate_window = 3
+            for i in range(10):
+                ledger.add_transaction(create_transaction(private_key, pub_str, pub_str, i))
+                ledger.new_block(previous_hash=Blockchain.hash(ledger.chain[-1]))
+            assert ledger.valid_chain(ledger.chain)
+            hashes = [Blockchain.hash(block) for block in store]
+            balances = ledger.get_balances()
+
+        # A restarted node continues the stored chain
+        with BlockStore(directory) as store:
+            ledger = Blockchain(starting_transactions=[], store=store)
+            assert len(ledger.chain) == 11
+            assert [Blockchain.hash(block) for block in store] == hashes
+            assert ledger.get_balances() == balances
+            assert ledger.valid_chain(ledger.chain)
+            assert ledger.chain[3].to_dict() == ledger.chain[2:4][1].to_dict()
+
+            # Only the appended block is checked again
+            ledger.new_block(previous_hash=Blockchain.hash(ledger.chain[-1]))
+            assert ledger.verified_prefix(ledger.chain) == 11
+            assert ledger.valid_chain(ledger.chain)
+            size = os.path.getsize(os.path.join(directory, DATA_FILE))
+
+        # A crash in the middle of an append leaves a torn record, and an index
+        # entry that was not written
+        with open(os.path.join(directory, DATA_FILE), "ab") as data:
+            data.write(b"\x00\x00\x01\x00torn")
+        with open(os.path.join(directory, INDEX_FILE), "r+b") as index:
+            index.truncate(11 * 8)
+        with BlockStore(directory) as store:
+            assert len(store) == 12
+            assert os.path.getsize(os.path.join(directory, DATA_FILE)) == size
+            assert Blockchain(starting_transactions=[], store=store).valid_chain(store)
+
+            # Switching to a competing chain drops the blocks after the fork
+            store.truncate(5)
+            assert len(store) == 5
+            assert Blockchain.hash(store[-1]) == hashes[4]
+
+        with BlockStore(directory) as store:
+            assert len(store) == 5
+
+
+if __name__ == "__main__":
+    test_block_store()
@@ -0,0 +1,64 @@
+"""Test that re-validating a chain only checks blocks added since the last check"""
+
+import pickle
+import time
+
+from blockchain import Blockchain
+from utils import (
+    generate_keys,
+    create_transaction,
+    public_key_to_address,
+)
+
+
+def test_chain_cache():
+    private_key, public_key = generate_keys()
+    pub_str = public_key_to_address(public_key)
+
+    tx0 = create_transaction(
+        private_key=private_key,
+        public_key=pub_str,
+        receiver=pub_str,
+        amount=100,
+    )
+    ledger = Blockchain(starting_transactions=[tx0])
+    for i in range(500):
+        ledger.add_transaction(create_transaction(private_key, pub_str, pub_str, 1))
+        ledger.new_block(previous_hash=Blockchain.hash(ledger.chain[-1]))
+
+    start_time = time.time()
+    assert ledger.valid_chain(ledger.chain)
+    full_time = time.time() - start_time
+
+    # Only the new tip is checked
+    ledger.new_block(previous_hash=Blockchain.hash(ledger.chain[-1]))
+    start_time = time.time()
+    assert ledger.valid_chain(ledger.chain)
+    tip_time = time.time() - start_time
+    print(f"Full validation: {full_time * 1000:.1f}ms, tip only: {tip_time * 1000:.1f}ms")
+
+    # A competing tip on top of the verified prefix
+    fork = ledger.chain[:-1] + [dict(ledger.chain[-1], timestamp=0)]
+    assert ledger.valid_chain(fork)
+    fork[-1]["previous_hash"] = "forged"
+    assert not ledger.valid_chain(fork)
+
+    # Modifying a verified block clears its cached hash and the cache of
+    # verified blocks
+    block = ledger.chain[250]
+    old_hash = Blockchain.hash(block)
+    block["transactions"][0]["amount"] = 50
+    assert not ledger.valid_chain(ledger.chain)
+    block["transactions"][0]["amount"] = 1
+    assert ledger.valid_chain(ledger.chain)
+    block["timestamp"] = 0
+    assert Blockchain.hash(block) != old_hash
+    assert not ledger.valid_chain(ledger.chain)
+
+    # Blocks survive a round trip through pickle with the same hash
+    copy = pickle.loads(pickle.dumps(ledger.chain[5]))
+    assert Blockchain.hash(copy) == Blockchain.hash(ledger.chain[5])
+
+
+if __name__ == "__main__":
+    test_chain_cache()
@@ -0,0 +1,70 @@
+"""Test that an exported chain reloads, mapped from disk, with the same
+transactions and balances"""
+
+import os
+import tempfile
+
+import numpy as np
+
+from analytics import ChainColumns
+from blockchain import Blockchain
+from chain_export import export_chain, load_chain
+from utils import (
+    generate_keys,
+    create_transaction,
+    public_key_to_address,
+)
+
+
+def test_chain_export():
+    alice_private, alice_public = generate_keys()
+    bob_private, bob_public = generate_keys()
+    alice = public_key_to_address(alice_public)
+    bob = public_key_to_address(bob_public)
+    tx0 = create_transaction(alice_private, alice, alice, 100)
+    ledger = Blockchain(starting_transactions=[tx0])
+    for i in range(5):
+        if i != 2:
+            ledger.add_transaction(create_transaction(alice_private, alice, bob, 7))
+            ledger.add_transaction(create_transaction(bob_private, bob, alice, 2))
+        ledger.new_block(previous_hash=Blockchain.hash(ledger.chain[-1]))
+
+    with tempfile.TemporaryDirectory() as directory:
+        # Small batches so that the export takes several
+        assert export_chain(ledger, directory, batch_blocks=4) == (6, 9)
+        export = load_chain(directory)
+        assert isinstance(export.transactions["amount"], np.memmap)
+        assert len(export) == len(ledger.chain)
+
+        # Blocks keep their header fields, and link through their hashes
+        for position, block in enumerate(ledger.chain):
+            assert export.blocks["index"][position] == block["index"]
+            assert export.blocks["hash"][position].decode() == Blockchain.hash(block)
+            merkle_root = export.blocks["merkle_root"][position].decode()
+            assert merkle_root == block["merkle_root"]
+            transactions = export.block_transactions(position)
+            assert export.transactions["amount"][transactions].tolist() == [
+                tx["amount"] for tx in block["transactions"]
+            ]
+        hashes = export.blocks["hash"].tolist()
+        assert export.blocks["previous_hash"][1:].tolist() == hashes[:-1]
+        assert export.block_transactions(3) == slice(5, 5)
+
+        # The mapped columns give the same balances as a conversion in memory
+        columns = export.columns()
+        expected = ChainColumns.from_chain(ledger.chain).balance_matrix([alice, bob])
+        assert np.array_equal(columns.balance_matrix([alice, bob]), expected)
+        assert columns.address(export.transactions["receiver"][1]) == bob
+        del columns, export
+
+        # An export that did not finish, and so wrote no index, cannot be loaded
+        os.remove(os.path.join(directory, "index.json"))
+        try:
+            load_chain(directory)
+            raise AssertionError("A broken export was loaded")
+        except ValueError as e:
+            print(f"Export rejected as expected: {str(e)}")
+
+
+if __name__ == "__main__":
+    test_chain_export()
@@ -5,7 +5,7 @@ from utils import (
     generate_keys,
     create_transaction,
     is_from_sender,
-    public_key_to_string,
+    public_key_to_address,
 )
 
 def test_fraudulent_spend():
@@ -16,8 +16,8 @@ def test_fraudulent_spend():
     # Create genesis transaction giving Alice 100 tokens
     tx0 = create_transaction(
         private_key=alice_private,
-        public_key=public_key_to_string(alice_public),
-        receiver=public_key_to_string(alice_public),
+        public_key=public_key_to_address(alice_public),
+        receiver=public_key_to_address(alice_public),
         amount=100,
     )
     
@@ -28,8 +28,8 @@ def test_fraudulent_spend():
     # but signing with his private key (which won't work)
     fraudulent_tx = create_transaction(
         private_key=bob_private,  # Bob's private key
-        public_key=public_key_to_string(alice_public),  # Pretending to be Alice
-        receiver=public_key_to_string(bob_public),
+        public_key=public_key_to_address(alice_public),  # Pretending to be Alice
+        receiver=public_key_to_address(bob_public),
         amount=50,
     )
     
@@ -1,10 +1,11 @@
 """Test blockchain immutability by attempting to modify a past block"""
 
 from blockchain import Blockchain
+from merkle import transactions_root
 from utils import (
     generate_keys,
     create_transaction,
-    public_key_to_string,
+    public_key_to_address,
 )
 import json
 
@@ -12,7 +13,7 @@ import json
 def test_immutability():
     # First create a sample blockchain with a few blocks
     private_key, public_key = generate_keys()
-    pub_str = public_key_to_string(public_key)
+    pub_str = public_key_to_address(public_key)
     
     # Genesis transaction giving 100 tokens
     tx0 = create_transaction(
@@ -43,29 +44,30 @@ def test_immutability():
     
     # Print block 1's original state
     print("\nBlock 1 before modification:")
-    print(json.dumps(ledger.chain[1], indent=2))
+    print(json.dumps(ledger.chain[1].to_dict(), indent=2))
     
     # Try to modify block 1's transaction amount
     print("\nModifying block 1's transaction amount from 10 to 20...")
     ledger.chain[1]["transactions"][0]["amount"] = 20
     
     print("\nBlock 1 after modification:")
-    print(json.dumps(ledger.chain[1], indent=2))
+    print(json.dumps(ledger.chain[1].to_dict(), indent=2))
     
     # Check if chain is still valid
     print(f"\nChain valid after modification: {ledger.valid_chain(ledger.chain)}")
     
     # Explain why it's invalid
     print("\nWhy is it invalid?")
-    print("1. Block 1's hash changed because we modified its contents")
-    print("2. Block 2's previous_hash still points to Block 1's original hash")
-    print("3. This hash mismatch breaks the chain of trust")
+    print("1. Block 1's transactions no longer match the Merkle root in its header")
+    print("2. Updating the Merkle root would change Block 1's hash, but")
+    print("   Block 2's previous_hash still points to Block 1's original hash")
+    print("3. Either mismatch breaks the chain of trust")
     
-    # Show the hash mismatch
-    block1_current_hash = Blockchain.hash(ledger.chain[1])
-    block2_previous_hash = ledger.chain[2]["previous_hash"]
-    print(f"\nBlock 1's current hash:     {block1_current_hash}")
-    print(f"Block 2's previous_hash:    {block2_previous_hash}")
+    # Show the Merkle root mismatch
+    block1_merkle_root = ledger.chain[1]["merkle_root"]
+    block1_current_root = transactions_root(ledger.chain[1]["transactions"])
+    print(f"\nBlock 1's Merkle root:          {block1_merkle_root}")
+    print(f"Root of Block 1's transactions: {block1_current_root}")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,71 @@
+"""Test the LRU cache of parsed public keys"""
+
+from utils import (
+    LRUCache,
+    PUBLIC_KEY_CACHE,
+    bytes_to_public_key,
+    generate_keys,
+    create_transaction,
+    is_from_sender,
+    key_cache_stats,
+    public_key_to_address,
+    public_key_to_string,
+    string_to_public_key,
+    transaction_message,
+)
+from cryptography.hazmat.primitives import serialization
+
+
+def test_lru_cache():
+    cache = LRUCache(maxsize=2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1  # "b" is now the least recently used
+    cache.put("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("c") == 3
+    assert cache.stats() == {
+        "hits": 2,
+        "misses": 1,
+        "evictions": 1,
+        "size": 2,
+        "maxsize": 2,
+    }
+    cache.resize(1)
+    assert cache.get("a") is None and cache.get("c") == 3
+
+
+def test_key_cache():
+    private_key, public_key = generate_keys()
+    pub_str = public_key_to_string(public_key)
+    assert public_key_to_string(public_key) == pub_str
+    address = public_key_to_address(public_key)
+
+    PUBLIC_KEY_CACHE.clear()
+    transactions = [
+        create_transaction(private_key, address, address, amount)
+        for amount in range(10)
+    ]
+    assert all(is_from_sender(tx) for tx in transactions)
+
+    # The sender's key was parsed once for ten verifications
+    stats = key_cache_stats()
+    print(f"Key cache stats: {stats}")
+    assert stats["parsed"]["misses"] == 1
+    assert stats["parsed"]["hits"] == 9
+
+    raw = string_to_public_key(pub_str).public_bytes(
+        encoding=serialization.Encoding.Raw,
+        format=serialization.PublicFormat.Raw,
+    )
+    assert len(raw) == 32
+    assert bytes_to_public_key(raw) is bytes_to_public_key(raw)
+    bytes_to_public_key(raw).verify(
+        bytes.fromhex(transactions[0]["signature"]),
+        transaction_message(transactions[0]),
+    )
+
+
+if __name__ == "__main__":
+    test_lru_cache()
+    test_key_cache()
@@ -0,0 +1,113 @@
+"""Test that the mempool rejects duplicates, stays bounded and fills blocks by
+priority"""
+
+from blockchain import Blockchain
+from mempool import Mempool
+from serialization import encode
+from utils import (
+    generate_keys,
+    create_transaction,
+    public_key_to_address,
+)
+
+
+def test_mempool():
+    alice_private, alice_public = generate_keys()
+    bob_private, bob_public = generate_keys()
+    alice = public_key_to_address(alice_public)
+    bob = public_key_to_address(bob_public)
+    transactions = [create_transaction(alice_private, alice, bob, i) for i in range(6)]
+
+    # By default, transactions are taken in order of arrival, and an unsigned
+    # "fee" field buys no priority
+    mempool = Mempool()
+    mempool.add(transactions[0])
+    mempool.add(dict(transactions[1], fee=10 ** 30))
+    assert [tx["amount"] for tx in mempool.peek(2)] == [0, 1]
+
+    # A priority that is not a non-negative integer leaves the pool as it was
+    mempool = Mempool(priority=lambda tx: tx.get("fee", 0))
+    mempool.add(transactions[0])
+    for fee in ("x", -1, 1.5):
+        try:
+            mempool.add(dict(transactions[1], fee=fee))
+            raise AssertionError("Transaction with an invalid priority was accepted")
+        except ValueError as e:
+            print(f"Transaction rejected as expected: {str(e)}")
+    stats = mempool.stats()
+    assert stats["count"] == 1 and stats["bytes"] == len(encode(transactions[0]))
+    assert mempool.take() == [transactions[0]]
+
+    # The best transactions come first, the oldest first among equal
+    # priorities
+    mempool = Mempool(max_transactions=4, priority=lambda tx: tx["amount"] % 3)
+    for tx in transactions[:4]:
+        assert mempool.add(tx) == []
+    assert [tx["amount"] for tx in mempool.peek(4)] == [2, 1, 0, 3]
+    try:
+        mempool.add(transactions[0])
+        raise AssertionError("Duplicate transaction was accepted")
+    except ValueError as e:
+        print(f"Transaction rejected as expected: {str(e)}")
+
+    # A full pool evicts its worst transaction, the newest among equal
+    # priorities, for a better one, and rejects a transaction no better than
+    # its worst
+    assert mempool.add(transactions[4]) == [transactions[3]]
+    try:
+        mempool.add(transactions[3])
+        raise AssertionError("Transaction was accepted into a full pool")
+    except ValueError as e:
+        print(f"Transaction rejected as expected: {str(e)}")
+    stats = mempool.stats()
+    print(f"Mempool stats: {stats}")
+    assert stats["count"] == 4 and stats["evicted"] == 1
+    assert stats["bytes"] == sum(len(encode(tx)) for tx in mempool)
+    assert stats["oldest_age"] >= stats["mean_age"] >= 0
+
+    # Blocks take the best transactions that fit
+    size = len(encode(transactions[2])) + len(encode(transactions[1]))
+    assert mempool.take(max_bytes=size) == [transactions[2], transactions[1]]
+    assert mempool.take() == [transactions[4], transactions[0]]
+    assert len(mempool) == 0 and mempool.stats()["bytes"] == 0
+
+    # A ledger leaves out of a block what does not fit in it, and a payment
+    # its sender cannot make from confirmed funds, even if it comes first
+    tx0 = create_transaction(alice_private, alice, alice, 100)
+    ledger = Blockchain(
+        starting_transactions=[tx0],
+        mempool=Mempool(priority=lambda tx: tx["sender"] == bob),
+    )
+    ledger.block_size = 3 * len(encode(tx0))
+    for i in range(4):
+        ledger.add_transaction(create_transaction(alice_private, alice, bob, 10))
+    ledger.add_transaction(create_transaction(bob_private, bob, alice, 35))
+    for i in range(3):
+        ledger.new_block(previous_hash=Blockchain.hash(ledger.chain[-1]))
+        if i == 0:
+            assert ledger.confirmed_balances == {alice: 70, bob: 30}
+            assert ledger.get_balances() == {alice: 95, bob: 5}
+    assert [len(block["transactions"]) for block in ledger.chain] == [1, 3, 1, 1]
+    assert ledger.chain[-1]["transactions"][0]["sender"] == bob
+    assert ledger.current_transactions == []
+    assert ledger.get_balances() == ledger.confirmed_balances == {alice: 95, bob: 5}
+    assert ledger.valid_chain(ledger.chain)
+
+    # Copies of a signed payment that differ only in fields the signature
+    # leaves free are not admitted again
+    tx = create_transaction(alice_private, alice, bob, 1)
+    ledger.add_transaction(tx)
+    copies = [
+        dict(tx, fee=1),
+        dict(tx, pem_signed=False),
+        dict(tx, signature=tx["signature"].upper()),
+        tx,
+    ]
+    for result in ledger.add_transactions(copies):
+        print(f"Copy rejected as expected: {result}")
+        assert isinstance(result, ValueError)
+    assert ledger.current_transactions == [tx]
+
+
+if __name__ == "__main__":
+    test_mempool()
@@ -0,0 +1,62 @@
+"""Test Merkle inclusion proofs for transactions in a block"""
+
+from blockchain import Blockchain
+from merkle import merkle_root, transaction_hash, verify_merkle_proof
+from utils import (
+    generate_keys,
+    create_transaction,
+    public_key_to_address,
+)
+
+
+def test_merkle_proofs():
+    private_key, public_key = generate_keys()
+    pub_str = public_key_to_address(public_key)
+
+    tx0 = create_transaction(
+        private_key=private_key,
+        public_key=pub_str,
+        receiver=pub_str,
+        amount=100,
+    )
+    ledger = Blockchain(starting_transactions=[tx0])
+
+    # An odd number of transactions exercises the promoted last node
+    for amount in range(1, 6):
+        tx = create_transaction(private_key, pub_str, pub_str, amount)
+        ledger.add_transaction(tx)
+    block = ledger.new_block(previous_hash=Blockchain.hash(ledger.chain[-1]))
+
+    for position, tx in enumerate(block["transactions"]):
+        response = ledger.transaction_proof(block["index"], position)
+        header = response["header"]
+        print(f"Transaction {position}: proof of {len(response['proof'])} hashes")
+
+        # The light client checks the header, then the proof against it
+        assert response["block_hash"] == Blockchain.hash(header)
+        assert response["transaction_hash"] == transaction_hash(tx)
+        assert verify_merkle_proof(
+            transaction_hash(tx), response["proof"], header["merkle_root"]
+        )
+
+    # A proof does not hold for a different transaction
+    response = ledger.transaction_proof(block["index"], 0)
+    forged = dict(block["transactions"][0], amount=1000)
+    assert not verify_merkle_proof(
+        transaction_hash(forged), response["proof"], header["merkle_root"]
+    )
+
+    # Repeating the last transactions changes the root, so the hash of the
+    # block, and a chain with a repeated payment is invalid (CVE-2012-2459)
+    hashes = [transaction_hash(tx) for tx in block["transactions"]]
+    assert merkle_root(hashes + hashes[-1:]) != merkle_root(hashes)
+    assert merkle_root(hashes[:-1] + hashes[-2:]) != merkle_root(hashes[:-1])
+    transactions = block["transactions"]
+    repeated = dict(block, transactions=transactions + transactions[-1:])
+    assert Blockchain.hash(repeated) == Blockchain.hash(block)
+    assert not ledger.valid_chain(ledger.chain[:-1] + [repeated])
+    assert ledger.valid_chain(ledger.chain)
+
+
+if __name__ == "__main__":
+    test_merkle_proofs()
@@ -0,0 +1,89 @@
+"""Test that blocks mined from a cached header prefix verify through Blockchain.hash"""
+
+import threading
+
+from mining import parallel_search_nonce, search_nonce
+from pow_blockchain import PoWBlockchain
+from utils import (
+    generate_keys,
+    create_transaction,
+    public_key_to_address,
+)
+
+
+def test_mining():
+    private_key, public_key = generate_keys()
+    pub_str = public_key_to_address(public_key)
+
+    tx0 = create_transaction(
+        private_key=private_key,
+        public_key=pub_str,
+        receiver=pub_str,
+        amount=100,
+    )
+    ledger = PoWBlockchain(starting_transactions=[tx0])
+    # Keep the test fast
+    ledger.difficulty = 3
+
+    for i in range(2):
+        for _ in range(3):
+            tx = create_transaction(private_key, pub_str, pub_str, 10)
+            ledger.add_transaction(tx)
+        block, mining_time = ledger.mine_block()
+        stats = ledger.last_mining_stats
+        print(f"Mined block {block['index']} with nonce {block['nonce']}")
+        print(f"Hashrate: {stats['hashrate']:,.0f} hashes/s")
+
+        # The block verifies through the usual hash function
+        assert PoWBlockchain.hash(block) == stats["hash"]
+        assert stats["hash"].startswith("000")
+        assert stats["attempts"] == block["nonce"] + 1
+
+    assert ledger.valid_chain(ledger.chain)
+
+    # Changing a transaction no longer matches the Merkle root in the header
+    ledger.chain[1]["transactions"][0]["amount"] = 20
+    assert not PoWBlockchain.valid_merkle_root(ledger.chain[1])
+    assert not ledger.valid_chain(ledger.chain)
+
+
+def test_parallel_search():
+    prefix = b"The quick brown fox jumps over the lazy dog"
+
+    # Sequential search for the lowest nonce
+    expected, _ = search_nonce(prefix, difficulty=3)
+
+    # Small chunks so that several workers take part in the search
+    nonce, attempts = parallel_search_nonce(
+        prefix, difficulty=3, workers=2, chunk_size=500
+    )
+    print(f"Parallel search found nonce {nonce} after {attempts:,} attempts")
+    assert nonce == expected
+
+    # Without `lowest`, any valid nonce may win
+    nonce, _ = parallel_search_nonce(
+        prefix, difficulty=3, workers=2, lowest=False, chunk_size=500
+    )
+    assert search_nonce(prefix, difficulty=3, start=nonce, stop=nonce + 1)[0] == nonce
+
+    # A watched search reports its attempts and finds the same nonce, even
+    # with a single worker
+    reports = []
+    nonce, attempts = parallel_search_nonce(
+        prefix, difficulty=3, workers=1, chunk_size=500, progress=reports.append
+    )
+    assert nonce == expected
+    assert reports == sorted(reports) and reports[-1] == attempts
+
+    # A cancelled search stops without a nonce
+    cancel = threading.Event()
+    cancel.set()
+    nonce, attempts = parallel_search_nonce(
+        prefix, difficulty=8, workers=2, chunk_size=500, cancel=cancel
+    )
+    assert nonce is None and attempts <= 500
+
+
+if __name__ == "__main__":
+    test_mining()
+    test_parallel_search()
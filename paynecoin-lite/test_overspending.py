@@ -4,7 +4,7 @@ from blockchain import Blockchain
 from utils import (
     generate_keys,
     create_transaction,
-    public_key_to_string,
+    public_key_to_address,
 )
 
 
@@ -14,8 +14,8 @@ def test_overspending():
     bob_private, bob_public = generate_keys()
     
     # Convert public keys to strings for transactions
-    alice_pub_str = public_key_to_string(alice_public)
-    bob_pub_str = public_key_to_string(bob_public)
+    alice_pub_str = public_key_to_address(alice_public)
+    bob_pub_str = public_key_to_address(bob_public)
     
     # Genesis transaction: Alice starts with 100 tokens
     tx0 = create_transaction(
@@ -0,0 +1,87 @@
+"""Test that validating a chain in parallel shards finds the same first invalid
+block as validating it block by block"""
+
+import tempfile
+
+from block_store import BlockStore
+from blockchain import Blockchain
+from utils import (
+    generate_keys,
+    create_transaction,
+    public_key_to_address,
+)
+
+
+def check(tx0, chain, expected):
+    """Validate a chain sequentially and in parallel with fresh Blockchains, so
+    nothing is cached from an earlier validation"""
+    sequential = Blockchain(starting_transactions=[tx0])
+    sequential.validate_window = 3
+    assert sequential.valid_chain(chain) == (expected is None)
+    for workers in (1, 2):
+        parallel = Blockchain(starting_transactions=[tx0])
+        parallel.validate_window = 3
+        assert parallel.first_invalid_block(chain, workers) == expected
+        parallel.validate_workers = workers
+        parallel.validate_window = 2
+        assert parallel.valid_chain(chain) == (expected is None)
+
+
+def test_parallel_validation():
+    alice_private, alice_public = generate_keys()
+    bob_private, bob_public = generate_keys()
+    alice = public_key_to_address(alice_public)
+    bob = public_key_to_address(bob_public)
+    tx0 = create_transaction(alice_private, alice, alice, 100)
+    ledger = Blockchain(starting_transactions=[tx0])
+    for i in range(12):
+        ledger.add_transaction(create_transaction(alice_private, alice, bob, 2))
+        ledger.add_transaction(create_transaction(bob_private, bob, alice, 1))
+        ledger.new_block(previous_hash=Blockchain.hash(ledger.chain[-1]))
+    chain = [dict(block) for block in ledger.chain]
+    check(tx0, chain, None)
+
+    # A forged signature
+    forged = create_transaction(bob_private, alice, bob, 1)
+    tampered = list(chain)
+    tampered[9] = dict(chain[9], transactions=[forged])
+    print(f"Forged signature at 9: {ledger.first_invalid_block(tampered, 2)}")
+    check(tx0, tampered, 9)
+
+    # Transactions that do not match the Merkle root
+    tampered = list(chain)
+    tampered[4] = dict(chain[4], transactions=chain[4]["transactions"][:1])
+    check(tx0, tampered, 4)
+
+    # A broken hash link, and a second one further on
+    tampered = list(chain)
+    tampered[7] = dict(chain[7], previous_hash="00" * 32)
+    tampered[11] = dict(chain[11], previous_hash="00" * 32)
+    check(tx0, tampered, 7)
+
+    # A signed and linked overspend, which the next block no longer links to
+    overspend = {
+        "nonce": 0,
+        "index": 6,
+        "timestamp": 123456789,
+        "transactions": [create_transaction(bob_private, bob, alice, 1000)],
+        "previous_hash": Blockchain.hash(chain[5]),
+    }
+    tampered = chain[:6] + [overspend] + chain[7:]
+    check(tx0, tampered, 6)
+
+    # A chain kept in a BlockStore, then extended past the verified blocks
+    with tempfile.TemporaryDirectory() as directory:
+        with BlockStore(directory) as store:
+            for block in ledger.chain:
+                store.append(block)
+            stored = Blockchain(starting_transactions=[], store=store)
+            stored.validate_window = 2
+            assert stored.first_invalid_block(store, 2) is None
+            store.append(dict(overspend, index=13, previous_hash="00" * 32))
+            assert stored.first_invalid_block(store, 2) == 13
+            assert not stored.valid_chain(store)
+
+
+if __name__ == "__main__":
+    test_parallel_validation()
@@ -0,0 +1,69 @@
+"""Test the canonical binary encoding used for hashing and signing"""
+
+import utils
+from serialization import decode, encode
+from utils import (
+    generate_keys,
+    create_transaction,
+    is_from_sender,
+    legacy_transaction_message,
+    public_key_to_address,
+    verify_transactions,
+)
+
+
+def test_round_trip():
+    private_key, public_key = generate_keys()
+    address = public_key_to_address(public_key)
+    tx = create_transaction(private_key, address, address, 10)
+    values = [
+        tx,
+        {k: v for k, v in tx.items() if k != "signature"},
+        dict(tx, amount=2.5, note="float amounts and extra fields"),
+        {"index": 1, "timestamp": 1.5, "previous_hash": "ab" * 32, "merkle_root": "cd" * 32},
+        {"index": 0, "timestamp": 12, "previous_hash": "1", "merkle_root": "cd" * 32},
+        [None, True, False, -1, 2 ** 80, 0.1, "", "ABCD", "abcd", [], {}],
+    ]
+    for value in values:
+        assert decode(encode(value)) == value
+
+    # Values that JSON would confuse encode differently
+    encodings = {encode(value) for value in (1, 1.0, True, "1", "01")}
+    assert len(encodings) == 5
+    assert encode({"b": 1, "a": 2}) == encode({"a": 2, "b": 1})
+    print(f"Signed transaction: {len(encode(tx))} bytes")
+
+
+def test_legacy_signature():
+    private_key, public_key = generate_keys()
+    address = public_key_to_address(public_key)
+
+    # A transaction signed over the JSON message still verifies
+    tx = {"sender": address, "receiver": address, "amount": 5, "timestamp": 0}
+    tx["signature"] = private_key.sign(legacy_transaction_message(tx)).hex()
+    assert is_from_sender(tx)
+    assert not is_from_sender(dict(tx, amount=6))
+    assert verify_transactions([tx, dict(tx, amount=6)]) == [True, False]
+
+    # The JSON message is only built once the binary one fails
+    signed = create_transaction(private_key, address, address, 5)
+    built = []
+
+    def counted(tx):
+        built.append(tx)
+        return legacy_transaction_message(tx)
+
+    utils.legacy_transaction_message = counted
+    try:
+        assert is_from_sender(signed)
+        assert verify_transactions([signed, signed]) == [True, True]
+        assert built == []
+        assert is_from_sender(tx)
+        assert built == [tx]
+    finally:
+        utils.legacy_transaction_message = legacy_transaction_message
+
+
+if __name__ == "__main__":
+    test_round_trip()
+    test_legacy_signature()
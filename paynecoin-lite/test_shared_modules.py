@@ -0,0 +1,34 @@
+"""Test that the modules paynecoin-lite and paynecoin-full share are identical
+
+Both packages run from their own directory, so the modules they share are
+copied in each. A change to one copy must be made to the other.
+"""
+
+import filecmp
+import os
+
+SHARED = [
+    "analytics.py",
+    "block.py",
+    "block_store.py",
+    "chain_export.py",
+    "conftest.py",
+    "mempool.py",
+    "merkle.py",
+    "mining.py",
+    "serialization.py",
+    "snapshot.py",
+]
+
+
+def test_shared_modules():
+    lite = os.path.dirname(os.path.abspath(__file__))
+    full = os.path.join(os.path.dirname(lite), "paynecoin-full")
+    _, mismatch, errors = filecmp.cmpfiles(lite, full, SHARED, shallow=False)
+    print(f"Shared modules: {len(SHARED)}")
+    assert mismatch == [], f"Copies differ: {mismatch}"
+    assert errors == [], f"Copies missing: {errors}"
+
+
+if __name__ == "__main__":
+    test_shared_modules()
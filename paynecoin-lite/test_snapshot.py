@@ -0,0 +1,56 @@
+"""Test that a restarted node restores its balances from a snapshot"""
+
+import os
+import tempfile
+
+from block_store import BlockStore
+from blockchain import Blockchain
+from snapshot import snapshot_heights
+from utils import (
+    generate_keys,
+    create_transaction,
+    public_key_to_address,
+)
+
+
+def test_snapshot():
+    alice_private, alice_public = generate_keys()
+    bob_private, bob_public = generate_keys()
+    alice = public_key_to_address(alice_public)
+    bob = public_key_to_address(bob_public)
+    tx0 = create_transaction(alice_private, alice, alice, 100)
+
+    with tempfile.TemporaryDirectory() as directory:
+        with BlockStore(directory) as store:
+            ledger = Blockchain(starting_transactions=[tx0], store=store)
+            ledger.snapshot_interval = 4
+            for i in range(10):
+                ledger.add_transaction(create_transaction(alice_private, alice, bob, 2))
+                ledger.new_block(previous_hash=Blockchain.hash(ledger.chain[-1]))
+            balances = ledger.get_balances()
+        assert snapshot_heights(directory) == [8, 4]
+
+        # Only the 3 blocks after the newest snapshot are replayed
+        with BlockStore(directory) as store:
+            ledger = Blockchain(starting_transactions=[], store=store)
+            assert ledger.snapshot_height == 8
+            assert ledger.get_balances() == balances == {alice: 80, bob: 20}
+
+        # A corrupt snapshot is skipped
+        with open(os.path.join(directory, "snapshot-000000000008.bin"), "r+b") as file:
+            file.seek(-1, os.SEEK_END)
+            file.write(b"\xff")
+        with BlockStore(directory) as store:
+            ledger = Blockchain(starting_transactions=[], store=store)
+            assert ledger.snapshot_height == 4
+            assert ledger.get_balances() == balances
+
+            # So is a snapshot of blocks that are no longer in the chain
+            store.truncate(3)
+            store.extend([dict(store[-1], timestamp=0), dict(store[-1], timestamp=1)])
+        with BlockStore(directory) as store:
+            assert Blockchain(starting_transactions=[], store=store).snapshot_height == 0
+
+
+if __name__ == "__main__":
+    test_snapshot()
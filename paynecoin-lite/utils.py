@@ -1,9 +1,96 @@
+from collections import OrderedDict
+from hashlib import sha256
 import json
-from time import time
-from cryptography.hazmat.primitives.asymmetric.ed25519 import Ed25519PrivateKey
+from multiprocessing import Pool
+from threading import Lock
+from time import time_ns
+from cryptography.hazmat.primitives.asymmetric.ed25519 import (
+    Ed25519PrivateKey,
+    Ed25519PublicKey,
+)
 from cryptography.hazmat.primitives import serialization
 from cryptography.exceptions import InvalidSignature
 
+from serialization import encode
+
+
+class LRUCache:
+    """A dict-like cache that evicts the least recently used entry when full
+
+    Counts hits, misses and evictions so that its size can be tuned."""
+
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.lock = Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        with self.lock:
+            try:
+                value = self.entries[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def resize(self, maxsize):
+        """Change the maximum number of entries, evicting as needed"""
+        with self.lock:
+            self.maxsize = maxsize
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        """Drop all entries and reset the counters"""
+        with self.lock:
+            self.entries.clear()
+            self.hits = self.misses = self.evictions = 0
+
+    def stats(self):
+        """Return the counters and the current and maximum size"""
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "size": len(self.entries),
+            "maxsize": self.maxsize,
+        }
+
+
+# Parsed public keys, keyed by PEM string or raw 32-byte key
+PUBLIC_KEY_CACHE = LRUCache(maxsize=4096)
+# PEM strings of public key objects, keyed by object id. Entries hold on to the
+# key object so that its id cannot be reused while it is cached.
+PUBLIC_KEY_STRING_CACHE = LRUCache(maxsize=4096)
+
+
+def key_cache_stats():
+    """Return the hit, miss and eviction counters of the public key caches"""
+    return {
+        "parsed": PUBLIC_KEY_CACHE.stats(),
+        "strings": PUBLIC_KEY_STRING_CACHE.stats(),
+    }
+
+
+def set_key_cache_size(maxsize):
+    """Change the maximum number of entries of the public key caches"""
+    PUBLIC_KEY_CACHE.resize(maxsize)
+    PUBLIC_KEY_STRING_CACHE.resize(maxsize)
+
 
 # public/private key generation
 def generate_keys():
@@ -24,17 +111,230 @@ def private_key_to_string(private_key):
     ).decode("latin1")
 
 
+def _cached_key_string(public_key, kind, convert):
+    """Look up or compute a string form of a public key object
+
+    Entries are keyed by object id and kind, see `PUBLIC_KEY_STRING_CACHE`"""
+    cached = PUBLIC_KEY_STRING_CACHE.get((id(public_key), kind))
+    if cached is not None and cached[0] is public_key:
+        return cached[1]
+    key_string = convert(public_key)
+    PUBLIC_KEY_STRING_CACHE.put((id(public_key), kind), (public_key, key_string))
+    return key_string
+
+
 def public_key_to_string(public_key):
-    """Convert a public key to a string"""
-    return public_key.public_bytes(
-        encoding=serialization.Encoding.PEM,
-        format=serialization.PublicFormat.SubjectPublicKeyInfo,
-    ).decode("latin1")
+    """Convert a public key to a (PEM) string
+
+    Conversions are cached per key object, see `PUBLIC_KEY_STRING_CACHE`"""
+    return _cached_key_string(
+        public_key,
+        "pem",
+        lambda key: key.public_bytes(
+            encoding=serialization.Encoding.PEM,
+            format=serialization.PublicFormat.SubjectPublicKeyInfo,
+        ).decode("latin1"),
+    )
 
 
 def string_to_public_key(public_key_string):
-    """Convert a string to a public key"""
-    return serialization.load_pem_public_key(public_key_string.encode("latin1"))
+    """Convert a string to a public key
+
+    Parsed keys are cached, see `PUBLIC_KEY_CACHE`"""
+    public_key = PUBLIC_KEY_CACHE.get(public_key_string)
+    if public_key is None:
+        public_key = serialization.load_pem_public_key(
+            public_key_string.encode("latin1")
+        )
+        PUBLIC_KEY_CACHE.put(public_key_string, public_key)
+    return public_key
+
+
+# Addresses are the hex of the raw 32-byte Ed25519 public key followed by a
+# 4-byte checksum: 72 characters instead of the ~113 of a PEM string
+ADDRESS_KEY_BYTES = 32
+ADDRESS_CHECKSUM_BYTES = 4
+ADDRESS_LENGTH = 2 * (ADDRESS_KEY_BYTES + ADDRESS_CHECKSUM_BYTES)
+
+
+def bytes_to_address(public_key_bytes):
+    """Convert a raw 32-byte Ed25519 public key to an address"""
+    checksum = sha256(public_key_bytes).digest()[:ADDRESS_CHECKSUM_BYTES]
+    return (public_key_bytes + checksum).hex()
+
+
+def address_to_bytes(address):
+    """Convert an address to the raw 32-byte public key, checking its checksum
+
+    Addresses are lowercase hex, so that each key has a single address."""
+    try:
+        data = bytes.fromhex(address)
+    except (TypeError, ValueError):
+        raise ValueError("Invalid address")
+    if len(data) != ADDRESS_KEY_BYTES + ADDRESS_CHECKSUM_BYTES:
+        raise ValueError("Invalid address")
+    public_key_bytes = data[:ADDRESS_KEY_BYTES]
+    if bytes_to_address(public_key_bytes) != address:
+        raise ValueError("Invalid address checksum")
+    return public_key_bytes
+
+
+def is_address(value):
+    """Check whether a value is a well-formed address"""
+    try:
+        address_to_bytes(value)
+        return True
+    except ValueError:
+        return False
+
+
+def public_key_to_address(public_key):
+    """Convert a public key to an address
+
+    Conversions are cached per key object, see `PUBLIC_KEY_STRING_CACHE`"""
+    return _cached_key_string(
+        public_key,
+        "address",
+        lambda key: bytes_to_address(
+            key.public_bytes(
+                encoding=serialization.Encoding.Raw,
+                format=serialization.PublicFormat.Raw,
+            )
+        ),
+    )
+
+
+def address_to_public_key(address):
+    """Convert an address to a public key"""
+    return bytes_to_public_key(address_to_bytes(address))
+
+
+def string_to_address(public_key_string):
+    """Convert a PEM public key string to an address"""
+    return public_key_to_address(string_to_public_key(public_key_string))
+
+
+def address_to_string(address):
+    """Convert an address to a PEM public key string"""
+    return public_key_to_string(address_to_public_key(address))
+
+
+def to_address(key):
+    """Convert a public key, PEM string or address to an address
+    :raise ValueError: If a string is neither a PEM string nor an address"""
+    if isinstance(key, str):
+        if key.startswith("-----BEGIN"):
+            return string_to_address(key)
+        if not is_address(key):
+            raise ValueError("Invalid address")
+        return key
+    return public_key_to_address(key)
+
+
+def sender_public_key(sender):
+    """Load the public key of a transaction sender, an address or PEM string"""
+    if sender.startswith("-----BEGIN"):
+        return string_to_public_key(sender)
+    return address_to_public_key(sender)
+
+
+def bytes_to_public_key(public_key_bytes):
+    """Convert a raw 32-byte Ed25519 public key to a public key
+
+    Parsed keys are cached, see `PUBLIC_KEY_CACHE`"""
+    public_key = PUBLIC_KEY_CACHE.get(public_key_bytes)
+    if public_key is None:
+        public_key = Ed25519PublicKey.from_public_bytes(public_key_bytes)
+        PUBLIC_KEY_CACHE.put(public_key_bytes, public_key)
+    return public_key
+
+
+# Fields a transaction may have: those its signature covers, the signature,
+# and the mark of transactions migrated from PEM strings
+TRANSACTION_FIELDS = {"sender", "receiver", "amount", "timestamp", "signature"}
+MIGRATED_TRANSACTION_FIELDS = TRANSACTION_FIELDS | {"pem_signed"}
+
+
+def has_canonical_fields(tx: dict) -> bool:
+    """
+    Check that a transaction has no field its signature leaves free
+
+    A copy of a signed transaction with an extra field, a "pem_signed" mark
+    set to False or an uppercase signature would still verify, but hash
+    differently, so it would not be recognized as a duplicate.
+    :param tx: The transaction dict
+    :return: <bool>
+    """
+    keys = tx.keys()
+    if keys != TRANSACTION_FIELDS and (
+        keys != MIGRATED_TRANSACTION_FIELDS or tx["pem_signed"] is not True
+    ):
+        return False
+    signature = tx["signature"]
+    return isinstance(signature, str) and signature == signature.lower()
+
+
+def _signed_fields(tx: dict) -> dict:
+    """Collect the fields of a transaction that its signature covers
+
+    Transactions migrated from PEM strings to addresses (see
+    `migrate_transaction`) were signed with PEM strings, which are rebuilt."""
+    sender = tx["sender"]
+    receiver = tx["receiver"]
+    if tx.get("pem_signed"):
+        sender = address_to_string(sender)
+        receiver = address_to_string(receiver)
+    return {
+        "sender": sender,
+        "receiver": receiver,
+        "amount": tx["amount"],
+        "timestamp": tx["timestamp"],
+    }
+
+
+def transaction_message(tx: dict) -> bytes:
+    """
+    Creates the canonical message that is signed for a transaction
+
+    The message is the binary encoding of the signed fields, see
+    `serialization.encode`.
+    :param tx: The transaction dict
+    :return: <bytes> The message
+    """
+    return encode(_signed_fields(tx))
+
+
+def legacy_transaction_message(tx: dict) -> bytes:
+    """
+    Creates the JSON message that transactions were signed with before the
+    binary encoding, still accepted by `is_from_sender`
+    :param tx: The transaction dict
+    :return: <bytes> The message
+    """
+    return json.dumps(_signed_fields(tx), sort_keys=True).encode()
+
+
+def _messages(tx: dict):
+    """Yield the messages a transaction may have been signed with, building the
+    legacy one only when needed: first for migrated transactions, which were
+    signed before the binary encoding, and otherwise once the binary one fails"""
+    if tx.get("pem_signed"):
+        yield legacy_transaction_message(tx)
+        yield transaction_message(tx)
+    else:
+        yield transaction_message(tx)
+        yield legacy_transaction_message(tx)
+
+
+def _verify(public_key_obj, signature, tx) -> bool:
+    """Verify a signature over the binary message, or else the legacy one"""
+    for message in _messages(tx):
+        try:
+            public_key_obj.verify(signature, message)
+            return True
+        except InvalidSignature:
+            continue
+    return False
 
 
 def create_transaction(
@@ -43,31 +343,27 @@ def create_transaction(
     """
     Creates a transaction from a sender's public key to a receiver's public key
 
-    In essence, adds a timestamp and signature to a transaction
+    In essence, adds a timestamp and signature to a transaction. Sender and
+    receiver are stored as addresses (see `public_key_to_address`); PEM strings
+    are converted.
     :param private_key: The Sender's private key
-    :param public_key: The Sender's public key, as a string
-    :param receiver: The Receiver's public key, as a string
+    :param public_key: The Sender's address or public key, as a string
+    :param receiver: The Receiver's address or public key, as a string
     :param amount: The amount in tokens
     :return: <dict> The transaction dict
+    :raise ValueError: If the sender or receiver is neither an address nor a
+        PEM string, see `to_address`
     """
 
     tx = {
-        "sender": public_key,
-        "receiver": receiver,
+        "sender": to_address(public_key),
+        "receiver": to_address(receiver),
         "amount": amount,
-        "timestamp": int(time()),
+        "timestamp": time_ns(),
     }
 
     # Create a canonical message for signing (exclude signature)
-    message = json.dumps(
-        {
-            "sender": tx["sender"],
-            "receiver": tx["receiver"],
-            "amount": tx["amount"],
-            "timestamp": tx["timestamp"],
-        },
-        sort_keys=True,
-    ).encode()
+    message = transaction_message(tx)
 
     # Sign the message with the sender's private key (Ed25519)
     signature_bytes = private_key.sign(message)
@@ -95,26 +391,94 @@ def is_from_sender(tx: dict) -> bool:
     except Exception:
         return False
 
-    # Recreate the canonical message that was signed
+    # Load the public key object and verify signature over the canonical
+    # messages that may have been signed
     try:
-        message = json.dumps(
-            {
-                "sender": tx["sender"],
-                "receiver": tx["receiver"],
-                "amount": tx["amount"],
-                "timestamp": tx["timestamp"],
-            },
-            sort_keys=True,
-        ).encode()
+        public_key_obj = sender_public_key(tx["sender"])
+        return _verify(public_key_obj, signature, tx)
     except Exception:
         return False
 
-    # Load the public key object and verify signature
+
+# Number of signatures a worker process verifies per task
+VERIFY_CHUNK_SIZE = 256
+
+
+def _verify_group(sender, items):
+    """Verify signatures that share a sender, parsing the public key once
+    :param sender: The sender's address or public key, as a string
+    :param items: A list of (position, transaction, signature) tuples
+    :return: A list of (position, result) tuples"""
     try:
-        public_key_obj = string_to_public_key(tx["sender"])
-        public_key_obj.verify(signature, message)
-        return True
-    except InvalidSignature:
-        return False
+        public_key_obj = sender_public_key(sender)
     except Exception:
-        return False
+        return [(position, False) for position, _, _ in items]
+    results = []
+    for position, tx, signature in items:
+        try:
+            results.append((position, _verify(public_key_obj, signature, tx)))
+        except Exception:
+            results.append((position, False))
+    return results
+
+
+def verify_transactions(transactions, workers=1, pool=None) -> list:
+    """
+    Verifies the signatures of many transactions at once
+
+    Transactions are grouped by sender so that each public key is parsed once
+    per group, and the groups are spread over a pool of `workers` processes.
+    :param transactions: An iterable of transaction dicts
+    :param workers: Number of processes to verify with
+    :param pool: A `multiprocessing.Pool` to verify with instead of starting
+        one, for callers verifying many batches
+    :return: <list> One bool per transaction, as `is_from_sender` would return
+    """
+    results = []
+    groups = {}
+    for position, tx in enumerate(transactions):
+        # Malformed transactions fail without reaching the workers
+        results.append(False)
+        try:
+            sender = tx["sender"]
+            signature = bytes.fromhex(tx["signature"])
+        except Exception:
+            continue
+        if isinstance(sender, str):
+            groups.setdefault(sender, []).append((position, tx, signature))
+
+    # Cut large groups so that a busy sender does not land on a single worker
+    tasks = []
+    for sender, items in groups.items():
+        for i in range(0, len(items), VERIFY_CHUNK_SIZE):
+            tasks.append((sender, items[i : i + VERIFY_CHUNK_SIZE]))
+
+    if pool is not None and len(tasks) > 1:
+        verified = pool.starmap(_verify_group, tasks)
+    elif workers > 1 and len(tasks) > 1:
+        with Pool(workers) as pool:
+            verified = pool.starmap(_verify_group, tasks)
+    else:
+        verified = [_verify_group(sender, items) for sender, items in tasks]
+    for group in verified:
+        for position, result in group:
+            results[position] = result
+    return results
+
+
+def migrate_transaction(tx: dict) -> dict:
+    """
+    Converts a transaction with PEM sender and receiver to addresses
+
+    The signature still covers the PEM strings, so the transaction is marked
+    with "pem_signed" and `is_from_sender` rebuilds them to verify it.
+    :param tx: The transaction dict
+    :return: <dict> The migrated transaction dict
+    """
+    if not tx["sender"].startswith("-----BEGIN"):
+        return dict(tx)
+    migrated = dict(tx)
+    migrated["sender"] = string_to_address(tx["sender"])
+    migrated["receiver"] = string_to_address(tx["receiver"])
+    migrated["pem_signed"] = True
+    return migrated